@@ -0,0 +1,247 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from dbpool import get_db_connection, release_db_connection
+from sessions import request_header
+from timing import span
+
+BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR', os.path.join(tempfile.gettempdir(), 'media_blobs'))
+BLOB_STORE_QUOTA = int(os.environ.get('BLOB_STORE_QUOTA_MB', '512')) * 1024 * 1024
+BLOB_THUMBNAIL_SIZE = int(os.environ.get('BLOB_THUMBNAIL_SIZE', '256'))
+BLOB_MAX_BYTES = int(os.environ.get('BLOB_MAX_BYTES', str(20 * 1024 * 1024)))
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+VARIANTS = ('', 'thumb')
+SIGNATURES: List[Tuple[bytes, str]] = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif')
+]
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def is_digest(value: str) -> bool:
+    return bool(DIGEST_PATTERN.match(value))
+
+def sniff_content_type(data: bytes) -> str:
+    """Media type from the leading magic bytes"""
+    for signature, content_type in SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp':
+        return 'video/mp4'
+    return 'application/octet-stream'
+
+def make_thumbnail(data: bytes, size: int) -> Optional[bytes]:
+    """WebP downscaled to fit size x size; None for non-images or when Pillow is not installed"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            out = io.BytesIO()
+            image.save(out, format='WEBP', quality=80)
+            return out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+class BlobStore:
+    '''
+    Content-addressed files on local disk: <root>/<ab>/<cd>/<sha256>[.<variant>].
+    Writes go to a temp file and are renamed into place, so readers never see a
+    partial blob and concurrent writers of the same content are harmless. The total
+    size is kept under quota_bytes by evicting the least recently read files; recency
+    survives restarts as the file mtime, which is read lazily on first use.
+    '''
+
+    def __init__(self, root: str, quota_bytes: int):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, int]' = OrderedDict()
+        self.total = 0
+        self.scanned = False
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0}
+
+    def path(self, digest: str, variant: str = '') -> str:
+        if not is_digest(digest) or variant not in VARIANTS:
+            raise ValueError(f'invalid blob reference {digest!r} {variant!r}')
+        return os.path.join(self.root, digest[:2], digest[2:4], f'{digest}.{variant}' if variant else digest)
+
+    def _scan(self) -> None:
+        if self.scanned:
+            return
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                full = os.path.join(directory, name)
+                try:
+                    stat = os.stat(full)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, full, stat.st_size))
+        for _, full, size in sorted(found):
+            self.entries[full] = size
+            self.total += size
+        self.scanned = True
+
+    def _track(self, path: str, size: int) -> None:
+        if path in self.entries:
+            self.entries.move_to_end(path)
+            return
+        self.entries[path] = size
+        self.total += size
+        while self.total > self.quota_bytes and len(self.entries) > 1:
+            evicted, evicted_size = self.entries.popitem(last=False)
+            self.total -= evicted_size
+            self.stats['evicted'] += 1
+            try:
+                os.remove(evicted)
+            except FileNotFoundError:
+                pass
+
+    def get(self, digest: str, variant: str = '') -> Optional[bytes]:
+        path = self.path(digest, variant)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+        with self.lock:
+            self._scan()
+            self.stats['hits'] += 1
+            self._track(path, len(data))
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, digest: str, data: bytes, variant: str = '') -> None:
+        path = self.path(digest, variant)
+        with self.lock:
+            self._scan()
+            if path in self.entries:
+                self.entries.move_to_end(path)
+                return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+        with self.lock:
+            self.stats['writes'] += 1
+            self._track(path, len(data))
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.stats, 'files': len(self.entries), 'bytes': self.total, 'quotaBytes': self.quota_bytes}
+
+def store_blob(store: BlobStore, content: bytes) -> str:
+    '''
+    Ingest media: local blob store plus its thumbnail, then the durable media_blobs row
+    that any instance can refill its local store from. Returns the SHA-256.
+    '''
+    digest = sha256_hex(content)
+    with span('ingest'):
+        thumbnail = make_thumbnail(content, BLOB_THUMBNAIL_SIZE)
+        store.put(digest, content)
+        if thumbnail is not None:
+            store.put(digest, thumbnail, 'thumb')
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """INSERT INTO media_blobs (sha256, content_type, size, data, thumbnail) VALUES (%s, %s, %s, %s, %s)
+               ON CONFLICT (sha256) DO NOTHING""",
+            (digest, sniff_content_type(content), len(content), content, thumbnail)
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+    return digest
+
+def load_blob(store: BlobStore, digest: str, variant: str = '') -> Optional[bytes]:
+    """Blob bytes from local disk, falling back to media_blobs (and caching the result locally)"""
+    content = store.get(digest, variant)
+    if content is not None:
+        return content
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {'thumbnail' if variant == 'thumb' else 'data'} FROM media_blobs WHERE sha256 = %s",
+            (digest,)
+        )
+        row = cur.fetchone()
+        cur.close()
+    except Exception as e:
+        print(f"[blobs] media_blobs read failed: {e}")
+        return None
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+    if row is None or row[0] is None:
+        return None
+    content = bytes(row[0])
+    store.put(digest, content, variant)
+    return content
+
+def serve_blob(store: BlobStore, event: Dict[str, Any]) -> Dict[str, Any]:
+    """GET ?blob=<sha256>[&variant=thumb]: immutable media; a missing thumbnail falls back to the original"""
+    params = event.get('queryStringParameters') or {}
+    digest = params.get('blob') or ''
+    variant = params.get('variant') or ''
+    content = None
+    if is_digest(digest) and variant in VARIANTS:
+        content = load_blob(store, digest, variant)
+        if content is None and variant:
+            variant = ''
+            content = load_blob(store, digest)
+    if content is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Файл не найден'}),
+            'isBase64Encoded': False
+        }
+
+    etag = f'"{digest}-{variant}"' if variant else f'"{digest}"'
+    response_headers = {
+        'Content-Type': sniff_content_type(content),
+        'Access-Control-Allow-Origin': '*',
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable'
+    }
+    if request_header(event.get('headers') or {}, 'if-none-match') == etag:
+        return {'statusCode': 304, 'headers': response_headers, 'body': '', 'isBase64Encoded': False}
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'body': base64.b64encode(content).decode(),
+        'isBase64Encoded': True
+    }
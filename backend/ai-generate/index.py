@@ -1,162 +1,682 @@
+import atexit
+import base64
+import hashlib
 import json
+import math
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import re
+from collections import OrderedDict
+from urllib.parse import quote
+from blobstore import BLOB_MAX_BYTES, BLOB_STORE_DIR, BLOB_STORE_QUOTA, BlobStore, serve_blob, store_blob
+import dbpool
+from dbpool import db_pool_stats, release_db_connection
+from sessions import get_session_token, request_header, verify_session_token
+from singleflight import single_flight
+from webgen import SITE_PAGE, compress, negotiate_encoding, site_template
+from timing import dumps, instrumented, label, metrics_snapshot, span
 
-try:
-    import requests
-except ImportError:
-    requests = None
+psycopg2: Any = None
+Json: Any = None
+RealDictCursor: Any = None
+execute_values: Any = None
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+def import_psycopg2() -> None:
+    """Import psycopg2 on first database use, so preflights never load it"""
+    global psycopg2, Json, RealDictCursor, execute_values
+    if psycopg2 is None:
+        with span('import'):
+            import psycopg2 as module
+            from psycopg2 import extras
+        Json = extras.Json
+        RealDictCursor = extras.RealDictCursor
+        execute_values = extras.execute_values
+        psycopg2 = module
 
-def generate_text_with_gpt(prompt: str) -> str:
-    """Generate text using OpenAI GPT-4"""
-    if not requests:
+def get_db_connection() -> Any:
+    """Pooled connection, see dbpool.get_db_connection"""
+    import_psycopg2()
+    return dbpool.get_db_connection()
+
+SITE_CACHE_SIZE = int(os.environ.get('SITE_CACHE_SIZE', '1024'))
+SITE_CACHE_TTL = float(os.environ.get('SITE_CACHE_TTL', '60'))
+SITE_RENDER_CACHE_SIZE = int(os.environ.get('SITE_RENDER_CACHE_SIZE', '128'))
+SITE_NAME_PATTERN = re.compile(r'^site-(\d+)-[\w-]*$')
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+_site_cache: 'OrderedDict[str, Tuple[str, Dict[str, Any], float]]' = OrderedDict()
+_rendered_sites: 'OrderedDict[Tuple[str, str], bytes]' = OrderedDict()
+_site_cache_lock = threading.Lock()
+
+def site_etag(row: Dict[str, Any]) -> str:
+    """Validator from template version + params, without rendering the page"""
+    if row['params'] is None:
+        return f'"{hashlib.sha256(row["html_content"].encode()).hexdigest()[:20]}"'
+    return site_template(row['template_version']).etag(**row['params'])
+
+def forget_site(site_name: str) -> None:
+    with _site_cache_lock:
+        _site_cache.pop(site_name, None)
+
+def resolve_site(site_name: str, user_id: int) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """(etag, row) for a site, from the hot-site cache or one indexed lookup"""
+    with _site_cache_lock:
+        entry = _site_cache.get(site_name)
+        if entry is not None and entry[2] > time.monotonic():
+            _site_cache.move_to_end(site_name)
+            return entry[0], entry[1]
+    
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            "SELECT template_version, params, html_content FROM generated_websites WHERE user_id = %s AND site_name = %s",
+            (user_id, site_name)
+        )
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+    if row is None:
+        return None
+    
+    etag = site_etag(row)
+    with _site_cache_lock:
+        _site_cache[site_name] = (etag, row, time.monotonic() + SITE_CACHE_TTL)
+        _site_cache.move_to_end(site_name)
+        while len(_site_cache) > SITE_CACHE_SIZE:
+            _site_cache.popitem(last=False)
+    return etag, row
+
+def site_body(etag: str, row: Dict[str, Any], encoding: str) -> bytes:
+    """Rendered (and compressed) page, cached by ETag so identical params render once"""
+    key = (etag, encoding)
+    with _site_cache_lock:
+        if key in _rendered_sites:
+            _rendered_sites.move_to_end(key)
+            return _rendered_sites[key]
+    
+    if encoding != 'identity':
+        content = compress(site_body(etag, row, 'identity'), encoding)
+    elif row['params'] is None:
+        content = row['html_content'].encode()
+    else:
+        with span('render'):
+            content = site_template(row['template_version']).render(**row['params']).encode()
+    
+    with _site_cache_lock:
+        _rendered_sites[key] = content
+        while len(_rendered_sites) > SITE_RENDER_CACHE_SIZE:
+            _rendered_sites.popitem(last=False)
+    return content
+
+def parse_byte_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """Single byte range as inclusive (start, end); None means full body, ValueError means 416"""
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        suffix = int(match.group(2))
+        if suffix == 0:
+            raise ValueError('empty suffix range')
+        return max(0, length - suffix), length - 1
+    start = int(match.group(1))
+    end = min(int(match.group(2)), length - 1) if match.group(2) else length - 1
+    if start >= length or start > end:
+        raise ValueError('unsatisfiable range')
+    return start, end
+
+def serve_site(event: Dict[str, Any]) -> Dict[str, Any]:
+    """GET ?site=<site_name>: generated page with ETag/304, Accept-Encoding and Range support"""
+    params = event.get('queryStringParameters') or {}
+    site_name = (params.get('site') or '').removesuffix('.html')
+    match = SITE_NAME_PATTERN.match(site_name)
+    if not match:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Сайт не найден'}),
+            'isBase64Encoded': False
+        }
+    
+    headers = event.get('headers') or {}
+    encoding = negotiate_encoding(headers) or 'identity'
+    if_none_match = request_header(headers, 'if-none-match')
+    
+    resolved = resolve_site(site_name, int(match.group(1)))
+    if resolved is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Сайт не найден'}),
+            'isBase64Encoded': False
+        }
+    etag, row = resolved
+    encoded_etag = etag if encoding == 'identity' else f'{etag[:-1]}-{encoding}"'
+    
+    response_headers = {
+        'Content-Type': 'text/html; charset=utf-8',
+        'Access-Control-Allow-Origin': '*',
+        'ETag': encoded_etag,
+        'Vary': 'Accept-Encoding',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=0, must-revalidate'
+    }
+    if encoding != 'identity':
+        response_headers['Content-Encoding'] = encoding
+    
+    if if_none_match == encoded_etag:
+        return {'statusCode': 304, 'headers': response_headers, 'body': '', 'isBase64Encoded': False}
+    
+    content = site_body(etag, row, encoding)
+    if_range = request_header(headers, 'if-range')
+    try:
+        byte_range = parse_byte_range(request_header(headers, 'range'), len(content)) if if_range in (None, encoded_etag) else None
+    except ValueError:
+        return {
+            'statusCode': 416,
+            'headers': {**response_headers, 'Content-Range': f'bytes */{len(content)}'},
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if byte_range is not None:
+        start, end = byte_range
+        return {
+            'statusCode': 206,
+            'headers': {**response_headers, 'Content-Range': f'bytes {start}-{end}/{len(content)}'},
+            'body': base64.b64encode(content[start:end + 1]).decode(),
+            'isBase64Encoded': True
+        }
+    
+    if encoding == 'identity':
+        return {'statusCode': 200, 'headers': response_headers, 'body': content.decode(), 'isBase64Encoded': False}
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'body': base64.b64encode(content).decode(),
+        'isBase64Encoded': True
+    }
+
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+OPENAI_POOL_SIZE = int(os.environ.get('OPENAI_POOL_SIZE', '20'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '3'))
+OPENAI_BACKOFF_BASE = float(os.environ.get('OPENAI_BACKOFF_BASE', '0.5'))
+OPENAI_BACKOFF_MAX = float(os.environ.get('OPENAI_BACKOFF_MAX', '8'))
+# (connect, read) seconds per endpoint
+OPENAI_TIMEOUTS = {
+    'chat/completions': (3.05, 30),
+    'images/generations': (3.05, 60)
+}
+OPENAI_RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+OPENAI_RATE_LIMIT_MODULES = {'chat/completions': 'text', 'images/generations': 'image'}
+
+requests: Any = None
+_requests_imported = False
+_openai_session: Any = None
+_openai_session_lock = threading.Lock()
+
+def import_requests() -> bool:
+    """Import requests on the first upstream call; False when it is not installed"""
+    global requests, _requests_imported
+    if not _requests_imported:
+        try:
+            with span('import'):
+                import requests
+                import requests.adapters
+        except ImportError:
+            requests = None
+        _requests_imported = True
+    return requests is not None
+
+def openai_session() -> Any:
+    """Shared keep-alive session so warm invocations reuse TCP+TLS connections"""
+    global _openai_session
+    if _openai_session is None:
+        import_requests()
+        with _openai_session_lock:
+            if _openai_session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=OPENAI_POOL_SIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _openai_session = session
+    return _openai_session
+
+def openai_retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """Retry-After when the server sends one, otherwise full-jitter exponential backoff"""
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                import email.utils
+                return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+def openai_post(endpoint: str, payload: Dict[str, Any], api_key: str) -> Any:
+    """
+    POST to OpenAI, retrying only failures where the request was not processed:
+    connection errors and 408/409/429/5xx. Read timeouts are not retried.
+    """
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        pace_upstream(OPENAI_RATE_LIMIT_MODULES[endpoint])
+        try:
+            with span('openai'):
+                response = openai_session().post(
+                    f'{OPENAI_BASE_URL}/{endpoint}',
+                    headers={
+                        'Authorization': f'Bearer {api_key}',
+                        'Content-Type': 'application/json'
+                    },
+                    json=payload,
+                    timeout=OPENAI_TIMEOUTS[endpoint]
+                )
+        except requests.ConnectionError:
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            delay = openai_retry_delay(attempt, None)
+        else:
+            if response.status_code not in OPENAI_RETRY_STATUSES or attempt == OPENAI_MAX_RETRIES:
+                return response
+            delay = openai_retry_delay(attempt, response.headers.get('Retry-After'))
+            if delay > OPENAI_BACKOFF_MAX:
+                return response
+            response.close()
+        print(f"[openai] {endpoint} attempt {attempt + 1} failed, retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+GPT_MODEL = 'gpt-4o-mini'
+GPT_SYSTEM_PROMPT = 'Ты DUWDU1 - самая мощная AI в мире. Отвечай кратко, точно и по делу.'
+GPT_TEMPERATURE = 0.7
+GPT_MAX_TOKENS = 1000
+GPT_CACHE_TTL = int(os.environ.get('GPT_CACHE_TTL', '86400'))
+GPT_CACHE_MEMORY_SIZE = int(os.environ.get('GPT_CACHE_MEMORY_SIZE', '512'))
+GPT_CACHE_MAX_ROWS = int(os.environ.get('GPT_CACHE_MAX_ROWS', '100000'))
+GPT_CACHE_PRUNE_INTERVAL = float(os.environ.get('GPT_CACHE_PRUNE_INTERVAL', '600'))
+
+_gpt_cache: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+_gpt_cache_lock = threading.Lock()
+_gpt_cache_stats: Dict[str, int] = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0}
+_gpt_cache_pruned_at = time.monotonic()
+
+def gpt_cache_key(prompt: str) -> str:
+    """Hash of everything that shapes the completion: normalized prompt, model and sampling settings"""
+    normalized = ' '.join(prompt.split()).casefold()
+    material = json.dumps([normalized, GPT_MODEL, GPT_SYSTEM_PROMPT, GPT_TEMPERATURE, GPT_MAX_TOKENS], ensure_ascii=False)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+def _gpt_cache_count(stat: str) -> None:
+    with _gpt_cache_lock:
+        _gpt_cache_stats[stat] += 1
+
+def _gpt_cache_remember(key: str, response: str, ttl: float) -> None:
+    with _gpt_cache_lock:
+        _gpt_cache[key] = (response, time.monotonic() + ttl)
+        _gpt_cache.move_to_end(key)
+        while len(_gpt_cache) > GPT_CACHE_MEMORY_SIZE:
+            _gpt_cache.popitem(last=False)
+            _gpt_cache_stats['evictions'] += 1
+
+def gpt_cache_get(key: str) -> Optional[str]:
+    """In-process LRU first, then the Postgres tier (promoting hits into memory)"""
+    with _gpt_cache_lock:
+        entry = _gpt_cache.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            _gpt_cache.move_to_end(key)
+            _gpt_cache_stats['memory_hits'] += 1
+            return entry[0]
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """SELECT response, EXTRACT(EPOCH FROM expires_at - NOW()) AS ttl
+               FROM gpt_response_cache WHERE cache_key = %s AND expires_at > NOW()""",
+            (key,)
+        )
+        row = cur.fetchone()
+        cur.close()
+    except Exception as e:
+        print(f"[gpt-cache] lookup failed: {e}")
+        row = None
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+    
+    if row is None:
+        _gpt_cache_count('misses')
+        print(f"[gpt-cache] miss, stats={gpt_cache_stats()}")
+        return None
+    _gpt_cache_count('db_hits')
+    _gpt_cache_remember(key, row['response'], float(row['ttl']))
+    return row['response']
+
+def gpt_cache_put(key: str, response: str) -> None:
+    """Store in both tiers; the Postgres tier is pruned to GPT_CACHE_MAX_ROWS now and then"""
+    global _gpt_cache_pruned_at
+    _gpt_cache_remember(key, response, GPT_CACHE_TTL)
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """INSERT INTO gpt_response_cache (cache_key, response, expires_at)
+               VALUES (%s, %s, NOW() + %s * INTERVAL '1 second')
+               ON CONFLICT (cache_key) DO UPDATE SET
+                   response = EXCLUDED.response, created_at = NOW(), expires_at = EXCLUDED.expires_at""",
+            (key, response, GPT_CACHE_TTL)
+        )
+        if time.monotonic() - _gpt_cache_pruned_at >= GPT_CACHE_PRUNE_INTERVAL:
+            _gpt_cache_pruned_at = time.monotonic()
+            cur.execute("DELETE FROM gpt_response_cache WHERE expires_at <= NOW()")
+            cur.execute(
+                """DELETE FROM gpt_response_cache WHERE created_at < (
+                       SELECT created_at FROM gpt_response_cache ORDER BY created_at DESC OFFSET %s LIMIT 1
+                   )""",
+                (GPT_CACHE_MAX_ROWS,)
+            )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[gpt-cache] store failed: {e}")
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+def gpt_cache_stats() -> Dict[str, Any]:
+    with _gpt_cache_lock:
+        stats = {**_gpt_cache_stats, 'memory_size': len(_gpt_cache)}
+    lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 4) if lookups else 0.0
+    return stats
+
+# Per endpoint, each must outlast the slowest generation a claim holder can be in, or
+# another worker takes the claim over and generates a duplicate: every attempt timing
+# out and the longest backoff between attempts (plus, for images, downloading the result)
+FLIGHT_LEASES = {
+    'chat/completions': float(os.environ.get('FLIGHT_LEASE_TEXT', str(
+        (OPENAI_MAX_RETRIES + 1) * sum(OPENAI_TIMEOUTS['chat/completions'])
+        + OPENAI_MAX_RETRIES * OPENAI_BACKOFF_MAX + 5
+    ))),
+    'images/generations': float(os.environ.get('FLIGHT_LEASE_IMAGE', str(
+        (OPENAI_MAX_RETRIES + 2) * sum(OPENAI_TIMEOUTS['images/generations'])
+        + OPENAI_MAX_RETRIES * OPENAI_BACKOFF_MAX + 30
+    )))
+}
+# How long a request waits for another worker's generation before generating itself;
+# this wait plus one generation has to fit in the function timeout. Job workers,
+# which run on a longer budget, wait for the whole lease instead.
+FLIGHT_WAIT = float(os.environ.get('FLIGHT_WAIT', '20'))
+FLIGHT_POLL_INTERVAL = float(os.environ.get('FLIGHT_POLL_INTERVAL', '0.25'))
+FLIGHT_RESULT_TTL = int(os.environ.get('FLIGHT_RESULT_TTL', '300'))
+
+def _claim_flight(key: str, lease: float) -> Tuple[bool, Optional[str]]:
+    """
+    (claimed, result): claim the generation_flights row for this worker, or read the
+    result another worker left there. Abandoned claims (older than lease) and
+    stale results (older than FLIGHT_RESULT_TTL) are taken over.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute(
+            """INSERT INTO generation_flights (flight_key) VALUES (%s)
+               ON CONFLICT (flight_key) DO UPDATE SET claimed_at = NOW(), result = NULL, completed_at = NULL
+               WHERE (generation_flights.completed_at IS NULL
+                      AND generation_flights.claimed_at < NOW() - %s * INTERVAL '1 second')
+                  OR generation_flights.completed_at < NOW() - %s * INTERVAL '1 second'
+               RETURNING flight_key""",
+            (key, lease, FLIGHT_RESULT_TTL)
+        )
+        claimed = cur.fetchone() is not None
+        result = None
+        if not claimed:
+            cur.execute("SELECT result FROM generation_flights WHERE flight_key = %s", (key,))
+            row = cur.fetchone()
+            result = row['result'] if row else None
+        conn.commit()
+        return claimed, result
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def _finish_flight(key: str, result: Optional[str]) -> None:
+    """Publish a result for waiting workers, or drop the claim so one of them can retry"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        if result is None:
+            cur.execute("DELETE FROM generation_flights WHERE flight_key = %s", (key,))
+        else:
+            cur.execute(
+                "UPDATE generation_flights SET result = %s, completed_at = NOW() WHERE flight_key = %s",
+                (result, key)
+            )
+        cur.execute(
+            "DELETE FROM generation_flights WHERE completed_at < NOW() - %s * INTERVAL '1 second'",
+            (FLIGHT_RESULT_TTL,)
+        )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[flight] finishing {key[:12]} failed: {e}")
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+def coalesced(key: str, endpoint: str, fn: Callable[[], Tuple[str, bool]], wait: float = FLIGHT_WAIT) -> Tuple[str, bool]:
+    """
+    Single-flight generation across requests and instances. fn returns (result, ok);
+    only ok results are shared with other workers. Claims on `endpoint` expire after
+    its FLIGHT_LEASES entry. If the database is unavailable, or another worker's claim
+    is still running after `wait` seconds, the caller generates on its own.
+    """
+    lease = FLIGHT_LEASES[endpoint]
+    
+    def run() -> Tuple[str, bool]:
+        deadline = time.monotonic() + min(wait, lease)
+        while True:
+            try:
+                claimed, result = _claim_flight(key, lease)
+            except Exception as e:
+                print(f"[flight] claim {key[:12]} failed, generating locally: {e}")
+                return fn()
+            if result is not None:
+                return result, True
+            if claimed:
+                break
+            if time.monotonic() >= deadline:
+                return fn()
+            time.sleep(FLIGHT_POLL_INTERVAL)
+        
+        result, ok = None, False
+        try:
+            result, ok = fn()
+            return result, ok
+        finally:
+            _finish_flight(key, result if ok else None)
+    
+    return single_flight(key, run)
+
+GPT_SYSTEM_MESSAGE = {'role': 'system', 'content': GPT_SYSTEM_PROMPT}
+
+def gpt_payload(prompt: str) -> Dict[str, Any]:
+    return {
+        'model': GPT_MODEL,
+        'messages': [
+            GPT_SYSTEM_MESSAGE,
+            {'role': 'user', 'content': prompt}
+        ],
+        'max_tokens': GPT_MAX_TOKENS,
+        'temperature': GPT_TEMPERATURE
+    }
+
+def generate_text_with_gpt(prompt: str, use_cache: bool = True) -> str:
+    """Generate text using OpenAI GPT-4, answering repeated prompts from the response cache"""
+    if not import_requests():
         return f"⚠️ Модуль requests недоступен.\n\nОтвет в демо-режиме:\n{prompt}"
     
     api_key = os.environ.get('OPENAI_API_KEY')
     if not api_key:
         return f"⚠️ Ключ OpenAI не настроен.\n\nОтвет в демо-режиме:\n{prompt}\n\nДобавьте OPENAI_API_KEY в секреты проекта для реальных ответов GPT-4."
     
+    cache_key = gpt_cache_key(prompt)
+    if not use_cache:
+        _gpt_cache_count('bypassed')
+        return _complete_text(prompt, cache_key, api_key)[0]
+    
+    cached = gpt_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    return coalesced(cache_key, 'chat/completions', lambda: _complete_text(prompt, cache_key, api_key))[0]
+
+def _complete_text(prompt: str, cache_key: str, api_key: str) -> Tuple[str, bool]:
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': 'gpt-4o-mini',
-                'messages': [
-                    {'role': 'system', 'content': 'Ты DUWDU1 - самая мощная AI в мире. Отвечай кратко, точно и по делу.'},
-                    {'role': 'user', 'content': prompt}
-                ],
-                'max_tokens': 1000,
-                'temperature': 0.7
-            },
-            timeout=30
-        )
+        response = openai_post('chat/completions', gpt_payload(prompt), api_key)
         
         if response.status_code == 200:
             data = response.json()
-            return data['choices'][0]['message']['content']
+            text = data['choices'][0]['message']['content']
+            gpt_cache_put(cache_key, text)
+            return text, True
         else:
-            return f"❌ Ошибка GPT-4 (код {response.status_code}). Попробуйте позже."
+            return f"❌ Ошибка GPT-4 (код {response.status_code}). Попробуйте позже.", False
     
     except Exception as e:
-        return f"❌ Ошибка подключения к GPT-4: {str(e)}"
+        return f"❌ Ошибка подключения к GPT-4: {str(e)}", False
 
-def generate_image_with_dalle(prompt: str) -> str:
+def generate_image_with_dalle(prompt: str, use_cache: bool = True) -> str:
     """Generate image using OpenAI DALL-E"""
-    if not requests:
-        return "⚠️ Модуль requests недоступен для генерации изображений."
+    result, ok = request_dalle_image(prompt, use_cache)
+    if not ok:
+        return result
+    return generate_image_message(prompt, result)
+
+def generate_image_message(prompt: str, image_url: str) -> str:
+    return f"✅ Изображение создано!\n\n🖼️ Ссылка: {image_url}\n\n📝 Описание: {prompt}\n\n💡 Кликните по ссылке, чтобы посмотреть результат!"
+
+def request_dalle_image(prompt: str, use_cache: bool = True, wait: float = FLIGHT_WAIT) -> Tuple[str, bool]:
+    """
+    (image URL, True) or (error message, False). Images are ingested into the blob
+    store, so the URL is ours and does not expire; a repeated prompt is answered from
+    generated_images without calling DALL-E. use_cache=False skips both that lookup
+    and coalescing, so the caller always gets a fresh generation. wait bounds how long
+    an identical generation in flight elsewhere is waited for, see coalesced.
+    """
+    if not import_requests():
+        return "⚠️ Модуль requests недоступен для генерации изображений.", False
     
     api_key = os.environ.get('OPENAI_API_KEY')
     if not api_key:
-        return "⚠️ Добавьте OPENAI_API_KEY в секреты для генерации изображений.\n\nФото будет создано через DALL-E 3 после настройки ключа."
+        return "⚠️ Добавьте OPENAI_API_KEY в секреты для генерации изображений.\n\nФото будет создано через DALL-E 3 после настройки ключа.", False
     
+    payload = {
+        'model': 'dall-e-3',
+        'prompt': prompt,
+        'n': 1,
+        'size': '1024x1024',
+        'quality': 'standard',
+        'response_format': 'b64_json'
+    }
+    normalized = ' '.join(prompt.split()).casefold()
+    flight_key = hashlib.sha256(json.dumps([normalized, {**payload, 'prompt': None}], sort_keys=True).encode()).hexdigest()
+    if not use_cache:
+        return _generate_image(payload, api_key, flight_key)
+    digest = generated_image(flight_key)
+    if digest is not None:
+        return blob_url(digest), True
+    return coalesced(flight_key, 'images/generations', lambda: _generate_image(payload, api_key, flight_key), wait)
+
+def _generate_image(payload: Dict[str, Any], api_key: str, request_key: str) -> Tuple[str, bool]:
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/images/generations',
-            headers={
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': 'dall-e-3',
-                'prompt': prompt,
-                'n': 1,
-                'size': '1024x1024',
-                'quality': 'standard'
-            },
-            timeout=60
-        )
+        response = openai_post('images/generations', payload, api_key)
         
         if response.status_code == 200:
-            data = response.json()
-            image_url = data['data'][0]['url']
-            return f"✅ Изображение создано!\n\n🖼️ Ссылка: {image_url}\n\n📝 Описание: {prompt}\n\n💡 Кликните по ссылке, чтобы посмотреть результат!"
+            image = response.json()['data'][0]
+            if 'b64_json' in image:
+                content = base64.b64decode(image['b64_json'])
+            else:
+                content = download_media(image['url'])
+            digest = store_blob(blob_store, content)
+            remember_generated_image(request_key, digest)
+            return blob_url(digest), True
         else:
-            return f"❌ Ошибка DALL-E (код {response.status_code}). Попробуйте позже."
+            return f"❌ Ошибка DALL-E (код {response.status_code}). Попробуйте позже.", False
     
     except Exception as e:
-        return f"❌ Ошибка генерации: {str(e)}"
+        return f"❌ Ошибка генерации: {str(e)}", False
+
+BLOB_PUBLIC_URL = os.environ.get('BLOB_PUBLIC_URL', 'https://functions.poehali.dev/8c6fc2c7-6263-44fa-bff3-a2d7fe94a4d3').rstrip('/')
+
+blob_store = BlobStore(BLOB_STORE_DIR, BLOB_STORE_QUOTA)
+
+def blob_url(digest: str, variant: str = '') -> str:
+    return f'{BLOB_PUBLIC_URL}?blob={digest}' + (f'&variant={variant}' if variant else '')
+
+def download_media(url: str) -> bytes:
+    """Fetch an external asset once for ingest, refusing anything over BLOB_MAX_BYTES"""
+    with span('download'):
+        response = openai_session().get(url, timeout=OPENAI_TIMEOUTS['images/generations'], stream=True)
+        try:
+            response.raise_for_status()
+            content = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) > BLOB_MAX_BYTES:
+                    raise ValueError(f'media larger than {BLOB_MAX_BYTES} bytes')
+            return bytes(content)
+        finally:
+            response.close()
+
+def generated_image(request_key: str) -> Optional[str]:
+    """Blob hash of an image already generated for this normalized prompt and payload"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT blob_sha256 FROM generated_images WHERE request_key = %s", (request_key,))
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"[blobs] generated image lookup failed: {e}")
+        return None
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+def remember_generated_image(request_key: str, digest: str) -> None:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """INSERT INTO generated_images (request_key, blob_sha256) VALUES (%s, %s)
+               ON CONFLICT (request_key) DO UPDATE SET blob_sha256 = EXCLUDED.blob_sha256, created_at = NOW()""",
+            (request_key, digest)
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+
+SITE_PUBLIC_URL = os.environ.get('SITE_PUBLIC_URL', 'https://functions.poehali.dev/8c6fc2c7-6263-44fa-bff3-a2d7fe94a4d3').rstrip('/')
+SITE_NAME_UNSAFE = re.compile(r'[^a-zа-яё0-9\s]', re.IGNORECASE)
+SITE_NAME_SPACES = re.compile(r'\s+')
 
 def generate_website(prompt: str, user_id: int) -> str:
     """Generate website and return URL"""
-    safe_name = re.sub(r'[^a-zа-яё0-9\s]', '', prompt.lower(), flags=re.IGNORECASE)
-    safe_name = re.sub(r'\s+', '-', safe_name.strip())[:50]
-    
-    html_content = f'''<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{prompt}</title>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: white;
-            padding: 20px;
-        }}
-        .container {{
-            max-width: 800px;
-            background: rgba(255,255,255,0.1);
-            backdrop-filter: blur(10px);
-            padding: 60px 40px;
-            border-radius: 20px;
-            box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-            text-align: center;
-            animation: slideIn 0.6s ease-out;
-        }}
-        h1 {{
-            font-size: 3em;
-            margin-bottom: 20px;
-            text-shadow: 0 2px 10px rgba(0,0,0,0.3);
-        }}
-        p {{
-            font-size: 1.2em;
-            line-height: 1.6;
-            opacity: 0.9;
-            margin-bottom: 30px;
-        }}
-        .badge {{
-            display: inline-block;
-            padding: 10px 20px;
-            background: rgba(255,255,255,0.2);
-            border-radius: 50px;
-            font-size: 0.9em;
-            margin: 10px 5px;
-        }}
-        @keyframes slideIn {{
-            from {{ opacity: 0; transform: translateY(30px); }}
-            to {{ opacity: 1; transform: translateY(0); }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>{prompt}</h1>
-        <p>Сайт создан AI-платформой DUWDU1 за 2 секунды</p>
-        <div class="badge">🚀 Адаптивный дизайн</div>
-        <div class="badge">⚡ Быстрая загрузка</div>
-        <div class="badge">🎨 Современный UI</div>
-        <p style="margin-top: 40px; opacity: 0.7; font-size: 0.9em;">
-            Powered by DUWDU1 Neural Network
-        </p>
-    </div>
-</body>
-</html>'''
+    safe_name = SITE_NAME_UNSAFE.sub('', prompt.lower())
+    safe_name = SITE_NAME_SPACES.sub('-', safe_name.strip())[:50]
     
     try:
         website_id = f"site-{user_id}-{safe_name}"
@@ -166,13 +686,19 @@ def generate_website(prompt: str, user_id: int) -> str:
         
         try:
             cur.execute(
-                "INSERT INTO generated_websites (user_id, site_name, html_content) VALUES (%s, %s, %s) ON CONFLICT (user_id, site_name) DO UPDATE SET html_content = EXCLUDED.html_content, created_at = NOW() RETURNING id",
-                (user_id, website_id, html_content)
+                """INSERT INTO generated_websites (user_id, site_name, template_version, params)
+                   VALUES (%s, %s, %s, %s)
+                   ON CONFLICT (user_id, site_name) DO UPDATE SET
+                       template_version = EXCLUDED.template_version, params = EXCLUDED.params,
+                       html_content = NULL, created_at = NOW()
+                   RETURNING id""",
+                (user_id, website_id, SITE_PAGE.version, Json({'prompt': prompt}))
             )
             site_id = cur.fetchone()['id']
             conn.commit()
+            forget_site(website_id)
             
-            site_url = f"https://duwdu1-sites.poehali.dev/{website_id}.html"
+            site_url = f"{SITE_PUBLIC_URL}?site={quote(website_id)}"
             
             return f'''✅ Сайт "{prompt}" создан успешно!
 
@@ -193,78 +719,759 @@ def generate_website(prompt: str, user_id: int) -> str:
         
         finally:
             cur.close()
-            conn.close()
+            release_db_connection(conn)
     
     except Exception as e:
         return f"❌ Ошибка создания сайта: {str(e)}"
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+def video_placeholder(prompt: str) -> str:
+    return f'''🎬 Генерация видео
+
+⚠️ Видео-генерация требует отдельного API (Runway, Pika Labs и др.)
+
+📝 Ваш запрос: {prompt}
+
+💡 Для активации видео-генерации свяжитесь с администратором.
+
+Пока доступна генерация изображений через DALL-E 3!'''
+
+AI_REQUEST_ID_BLOCK = int(os.environ.get('AI_REQUEST_ID_BLOCK', '100'))
+AI_REQUESTS_FLUSH_INTERVAL = float(os.environ.get('AI_REQUESTS_FLUSH_INTERVAL', '1'))
+AI_REQUESTS_FLUSH_SIZE = int(os.environ.get('AI_REQUESTS_FLUSH_SIZE', '200'))
+AI_REQUESTS_SPILL_PATH = os.environ.get('AI_REQUESTS_SPILL_PATH', os.path.join(tempfile.gettempdir(), 'ai_requests_spill.jsonl'))
+AI_REQUESTS_DEAD_LETTER_PATH = os.environ.get('AI_REQUESTS_DEAD_LETTER_PATH', AI_REQUESTS_SPILL_PATH + '.rejected')
+
+_request_ids: List[int] = []
+_request_ids_lock = threading.Lock()
+_request_ids_failed_at = float('-inf')
+_ai_requests: List[Tuple[Optional[int], int, str, str, str, datetime]] = []
+_ai_requests_lock = threading.Lock()
+_ai_requests_flush_lock = threading.Lock()
+_ai_requests_flushed_at = float('-inf')
+
+def reserve_request_ids(count: int) -> List[Optional[int]]:
+    """
+    ai_requests ids from a block pre-allocated off the sequence, refilled with one
+    round trip per AI_REQUEST_ID_BLOCK requests. None when the database is down
+    (retried at most once per flush interval); those entries get ids when flushed.
+    """
+    global _request_ids_failed_at
+    with _request_ids_lock:
+        if len(_request_ids) < count and time.monotonic() - _request_ids_failed_at >= AI_REQUESTS_FLUSH_INTERVAL:
+            conn = None
+            try:
+                conn = get_db_connection()
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT nextval(pg_get_serial_sequence('ai_requests', 'id')) FROM generate_series(1, %s)",
+                    (max(AI_REQUEST_ID_BLOCK, count - len(_request_ids)),)
+                )
+                _request_ids.extend(row[0] for row in cur.fetchall())
+                conn.commit()
+                cur.close()
+            except Exception as e:
+                _request_ids_failed_at = time.monotonic()
+                print(f"[ai-requests] id block allocation failed: {e}")
+            finally:
+                if conn is not None:
+                    release_db_connection(conn)
+        taken = _request_ids[:count]
+        del _request_ids[:count]
+    return taken + [None] * (count - len(taken))
+
+def log_ai_requests(user_id: int, rows: List[Tuple[str, str, str]]) -> List[Optional[int]]:
+    """Buffer (module_type, prompt, response) rows until the next due flush; ids follow row order"""
+    ids = reserve_request_ids(len(rows))
+    created_at = datetime.now(timezone.utc)
+    # Postgres text cannot hold NUL; psycopg2 would reject the row on every flush
+    rows = [tuple(value.replace('\x00', '') if isinstance(value, str) else value for value in row) for row in rows]
+    with _ai_requests_lock:
+        _ai_requests.extend((request_id, user_id, *row, created_at) for request_id, row in zip(ids, rows))
+    return ids
+
+def log_ai_request(user_id: int, module_type: str, prompt: str, response_text: str) -> Optional[int]:
+    return log_ai_requests(user_id, [(module_type, prompt, response_text)])[0]
+
+def _read_spill() -> List[Tuple[Optional[int], int, str, str, str, datetime]]:
+    entries = []
+    with open(AI_REQUESTS_SPILL_PATH) as f:
+        for line in f:
+            try:
+                request_id, user_id, module_type, prompt, response_text, created_at = json.loads(line)
+            except ValueError:
+                continue
+            entries.append((request_id, user_id, module_type, prompt, response_text, datetime.fromisoformat(created_at)))
+    return entries
+
+def _spill_line(entry: Tuple[Optional[int], int, str, str, str, datetime]) -> str:
+    request_id, user_id, module_type, prompt, response_text, created_at = entry
+    return json.dumps([request_id, user_id, module_type, prompt, response_text, created_at.isoformat()], ensure_ascii=False) + '\n'
+
+def _write_spill(entries: List[Tuple[Optional[int], int, str, str, str, datetime]]) -> None:
+    """Rewrite the spill file atomically with every entry still waiting for the database"""
+    with open(AI_REQUESTS_SPILL_PATH + '.tmp', 'w') as f:
+        f.writelines(_spill_line(entry) for entry in entries)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(AI_REQUESTS_SPILL_PATH + '.tmp', AI_REQUESTS_SPILL_PATH)
+
+def _reject_ai_requests(entries: List[Tuple[Optional[int], int, str, str, str, datetime]], error: Exception) -> None:
+    """Set aside rows the database refuses (bad data, missing user) so they never block a flush again"""
+    print(f"[ai-requests] rejecting {len(entries)} entries ids={[entry[0] for entry in entries]}: {error}")
+    with open(AI_REQUESTS_DEAD_LETTER_PATH, 'a') as f:
+        f.writelines(_spill_line(entry) for entry in entries)
+
+def _insert_ai_requests(conn: Any, entries: List[Tuple[Optional[int], int, str, str, str, datetime]]) -> int:
+    """
+    Insert entries in one statement. When the database rejects a row's data the batch
+    is split in halves and retried until the offending rows are isolated and set aside;
+    connection errors propagate so the caller spills the batch for a later retry.
+    """
+    try:
+        cur = conn.cursor()
+        execute_values(
+            cur,
+            """INSERT INTO ai_requests (id, user_id, module_type, prompt, response, created_at)
+               VALUES %s ON CONFLICT DO NOTHING""",
+            entries,
+            page_size=1000
+        )
+        conn.commit()
+        cur.close()
+        return len(entries)
+    except (ValueError, psycopg2.DataError, psycopg2.IntegrityError) as e:
+        conn.rollback()
+        if len(entries) == 1:
+            _reject_ai_requests(entries, e)
+            return 0
+        middle = len(entries) // 2
+        return _insert_ai_requests(conn, entries[:middle]) + _insert_ai_requests(conn, entries[middle:])
+
+def flush_ai_requests(force: bool = True) -> int:
+    """
+    Write buffered entries (and any spilled by earlier failures) with one multi-row
+    INSERT. ON CONFLICT DO NOTHING makes replaying a spill that was partly written
+    safe. If the database is unavailable the batch is appended to the spill file;
+    rows the database rejects are moved to AI_REQUESTS_DEAD_LETTER_PATH instead.
+    The spill file defaults to the instance's temp directory, so it only carries rows
+    across a database outage while the instance lives; point AI_REQUESTS_SPILL_PATH at
+    mounted storage if they must survive the instance.
+    
+    The handler calls this with force=False before returning, which writes only once
+    AI_REQUESTS_FLUSH_INTERVAL has passed since the last flush or AI_REQUESTS_FLUSH_SIZE
+    entries are waiting, and skips the flush if another request is already writing.
+    Nothing runs between invocations (the runtime may freeze or stop the instance then),
+    so at most one interval of rows is held in memory.
+    """
+    global _ai_requests_flushed_at
+    if not _ai_requests_flush_lock.acquire(blocking=force):
+        return 0
+    try:
+        with _ai_requests_lock:
+            due = (
+                force
+                or len(_ai_requests) >= AI_REQUESTS_FLUSH_SIZE
+                or time.monotonic() - _ai_requests_flushed_at >= AI_REQUESTS_FLUSH_INTERVAL
+            )
+            if not due:
+                return 0
+            pending = _ai_requests[:]
+            del _ai_requests[:]
+            _ai_requests_flushed_at = time.monotonic()
+        spilled = os.path.exists(AI_REQUESTS_SPILL_PATH)
+        if spilled:
+            pending = _read_spill() + pending
+        if not pending:
+            return 0
+        
+        conn = None
+        try:
+            conn = get_db_connection()
+            missing = sum(1 for entry in pending if entry[0] is None)
+            if missing:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT nextval(pg_get_serial_sequence('ai_requests', 'id')) FROM generate_series(1, %s)",
+                    (missing,)
+                )
+                fresh = iter([row[0] for row in cur.fetchall()])
+                pending = [(entry[0] if entry[0] is not None else next(fresh), *entry[1:]) for entry in pending]
+                cur.close()
+            written = _insert_ai_requests(conn, pending)
+            if spilled:
+                os.remove(AI_REQUESTS_SPILL_PATH)
+            return written
+        except Exception as e:
+            print(f"[ai-requests] flush failed, spilling {len(pending)} entries: {e}")
+            _write_spill(pending)
+            return 0
+        finally:
+            if conn is not None:
+                release_db_connection(conn)
+    finally:
+        _ai_requests_flush_lock.release()
+
+atexit.register(flush_ai_requests)
+
+RATE_LIMIT_COSTS = {'text': 1, 'image': 10}
+RATE_LIMIT_USER_CAPACITY = float(os.environ.get('RATE_LIMIT_USER_CAPACITY', '30'))
+RATE_LIMIT_USER_REFILL = float(os.environ.get('RATE_LIMIT_USER_REFILL', '0.5'))
+RATE_LIMIT_GLOBAL_REFILL = float(os.environ.get('RATE_LIMIT_GLOBAL_REFILL', '50'))
+RATE_LIMIT_GLOBAL_BURST = float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', '1'))
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', '2'))
+RATE_LIMIT_SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL', '1'))
+RATE_LIMIT_IDLE = 60.0
+RATE_LIMIT_GLOBAL_USER = 0
+
+class TokenBucket:
     '''
-    Business: Generate AI content using real APIs (GPT-4, DALL-E, website hosting)
-    Args: event with httpMethod, body containing userId, moduleType, prompt
-    Returns: HTTP response with generated content or URLs
+    Local view of a shared bucket. `spent` is what this instance consumed since the
+    last sync; the sync charges it against the shared row and adopts the result.
     '''
-    method: str = event.get('httpMethod', 'GET')
+    __slots__ = ('capacity', 'refill', 'tokens', 'updated_at', 'spent', 'synced')
     
-    if method == 'OPTIONS':
+    def __init__(self, capacity: float, refill: float):
+        self.capacity = capacity
+        self.refill = refill
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.spent = 0.0
+        self.synced = False
+    
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until `cost` tokens are available (0 when they are)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill)
+        self.updated_at = now
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.refill
+    
+    def take(self, cost: float) -> None:
+        self.tokens -= cost
+        self.spent += cost
+
+_buckets: Dict[Tuple[int, str], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+_rate_limits_synced_at = float('-inf')
+_rate_limit_sync_lock = threading.Lock()
+
+def _bucket(user_id: int, module: str) -> TokenBucket:
+    bucket = _buckets.get((user_id, module))
+    if bucket is None:
+        if user_id == RATE_LIMIT_GLOBAL_USER:
+            bucket = TokenBucket(RATE_LIMIT_GLOBAL_REFILL * RATE_LIMIT_GLOBAL_BURST, RATE_LIMIT_GLOBAL_REFILL)
+        else:
+            bucket = TokenBucket(RATE_LIMIT_USER_CAPACITY, RATE_LIMIT_USER_REFILL)
+        _buckets[(user_id, module)] = bucket
+    return bucket
+
+def rate_limit_module(module_type: str, options: Dict[str, Any]) -> str:
+    if module_type == 'media':
+        return options.get('mediaType', 'image')
+    return module_type
+
+def admit(user_id: int, module: str, check_backlog: bool = True) -> float:
+    """
+    In-memory admission against the caller's (user, module) bucket. With
+    check_backlog, requests are also refused while the module's upstream pacing
+    queue (see pace_upstream) is longer than RATE_LIMIT_MAX_WAIT. Returns 0 when
+    admitted, otherwise the seconds to wait before retrying.
+    """
+    cost = RATE_LIMIT_COSTS.get(module, 0)
+    if not cost:
+        return 0.0
+    sync_rate_limits(force=False)
+    now = time.monotonic()
+    with _buckets_lock:
+        bucket = _bucket(user_id, module)
+        wait = bucket.wait_time(cost, now)
+        if check_backlog:
+            backlog = _bucket(RATE_LIMIT_GLOBAL_USER, module).wait_time(cost, now) - RATE_LIMIT_MAX_WAIT
+            wait = max(wait, backlog)
+        if wait <= 0:
+            bucket.take(cost)
+            return 0.0
+        return wait
+
+def pace_upstream(module: str) -> None:
+    """
+    Reserve the module's next upstream slot from the global bucket and sleep until it
+    is due, so provider traffic stays at RATE_LIMIT_GLOBAL_REFILL cost units per second
+    with bursts no larger than RATE_LIMIT_GLOBAL_BURST seconds of it.
+    """
+    cost = RATE_LIMIT_COSTS.get(module, 0)
+    if not cost:
+        return
+    sync_rate_limits(force=False)
+    with _buckets_lock:
+        bucket = _bucket(RATE_LIMIT_GLOBAL_USER, module)
+        wait = bucket.wait_time(cost, time.monotonic())
+        bucket.take(cost)
+    if wait > 0:
+        time.sleep(wait)
+
+def sync_rate_limits(force: bool = True) -> None:
+    """
+    Without force, runs at most once per RATE_LIMIT_SYNC_INTERVAL and only if no other
+    thread is syncing: admit and pace_upstream call it that way, so requests keep the
+    shared buckets current without a background thread.
+    """
+    global _rate_limits_synced_at
+    if not force and time.monotonic() - _rate_limits_synced_at < RATE_LIMIT_SYNC_INTERVAL:
+        return
+    if not _rate_limit_sync_lock.acquire(blocking=force):
+        return
+    try:
+        _rate_limits_synced_at = time.monotonic()
+        _sync_rate_limits()
+    finally:
+        _rate_limit_sync_lock.release()
+
+def _sync_rate_limits() -> None:
+    """
+    One batched upsert: refill every touched shared bucket for the time since its
+    last update, charge what this instance spent, and adopt the result.
+    Idle full buckets are dropped from memory.
+    """
+    now = time.monotonic()
+    with _buckets_lock:
+        for key in [key for key, bucket in _buckets.items()
+                    if bucket.synced and not bucket.spent and now - bucket.updated_at > RATE_LIMIT_IDLE]:
+            del _buckets[key]
+        snapshot = [(key, bucket.spent) for key, bucket in _buckets.items() if bucket.spent or not bucket.synced]
+        rows = [(user_id, module, _buckets[(user_id, module)].capacity - spent,
+                 _buckets[(user_id, module)].capacity, _buckets[(user_id, module)].refill)
+                for (user_id, module), spent in snapshot]
+    if not rows:
+        return
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        shared = execute_values(
+            cur,
+            """INSERT INTO rate_limit_buckets AS b (user_id, module, tokens, capacity, refill)
+               VALUES %s
+               ON CONFLICT (user_id, module) DO UPDATE SET
+                   tokens = LEAST(
+                       EXCLUDED.capacity,
+                       b.tokens + EXCLUDED.refill * EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at)
+                   ) - (EXCLUDED.capacity - EXCLUDED.tokens),
+                   capacity = EXCLUDED.capacity,
+                   refill = EXCLUDED.refill,
+                   updated_at = clock_timestamp()
+               RETURNING user_id, module, tokens""",
+            rows,
+            page_size=len(rows),
+            fetch=True
+        )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[rate-limit] sync failed, deciding locally: {e}")
+        return
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+    
+    spent_at_snapshot = dict(snapshot)
+    now = time.monotonic()
+    with _buckets_lock:
+        for user_id, module, tokens in shared:
+            bucket = _buckets.get((user_id, module))
+            if bucket is None:
+                continue
+            bucket.spent -= spent_at_snapshot.get((user_id, module), 0.0)
+            bucket.tokens = tokens - bucket.spent
+            bucket.updated_at = now
+            bucket.synced = True
+
+def too_many_requests(wait: float) -> Dict[str, Any]:
+    retry_after = max(1, math.ceil(wait))
+    return {
+        'statusCode': 429,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Retry-After': str(retry_after)
+        },
+        'body': json.dumps({'error': 'Слишком много запросов, попробуйте позже', 'retryAfter': retry_after}),
+        'isBase64Encoded': False
+    }
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_WORKER_BUDGET = float(os.environ.get('JOB_WORKER_BUDGET', '240'))
+JOB_VISIBILITY_TIMEOUT = int(os.environ.get('JOB_VISIBILITY_TIMEOUT', '300'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '10'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+JOB_INLINE_AFTER = float(os.environ.get('JOB_INLINE_AFTER', '10'))
+
+def submit_job(user_id: int, module_type: str, media_type: str, prompt: str) -> int:
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cur.execute(
+            """INSERT INTO generation_jobs (user_id, module_type, media_type, prompt, max_attempts)
+               VALUES (%s, %s, %s, %s, %s) RETURNING id""",
+            (user_id, module_type, media_type, prompt, JOB_MAX_ATTEMPTS)
+        )
+        job_id = cur.fetchone()['id']
+        conn.commit()
+        return job_id
+    
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def claim_job(worker_id: str, job_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Lease the next visible job (or job `job_id`, if it is visible) with FOR UPDATE SKIP
+    LOCKED. A running job whose lease (visible_at) has expired belonged to a crashed
+    worker and is claimed again; one that has used up its attempts is failed instead.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cur.execute(
+            """UPDATE generation_jobs
+               SET status = 'failed', error = 'Превышено время выполнения', locked_by = NULL,
+                   updated_at = NOW(), finished_at = NOW()
+               WHERE status = 'running' AND visible_at <= NOW() AND attempts >= max_attempts"""
+        )
+        cur.execute(
+            """UPDATE generation_jobs j
+               SET status = 'running', attempts = j.attempts + 1, progress = 10, locked_by = %s,
+                   visible_at = NOW() + %s * INTERVAL '1 second', updated_at = NOW()
+               FROM (
+                   SELECT id FROM generation_jobs
+                   WHERE status IN ('queued', 'running') AND visible_at <= NOW() AND attempts < max_attempts
+                     AND (%s::bigint IS NULL OR id = %s)
+                   ORDER BY visible_at, id
+                   LIMIT 1
+                   FOR UPDATE SKIP LOCKED
+               ) next_job
+               WHERE j.id = next_job.id
+               RETURNING j.id, j.user_id, j.module_type, j.media_type, j.prompt, j.attempts, j.max_attempts""",
+            (worker_id, JOB_VISIBILITY_TIMEOUT, job_id, job_id)
+        )
+        job = cur.fetchone()
+        conn.commit()
+        return job
+    
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def execute_job(job: Dict[str, Any]) -> Tuple[str, Optional[str], bool]:
+    """(response text, result URL, ok) for a claimed job"""
+    if job['media_type'] == 'image':
+        result, ok = request_dalle_image(job['prompt'], wait=FLIGHT_LEASES['images/generations'])
+        if not ok:
+            return result, None, False
+        return generate_image_message(job['prompt'], result), result, True
+    return video_placeholder(job['prompt']), None, True
+
+def finish_job(job: Dict[str, Any], worker_id: str, response_text: str, result_url: Optional[str], ok: bool) -> None:
+    """
+    Record the outcome; failures are requeued with exponential backoff until max_attempts.
+    Updates are fenced on (locked_by, attempts) so a worker whose lease expired cannot
+    overwrite the job's newer attempt.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        fence = (job['id'], worker_id, job['attempts'])
+        if not ok and job['attempts'] < job['max_attempts']:
+            cur.execute(
+                """UPDATE generation_jobs
+                   SET status = 'queued', progress = 0, error = %s, locked_by = NULL,
+                       visible_at = NOW() + %s * INTERVAL '1 second', updated_at = NOW()
+                   WHERE id = %s AND locked_by = %s AND attempts = %s""",
+                (response_text, JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1), *fence)
+            )
+            conn.commit()
+            return
+        
+        cur.execute(
+            "INSERT INTO ai_requests (user_id, module_type, prompt, response) VALUES (%s, %s, %s, %s) RETURNING id",
+            (job['user_id'], job['module_type'], job['prompt'], response_text)
+        )
+        request_id = cur.fetchone()['id']
+        cur.execute(
+            """UPDATE generation_jobs
+               SET status = %s, progress = 100, response = %s, result_url = %s, error = %s,
+                   request_id = %s, locked_by = NULL, updated_at = NOW(), finished_at = NOW()
+               WHERE id = %s AND locked_by = %s AND attempts = %s""",
+            ('succeeded' if ok else 'failed', response_text if ok else None, result_url,
+             None if ok else response_text, request_id, *fence)
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+        else:
+            conn.commit()
+    
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def job_worker_prefix() -> str:
+    import socket
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def run_claimed_job(job: Dict[str, Any], worker_id: str) -> None:
+    try:
+        response_text, result_url, ok = execute_job(job)
+    except Exception as e:
+        response_text, result_url, ok = f"❌ Ошибка генерации: {str(e)}", None, False
+    try:
+        finish_job(job, worker_id, response_text, result_url, ok)
+    except Exception as e:
+        print(f"[jobs] {worker_id} finishing job {job['id']} failed, lease will expire: {e}")
+
+def run_job_worker(worker_id: str, until: float, drain: bool = True) -> int:
+    """Claim and run jobs until the deadline; with drain=True stop as soon as the queue is empty"""
+    processed = 0
+    while time.monotonic() < until:
+        try:
+            job = claim_job(worker_id)
+        except Exception as e:
+            print(f"[jobs] {worker_id} claim failed: {e}")
+            job = None
+        if job is None:
+            if drain:
+                break
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        
+        run_claimed_job(job, worker_id)
+        processed += 1
+    return processed
+
+def run_job_workers(workers: int = JOB_WORKERS, budget: float = JOB_WORKER_BUDGET, drain: bool = True) -> int:
+    """Worker pool; throughput is bounded by `workers`, not by incoming HTTP requests"""
+    from concurrent.futures import ThreadPoolExecutor
+    until = time.monotonic() + budget
+    prefix = job_worker_prefix()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(lambda n: run_job_worker(f'{prefix}:{n}', until, drain), range(workers)))
+
+def run_job_inline(job_id: int) -> bool:
+    """
+    Run one stalled job inside the request that polls it. Workers only run on the timer
+    trigger; if it is not configured or falls behind, a job still waiting JOB_INLINE_AFTER
+    seconds after it became visible is taken by its own ?job= poll instead of staying
+    queued forever. False when a worker holds the job or it is no longer runnable.
+    """
+    worker_id = f'{job_worker_prefix()}:inline'
+    try:
+        job = claim_job(worker_id, job_id)
+    except Exception as e:
+        print(f"[jobs] {worker_id} claim of job {job_id} failed: {e}")
+        return False
+    if job is None:
+        return False
+    run_claimed_job(job, worker_id)
+    return True
+
+AI_REQUESTS_RETENTION_MONTHS = int(os.environ.get('AI_REQUESTS_RETENTION_MONTHS', '6'))
+AI_REQUESTS_PARTITIONS_AHEAD = int(os.environ.get('AI_REQUESTS_PARTITIONS_AHEAD', '3'))
+AI_REQUESTS_MAINTENANCE_INTERVAL = float(os.environ.get('AI_REQUESTS_MAINTENANCE_INTERVAL', '3600'))
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+_ai_requests_maintained_at = float('-inf')
+_ai_requests_maintenance_lock = threading.Lock()
+
+def maintain_ai_requests() -> None:
+    '''
+    Create upcoming monthly partitions and roll partitions past retention into ai_requests_daily.
+    Runs at most once per AI_REQUESTS_MAINTENANCE_INTERVAL per instance, from the timer
+    trigger and from requests, so partitions are created even without a trigger; a
+    request finding maintenance already running elsewhere in the instance skips it.
+    '''
+    global _ai_requests_maintained_at
+    if time.monotonic() - _ai_requests_maintained_at < AI_REQUESTS_MAINTENANCE_INTERVAL:
+        return
+    if not _ai_requests_maintenance_lock.acquire(blocking=False):
+        return
+    conn = None
+    try:
+        if time.monotonic() - _ai_requests_maintained_at < AI_REQUESTS_MAINTENANCE_INTERVAL:
+            return
+        _ai_requests_maintained_at = time.monotonic()
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('ai_requests_maintenance'))")
+        if cur.fetchone()[0]:
+            cur.execute("SELECT ensure_ai_requests_partitions(CURRENT_DATE, %s)", (AI_REQUESTS_PARTITIONS_AHEAD,))
+            created = cur.fetchone()[0]
+            cur.execute("SELECT compact_ai_requests(%s)", (AI_REQUESTS_RETENTION_MONTHS,))
+            compacted = cur.fetchone()[0]
+            if created or compacted:
+                print(f"[ai-requests] partitions created: {created}, compacted: {compacted}")
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[ai-requests] maintenance failed: {e}")
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+        _ai_requests_maintenance_lock.release()
+
+def encode_history_cursor(created_at: datetime, request_id: int) -> str:
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{request_id}'.encode()).decode().rstrip('=')
+
+def decode_history_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    try:
+        created_at, request_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        return datetime.fromisoformat(created_at), int(request_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def request_history(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    GET ?history&limit=&cursor=: the caller's requests, newest first. Keyset
+    pagination on (created_at, id) walks idx_ai_requests_user_created, so every
+    page costs the same regardless of depth.
+    """
+    params = event.get('queryStringParameters') or {}
+    user_id = verify_session_token(get_session_token(event, {}))
+    if user_id is None:
         return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Требуется авторизация'}),
             'isBase64Encoded': False
         }
     
-    if method != 'POST':
+    limit = params.get('limit') or str(HISTORY_PAGE_SIZE)
+    after = decode_history_cursor(params['cursor']) if params.get('cursor') else None
+    if not limit.isdigit() or not 1 <= int(limit) <= HISTORY_MAX_PAGE_SIZE or (params.get('cursor') and after is None):
         return {
-            'statusCode': 405,
+            'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
+            'body': json.dumps({'error': 'Некорректные параметры истории'}),
             'isBase64Encoded': False
         }
+    limit = int(limit)
     
-    body = json.loads(event.get('body', '{}'))
-    user_id = body.get('userId')
-    module_type = body.get('moduleType')
-    prompt = body.get('prompt')
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        if after is None:
+            cur.execute(
+                """SELECT id, module_type, prompt, response, created_at FROM ai_requests
+                   WHERE user_id = %s
+                   ORDER BY created_at DESC, id DESC LIMIT %s""",
+                (user_id, limit + 1)
+            )
+        else:
+            cur.execute(
+                """SELECT id, module_type, prompt, response, created_at FROM ai_requests
+                   WHERE user_id = %s AND (created_at, id) < (%s, %s)
+                   ORDER BY created_at DESC, id DESC LIMIT %s""",
+                (user_id, *after, limit + 1)
+            )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    if not user_id or not module_type or not prompt:
+    page = rows[:limit]
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Cache-Control': 'no-store'},
+        'body': dumps({
+            'items': [
+                {
+                    'requestId': row['id'],
+                    'moduleType': row['module_type'],
+                    'prompt': row['prompt'],
+                    'response': row['response'],
+                    'createdAt': row['created_at'].isoformat()
+                }
+                for row in page
+            ],
+            'nextCursor': encode_history_cursor(page[-1]['created_at'], page[-1]['id']) if len(rows) > limit else None
+        }, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+def job_status(event: Dict[str, Any]) -> Dict[str, Any]:
+    """GET ?job=<id>: status, progress and result of the caller's own job"""
+    params = event.get('queryStringParameters') or {}
+    user_id = verify_session_token(get_session_token(event, {}))
+    if user_id is None:
         return {
-            'statusCode': 400,
+            'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Все поля обязательны'}),
+            'body': json.dumps({'error': 'Требуется авторизация'}),
             'isBase64Encoded': False
         }
     
-    response_text = ''
+    row = None
+    if str(params.get('job', '')).isdigit():
+        for attempt in range(2):
+            conn = get_db_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """SELECT id, status, progress, attempts, max_attempts, result_url, response, error, request_id,
+                              status IN ('queued', 'running') AND attempts < max_attempts
+                                  AND visible_at <= NOW() - %s * INTERVAL '1 second' AS stalled
+                       FROM generation_jobs WHERE id = %s AND user_id = %s""",
+                    (JOB_INLINE_AFTER, int(params['job']), user_id)
+                )
+                row = cur.fetchone()
+            finally:
+                cur.close()
+                release_db_connection(conn)
+            if attempt or row is None or not row['stalled'] or not run_job_inline(row['id']):
+                break
+    
+    if row is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Задача не найдена'}),
+            'isBase64Encoded': False
+        }
     
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Cache-Control': 'no-store'},
+        'body': json.dumps({
+            'jobId': row['id'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'attempts': row['attempts'],
+            'maxAttempts': row['max_attempts'],
+            'resultUrl': row['result_url'],
+            'response': row['response'],
+            'error': row['error'],
+            'requestId': row['request_id']
+        }),
+        'isBase64Encoded': False
+    }
+
+def generate_response(module_type: str, prompt: str, user_id: int, options: Dict[str, Any]) -> Optional[str]:
+    """Synchronous generation for one request; None for an unknown module type"""
     if module_type == 'website':
-        response_text = generate_website(prompt, user_id)
+        return generate_website(prompt, user_id)
     
-    elif module_type == 'text':
-        response_text = generate_text_with_gpt(prompt)
+    if module_type == 'text':
+        return generate_text_with_gpt(prompt, use_cache=not options.get('noCache'))
     
-    elif module_type == 'media':
-        media_type = body.get('mediaType', 'image')
-        if media_type == 'image':
-            response_text = generate_image_with_dalle(prompt)
-        else:
-            response_text = f'''🎬 Генерация видео
-
-⚠️ Видео-генерация требует отдельного API (Runway, Pika Labs и др.)
-
-📝 Ваш запрос: {prompt}
-
-💡 Для активации видео-генерации свяжитесь с администратором.
-
-Пока доступна генерация изображений через DALL-E 3!'''
+    if module_type == 'media':
+        if options.get('mediaType', 'image') == 'image':
+            return generate_image_with_dalle(prompt, use_cache=not options.get('noCache'))
+        return video_placeholder(prompt)
     
-    elif module_type == 'voice':
-        response_text = f'''🎤 Голосовая обработка
+    if module_type == 'voice':
+        return f'''🎤 Голосовая обработка
 
 ⚠️ Голосовой ввод требует отдельного API (OpenAI Whisper, TTS)
 
@@ -274,36 +1481,208 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 Используйте текстовую нейросеть для получения ответов!'''
     
-    else:
+    return None
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '50'))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', str(OPENAI_POOL_SIZE)))
+
+def handle_batch(items: Any, user_id: int) -> Dict[str, Any]:
+    """
+    items: [{moduleType, prompt, ...per-item options}]. Items fan out to upstream on
+    a pool of BATCH_CONCURRENCY threads; results keep the request order and carry
+    their own errors. Media items are generated inline rather than queued.
+    """
+    if not isinstance(items, list) or not items or len(items) > BATCH_MAX_ITEMS:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неизвестный тип модуля'}),
+            'body': json.dumps({'error': f'Нужен список items от 1 до {BATCH_MAX_ITEMS} элементов'}),
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    def run(item: Any) -> Tuple[Optional[str], Optional[str]]:
+        if not isinstance(item, dict) or not item.get('moduleType') or not item.get('prompt'):
+            return None, 'Все поля обязательны'
+        wait = admit(user_id, rate_limit_module(item['moduleType'], item))
+        if wait > 0:
+            return None, f'Слишком много запросов, повторите через {max(1, math.ceil(wait))} с'
+        try:
+            response_text = generate_response(item['moduleType'], item['prompt'], user_id, item)
+        except Exception as e:
+            return None, f'Ошибка генерации: {str(e)}'
+        if response_text is None:
+            return None, 'Неизвестный тип модуля'
+        return response_text, None
     
-    try:
-        cur.execute(
-            "INSERT INTO ai_requests (user_id, module_type, prompt, response) VALUES (%s, %s, %s, %s) RETURNING id",
-            (user_id, module_type, prompt, response_text)
-        )
-        request_id = cur.fetchone()['id']
-        conn.commit()
-        
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(items))) as pool:
+        outcomes = list(pool.map(run, items))
+    
+    completed = [index for index, (response_text, _) in enumerate(outcomes) if response_text is not None]
+    request_ids = dict(zip(completed, log_ai_requests(
+        user_id, [(items[index]['moduleType'], items[index]['prompt'], outcomes[index][0]) for index in completed]
+    )))
+    
+    results = []
+    for index, (response_text, error) in enumerate(outcomes):
+        if error is not None:
+            results.append({'index': index, 'success': False, 'error': error})
+        else:
+            results.append({'index': index, 'success': True, 'requestId': request_ids[index], 'response': response_text})
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'success': True, 'results': results}),
+        'isBase64Encoded': False
+    }
+
+CORS_PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Authorization, Range, If-None-Match',
+    'Access-Control-Max-Age': '86400'
+}
+
+MODULE_TYPES = frozenset({'text', 'media', 'website', 'voice', 'batch'})
+
+@instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Generate AI content using real APIs (GPT-4, DALL-E, website hosting)
+    Args: event with httpMethod, X-Auth-Token header, body containing moduleType, prompt
+          (text also takes noCache: true;
+          media is queued as a job unless sync: true) or items: [{moduleType, prompt}] for a batch;
+          GET with ?site=<site_name> serves a generated website, ?blob=<sha256>[&variant=thumb]
+          a stored image, ?job=<id> reports a job,
+          ?history[&cursor=&limit=] pages through the caller's requests, ?metrics reports latencies;
+          a timer trigger event (any event without httpMethod; give this function a trigger,
+          e.g. every minute) runs the job workers and ai_requests maintenance (also run by
+          requests once AI_REQUESTS_MAINTENANCE_INTERVAL has passed), and a ?job= poll
+          runs its own job inline once it has waited JOB_INLINE_AFTER seconds with no worker
+    Returns: HTTP response with generated content, URLs or a job id
+    '''
+    if 'httpMethod' not in event:
+        label('jobs')
+        maintain_ai_requests()
+        processed = run_job_workers()
+        return {'statusCode': 200, 'body': json.dumps({'processed': processed})}
+    
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
         return {
             'statusCode': 200,
+            'headers': dict(CORS_PREFLIGHT_HEADERS),
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET' and 'metrics' in (event.get('queryStringParameters') or {}):
+        label('metrics')
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Cache-Control': 'no-store'},
+            'body': json.dumps({'timings': metrics_snapshot(), 'gptCache': gpt_cache_stats(), 'blobStore': blob_store.snapshot(), 'dbPool': db_pool_stats()}),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET' and 'job' in (event.get('queryStringParameters') or {}):
+        label('job')
+        return job_status(event)
+    
+    if method == 'GET' and 'history' in (event.get('queryStringParameters') or {}):
+        label('history')
+        return request_history(event)
+    
+    if method == 'GET' and 'blob' in (event.get('queryStringParameters') or {}):
+        label('blob')
+        return serve_blob(blob_store, event)
+    
+    if method == 'GET':
+        label('site')
+        return serve_site(event)
+    
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    body = json.loads(event.get('body', '{}'))
+    module_type = body.get('moduleType')
+    prompt = body.get('prompt')
+    items = body.get('items')
+    label('batch' if items is not None else module_type, MODULE_TYPES)
+    
+    if items is None and (not module_type or not prompt):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Все поля обязательны'}),
+            'isBase64Encoded': False
+        }
+    
+    user_id = verify_session_token(get_session_token(event, body))
+    if user_id is None:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Требуется авторизация'}),
+            'isBase64Encoded': False
+        }
+    
+    if items is not None:
+        response = handle_batch(items, user_id)
+        maintain_ai_requests()
+        flush_ai_requests(force=False)
+        return response
+    
+    queued = module_type == 'media' and not body.get('sync')
+    module = rate_limit_module(module_type, body)
+    wait = admit(user_id, module, check_backlog=not queued)
+    if wait > 0:
+        return too_many_requests(wait)
+    
+    if queued:
+        job_id = submit_job(user_id, module_type, body.get('mediaType', 'image'), prompt)
+        return {
+            'statusCode': 202,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({
                 'success': True,
-                'requestId': request_id,
-                'response': response_text
+                'jobId': job_id,
+                'status': 'queued',
+                'poll': f'?job={job_id}'
             }),
             'isBase64Encoded': False
         }
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    response_text = generate_response(module_type, prompt, user_id, body)
+    if response_text is None:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Неизвестный тип модуля'}),
+            'isBase64Encoded': False
+        }
+    
+    request_id = log_ai_request(user_id, module_type, prompt, response_text)
+    maintain_ai_requests()
+    flush_ai_requests(force=False)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({
+            'success': True,
+            'requestId': request_id,
+            'response': response_text
+        }),
+        'isBase64Encoded': False
+    }
+
+if __name__ == '__main__':
+    run_job_workers(budget=float('inf'), drain=False)
@@ -0,0 +1,38 @@
+import threading
+from typing import Any, Callable, Dict, Optional
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+def single_flight(key: str, fn: Callable[[], Any]) -> Any:
+    """Run fn once per key within this process; concurrent callers wait for and share its result"""
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = fn()
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
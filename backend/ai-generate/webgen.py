@@ -0,0 +1,169 @@
+import base64
+import gzip
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SLOT_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+STYLE_PATTERN = re.compile(r'(<style>)(.*?)(</style>)', re.S)
+CSS_PUNCTUATION = re.compile(r'\s*([{};:,>])\s*')
+BETWEEN_TAGS = re.compile(r'>\s+<')
+WHITESPACE_RUN = re.compile(r'\s+')
+COMPRESSED_CACHE_SIZE = 256
+
+def minify_html(source: str) -> str:
+    """Collapse whitespace in markup and tighten CSS punctuation inside <style>"""
+    source = STYLE_PATTERN.sub(
+        lambda m: m.group(1) + CSS_PUNCTUATION.sub(r'\1', WHITESPACE_RUN.sub(' ', m.group(2))).strip().replace(';}', '}') + m.group(3),
+        source
+    )
+    return WHITESPACE_RUN.sub(' ', BETWEEN_TAGS.sub('><', source)).strip()
+
+class PageTemplate:
+    '''
+    Static page split once into fragments around {{ slot }} placeholders.
+    Rendering only escapes the slot values and joins them with the prebuilt fragments.
+    '''
+    
+    def __init__(self, source: str, minify: bool = True):
+        compiled = minify_html(source) if minify else source
+        pieces = SLOT_PATTERN.split(compiled)
+        self.fragments: List[str] = pieces[0::2]
+        self.slots: List[str] = pieces[1::2]
+        self.version = hashlib.sha256(compiled.encode()).hexdigest()[:12]
+    
+    def render(self, **values: str) -> str:
+        escaped = {name: html.escape(str(value)) for name, value in values.items()}
+        parts = [self.fragments[0]]
+        for slot, fragment in zip(self.slots, self.fragments[1:]):
+            parts.append(escaped[slot])
+            parts.append(fragment)
+        return ''.join(parts)
+    
+    def etag(self, **values: str) -> str:
+        """Stable validator for this template version and slot values"""
+        digest = hashlib.sha256(self.version.encode())
+        for name in sorted(values):
+            digest.update(b'\0' + name.encode() + b'\0' + str(values[name]).encode())
+        return f'"{digest.hexdigest()[:20]}"'
+
+def negotiate_encoding(headers: Dict[str, str]) -> Optional[str]:
+    """Pick br or gzip from Accept-Encoding, honouring q=0"""
+    accept = next((value for name, value in headers.items() if name.lower() == 'accept-encoding'), '')
+    accepted = set()
+    for item in accept.split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.replace(' ', '').startswith('q=0') and not params.replace(' ', '').startswith('q=0.'):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+_compressed: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+_compressed_lock = threading.Lock()
+
+def compressed_body(etag: str, encoding: str, data: bytes) -> str:
+    """Base64 of the compressed body, cached per (ETag, encoding)"""
+    key = (etag, encoding)
+    with _compressed_lock:
+        if key in _compressed:
+            _compressed.move_to_end(key)
+            return _compressed[key]
+    encoded = base64.b64encode(compress(data, encoding)).decode()
+    with _compressed_lock:
+        _compressed[key] = encoded
+        while len(_compressed) > COMPRESSED_CACHE_SIZE:
+            _compressed.popitem(last=False)
+    return encoded
+
+SITE_PAGE_SOURCE = '''<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ prompt }}</title>
+    <style>
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            min-height: 100vh;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            color: white;
+            padding: 20px;
+        }
+        .container {
+            max-width: 800px;
+            background: rgba(255,255,255,0.1);
+            backdrop-filter: blur(10px);
+            padding: 60px 40px;
+            border-radius: 20px;
+            box-shadow: 0 20px 60px rgba(0,0,0,0.3);
+            text-align: center;
+            animation: slideIn 0.6s ease-out;
+        }
+        h1 {
+            font-size: 3em;
+            margin-bottom: 20px;
+            text-shadow: 0 2px 10px rgba(0,0,0,0.3);
+        }
+        p {
+            font-size: 1.2em;
+            line-height: 1.6;
+            opacity: 0.9;
+            margin-bottom: 30px;
+        }
+        .badge {
+            display: inline-block;
+            padding: 10px 20px;
+            background: rgba(255,255,255,0.2);
+            border-radius: 50px;
+            font-size: 0.9em;
+            margin: 10px 5px;
+        }
+        @keyframes slideIn {
+            from { opacity: 0; transform: translateY(30px); }
+            to { opacity: 1; transform: translateY(0); }
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>{{ prompt }}</h1>
+        <p>Сайт создан AI-платформой DUWDU1 за 2 секунды</p>
+        <div class="badge">🚀 Адаптивный дизайн</div>
+        <div class="badge">⚡ Быстрая загрузка</div>
+        <div class="badge">🎨 Современный UI</div>
+        <p style="margin-top: 40px; opacity: 0.7; font-size: 0.9em;">
+            Powered by DUWDU1 Neural Network
+        </p>
+    </div>
+</body>
+</html>'''
+
+SITE_PAGE = PageTemplate(SITE_PAGE_SOURCE)
+
+# Rows remember the template version they were written with; versions no longer
+# registered here render with the current page, so a template bump needs no rewrite
+SITE_TEMPLATES = {SITE_PAGE.version: SITE_PAGE}
+
+def site_template(version: Optional[str]) -> PageTemplate:
+    return SITE_TEMPLATES.get(version, SITE_PAGE)
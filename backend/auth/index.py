@@ -1,16 +1,194 @@
+import hashlib
+import hmac
+import io
 import json
+import math
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+import secrets
+import string
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+import dbpool
+from dbpool import db_pool_stats, release_db_connection
+from sessions import get_session_token, issue_session_token, verify_session_token
+from timing import instrumented, label, metrics_snapshot, span
 
+psycopg2: Any = None
+RealDictCursor: Any = None
+
+def import_psycopg2() -> None:
+    """Import psycopg2 on first database use, so preflights and cached answers never load it"""
+    global psycopg2, RealDictCursor
+    if psycopg2 is None:
+        with span('import'):
+            import psycopg2 as module
+            from psycopg2 import errors, extras
+        RealDictCursor = extras.RealDictCursor
+        psycopg2 = module
+
+def get_db_connection() -> Any:
+    """Pooled connection, see dbpool.get_db_connection"""
+    import_psycopg2()
+    return dbpool.get_db_connection()
+
+ACCESS_CODE_REFRESH = float(os.environ.get('ACCESS_CODE_REFRESH', '10'))
+ACCESS_CODE_BLOOM_THRESHOLD = int(os.environ.get('ACCESS_CODE_BLOOM_THRESHOLD', '200000'))
+ACCESS_CODE_ALPHABET = string.ascii_uppercase
+ACCESS_CODE_LENGTH = 10
+ACCESS_CODE_MAX_BATCH = 10000
+
+class AccessCodeBloomFilter:
+    """Probabilistic set of codes for large pools: false positives only, never false negatives"""
+    
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, code: str):
+        digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * step) % self.size for i in range(self.hash_count))
+    
+    def add(self, code: str) -> None:
+        for position in self._positions(code):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, code: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(code))
+
+_known_access_codes: Any = set()
+_used_access_codes: Set[str] = set()
+_access_codes_watermark: Optional[datetime] = None
+# monotonic time at which the last completed refresh started: the snapshot holds every code committed before it
+_access_codes_fresh_as_of = float('-inf')
+_access_codes_lock = threading.Lock()
+
+def _refresh_access_codes() -> None:
+    """Load all codes at warm start, then only rows created or used since the last watermark"""
+    global _known_access_codes, _access_codes_watermark
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if _access_codes_watermark is None:
+            cur.execute("SELECT code, is_used, created_at, used_at FROM access_codes")
+        else:
+            # Overlap the window so rows committed late with an older created_at are not missed
+            cur.execute(
+                """SELECT code, is_used, created_at, used_at FROM access_codes
+                   WHERE created_at > %s - INTERVAL '1 minute' OR used_at > %s - INTERVAL '1 minute'""",
+                (_access_codes_watermark, _access_codes_watermark)
+            )
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+    
+    if _access_codes_watermark is None and len(rows) > ACCESS_CODE_BLOOM_THRESHOLD:
+        _known_access_codes = AccessCodeBloomFilter(capacity=len(rows) * 2)
+    for row in rows:
+        _known_access_codes.add(row['code'])
+        if row['is_used']:
+            _used_access_codes.add(row['code'])
+        changed_at = max(filter(None, (row['created_at'], row['used_at'])), default=None)
+        if changed_at and (_access_codes_watermark is None or changed_at > _access_codes_watermark):
+            _access_codes_watermark = changed_at
+
+def _access_codes_fresh_since(since: float) -> bool:
+    """Refresh unless a refresh started at or after `since` already completed; False if the database is unreachable"""
+    global _access_codes_fresh_as_of
+    if _access_codes_fresh_as_of >= since:
+        return True
+    with _access_codes_lock:
+        if _access_codes_fresh_as_of >= since:
+            return True
+        started = time.monotonic()
+        try:
+            _refresh_access_codes()
+        except psycopg2.Error as e:
+            print(f"[access-codes] refresh failed: {e}")
+            return False
+        _access_codes_fresh_as_of = started
+    return True
+
+def cached_access_code_error(code: str) -> Optional[str]:
+    '''
+    Error for codes the in-memory index rules out, or None when the database must decide.
+    A miss in a snapshot up to ACCESS_CODE_REFRESH seconds old may be a code just issued by
+    another instance, so it is only final after a refresh started after the request came
+    in; concurrent misses share one incremental refresh.
+    '''
+    asked_at = time.monotonic()
+    if not _access_codes_fresh_since(asked_at - ACCESS_CODE_REFRESH):
+        return None
+    if code not in _known_access_codes:
+        if not _access_codes_fresh_since(asked_at):
+            return None
+        if code not in _known_access_codes:
+            return 'Неверный код'
+    if code in _used_access_codes:
+        return 'Код уже использован'
+    return None
+
+def issue_access_codes(conn: Any, count: int) -> List[str]:
+    """Generate codes and load them with a single COPY, skipping any that already exist"""
+    codes = {''.join(secrets.choice(ACCESS_CODE_ALPHABET) for _ in range(ACCESS_CODE_LENGTH)) for _ in range(count)}
+    cur = conn.cursor()
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS issued_access_codes (code VARCHAR(50)) ON COMMIT DELETE ROWS")
+    cur.copy_expert("COPY issued_access_codes (code) FROM STDIN", io.StringIO('\n'.join(codes) + '\n'))
+    cur.execute(
+        "INSERT INTO access_codes (code) SELECT code FROM issued_access_codes ON CONFLICT (code) DO NOTHING RETURNING code"
+    )
+    issued = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    
+    with _access_codes_lock:
+        for code in issued:
+            _known_access_codes.add(code)
+    return issued
+
+def is_admin_request(event: Dict[str, Any], body: Dict[str, Any]) -> bool:
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    provided = headers.get('x-admin-token') or body.get('adminToken') or ''
+    return hmac.compare_digest(provided.encode(), admin_token.encode())
+
+# Claim the code and create the user in one statement: the conditional UPDATE
+# row-locks the code so concurrent registrations cannot both pass, and a
+# username conflict aborts the whole statement leaving the code unused.
+REGISTER_USER_SQL = """
+    WITH claimed AS (
+        UPDATE access_codes SET is_used = TRUE, used_at = CURRENT_TIMESTAMP
+        WHERE code = %s AND is_used IS NOT TRUE
+        RETURNING code
+    )
+    INSERT INTO users (username, password, access_code)
+    SELECT %s, %s, code FROM claimed
+    RETURNING id
+"""
+
+CORS_PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Admin-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+
+AUTH_ACTIONS = frozenset({'check_code', 'register', 'login', 'logout', 'issue_codes', 'metrics'})
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Handle user authentication and registration
-    Args: event with httpMethod, body
+    Args: event with httpMethod, body (action: check_code, register, login, logout,
+          issue_codes or metrics)
     Returns: HTTP response with user data or error
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -18,24 +196,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': dict(CORS_PREFLIGHT_HEADERS),
             'body': '',
             'isBase64Encoded': False
         }
     
+    body = json.loads(event.get('body', '{}')) if method == 'POST' else {}
+    action = body.get('action')
+    if action:
+        label(action, AUTH_ACTIONS)
+    
+    if action == 'metrics':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Cache-Control': 'no-store'},
+            'body': json.dumps({'timings': metrics_snapshot(), 'dbPool': db_pool_stats()}),
+            'isBase64Encoded': False
+        }
+    
+    if action == 'check_code':
+        cached_error = cached_access_code_error(body.get('code', '').upper())
+        if cached_error:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': cached_error}),
+                'isBase64Encoded': False
+            }
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
         if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
             if action == 'check_code':
                 code = body.get('code', '').upper()
                 cur.execute(
@@ -80,43 +273,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("SELECT is_used FROM access_codes WHERE code = %s", (code,))
-                code_result = cur.fetchone()
-                
-                if not code_result or code_result['is_used']:
+                try:
+                    cur.execute(REGISTER_USER_SQL, (code, username, password))
+                    registered = cur.fetchone()
+                except psycopg2.errors.UniqueViolation:
+                    conn.rollback()
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Код недействителен'}),
+                        'body': json.dumps({'error': 'Имя пользователя занято'}),
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-                if cur.fetchone():
+                if not registered:
+                    conn.rollback()
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Имя пользователя занято'}),
+                        'body': json.dumps({'error': 'Код недействителен'}),
                         'isBase64Encoded': False
                     }
                 
-                cur.execute(
-                    "INSERT INTO users (username, password, access_code) VALUES (%s, %s, %s) RETURNING id",
-                    (username, password, code)
-                )
-                user_id = cur.fetchone()['id']
-                
-                cur.execute(
-                    "UPDATE access_codes SET is_used = TRUE, used_at = CURRENT_TIMESTAMP WHERE code = %s",
-                    (code,)
-                )
+                user_id = registered['id']
+                # Sign before committing: if tokens cannot be issued the code stays unused
+                token = issue_session_token(user_id)
                 
                 conn.commit()
+                _used_access_codes.add(code)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'userId': user_id, 'username': username}),
+                    'body': json.dumps({
+                        'success': True,
+                        'userId': user_id,
+                        'username': username,
+                        'token': token
+                    }),
                     'isBase64Encoded': False
                 }
             
@@ -149,7 +342,68 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'userId': user['id'], 'username': user['username']}),
+                    'body': json.dumps({
+                        'success': True,
+                        'userId': user['id'],
+                        'username': user['username'],
+                        'token': issue_session_token(user['id'])
+                    }),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'issue_codes':
+                if not is_admin_request(event, body):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Доступ запрещён'}),
+                        'isBase64Encoded': False
+                    }
+                
+                try:
+                    count = int(body.get('count', 100))
+                except (TypeError, ValueError):
+                    count = 0
+                if count < 1 or count > ACCESS_CODE_MAX_BATCH:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Количество кодов: от 1 до {ACCESS_CODE_MAX_BATCH}'}),
+                        'isBase64Encoded': False
+                    }
+                
+                codes = issue_access_codes(conn, count)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True, 'count': len(codes), 'codes': codes}),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'logout':
+                token = get_session_token(event, body)
+                user_id = verify_session_token(token, conn)
+                
+                if user_id is None:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Недействительный токен'}),
+                        'isBase64Encoded': False
+                    }
+                
+                _, expires_at, token_id, _ = token.split('.')
+                cur.execute(
+                    "INSERT INTO revoked_tokens (jti, user_id, expires_at) VALUES (%s, %s, to_timestamp(%s)) ON CONFLICT (jti) DO NOTHING",
+                    (token_id, user_id, int(expires_at))
+                )
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True}),
                     'isBase64Encoded': False
                 }
         
@@ -162,4 +416,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, FrozenSet, Optional
+
+import dbpool
+
+SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', str(7 * 24 * 3600)))
+SESSION_REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '60'))
+
+_session_mac: Any = None
+_revoked_token_ids: FrozenSet[str] = frozenset()
+_revoked_loaded_at = float('-inf')
+_revoked_lock = threading.Lock()
+
+def _session_signature(payload: str) -> bytes:
+    global _session_mac
+    if _session_mac is None:
+        secret = os.environ.get('SESSION_SECRET')
+        if not secret:
+            raise RuntimeError('SESSION_SECRET is not set: session tokens can be neither issued nor verified')
+        _session_mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+    mac = _session_mac.copy()
+    mac.update(payload.encode())
+    return base64.urlsafe_b64encode(mac.digest()).rstrip(b'=')
+
+def issue_session_token(user_id: int) -> str:
+    """Compact signed token: user_id.expires_at.token_id.signature"""
+    payload = f"{user_id}.{int(time.time()) + SESSION_TOKEN_TTL}.{secrets.token_urlsafe(9)}"
+    return f"{payload}.{_session_signature(payload).decode()}"
+
+def _revoked_session_ids(conn: Any = None) -> FrozenSet[str]:
+    '''
+    Revoked token ids, cached in memory and reloaded every SESSION_REVOCATION_REFRESH seconds.
+    A caller already holding a pooled connection passes it as conn, so the reload does not
+    wait for a second one (which can deadlock once every slot is held that way).
+    '''
+    global _revoked_token_ids, _revoked_loaded_at
+    if time.monotonic() - _revoked_loaded_at < SESSION_REVOCATION_REFRESH:
+        return _revoked_token_ids
+    with _revoked_lock:
+        if time.monotonic() - _revoked_loaded_at < SESSION_REVOCATION_REFRESH:
+            return _revoked_token_ids
+        pooled = conn is None
+        try:
+            if pooled:
+                conn = dbpool.get_db_connection()
+            cur = conn.cursor(cursor_factory=dbpool.psycopg2.extensions.cursor)
+            cur.execute("SELECT jti FROM revoked_tokens WHERE expires_at > NOW()")
+            _revoked_token_ids = frozenset(row[0] for row in cur.fetchall())
+            cur.close()
+        except dbpool.psycopg2.Error as e:
+            print(f"[session] revocation refresh failed, keeping {len(_revoked_token_ids)} cached ids: {e}")
+        finally:
+            if pooled and conn is not None:
+                dbpool.release_db_connection(conn)
+        _revoked_loaded_at = time.monotonic()
+        return _revoked_token_ids
+
+def verify_session_token(token: Any, conn: Any = None) -> Optional[int]:
+    '''
+    Return user id for a valid unexpired token; None for anything malformed. The database is
+    only read to refresh the revocation list, through conn when the caller holds one.
+    '''
+    if not isinstance(token, str) or token.count('.') != 3:
+        return None
+    payload, _, signature = token.rpartition('.')
+    try:
+        if not hmac.compare_digest(signature.encode(), _session_signature(payload)):
+            return None
+        user_id, expires_at, token_id = payload.split('.')
+        user_id, expires_at = int(user_id), int(expires_at)
+    except ValueError:
+        return None
+    if expires_at < time.time() or token_id in _revoked_session_ids(conn):
+        return None
+    return user_id
+
+def request_header(headers: Dict[str, str], name: str) -> Optional[str]:
+    """Case-insensitive header lookup (gateways differ in header casing)"""
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def get_session_token(event: Dict[str, Any], body: Dict[str, Any]) -> Optional[str]:
+    """Session token from X-Auth-Token / Authorization headers or request body"""
+    for name, value in (event.get('headers') or {}).items():
+        lowered = name.lower()
+        if lowered == 'x-auth-token':
+            return value
+        if lowered == 'authorization' and value.startswith('Bearer '):
+            return value[7:]
+    return body.get('token')
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from timing import span, timed_connection_class
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_OPEN = int(os.environ.get('DB_POOL_MAX_OPEN', '8'))
+DB_POOL_WAIT = float(os.environ.get('DB_POOL_WAIT', '10'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '10'))
+
+psycopg2: Any = None
+
+def import_psycopg2() -> Any:
+    """Import psycopg2 on first database use, so preflights never load it"""
+    global psycopg2
+    if psycopg2 is None:
+        with span('import'):
+            import psycopg2 as module
+            import psycopg2.extensions
+            import psycopg2.pool
+        psycopg2 = module
+    return psycopg2
+
+_db_pool: List[Tuple[Any, float]] = []
+_db_pool_lock = threading.Lock()
+_db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_OPEN)
+_db_pool_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0, 'exhausted': 0, 'checked_out': 0}
+
+def _db_connection_alive(conn: Any, idle_for: float) -> bool:
+    """Check pooled connection health, pinging only if it sat idle for a while"""
+    if conn.closed:
+        return False
+    if idle_for < DB_POOL_PING_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _discard_db_connection(conn: Any) -> None:
+    with _db_pool_lock:
+        _db_pool_stats['discarded'] += 1
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _checkout() -> Any:
+    while True:
+        with _db_pool_lock:
+            if not _db_pool:
+                break
+            conn, released_at = _db_pool.pop()
+        if _db_connection_alive(conn, time.monotonic() - released_at):
+            with _db_pool_lock:
+                _db_pool_stats['hits'] += 1
+            return conn
+        _discard_db_connection(conn)
+
+    with _db_pool_lock:
+        _db_pool_stats['misses'] += 1
+    print(f"[db-pool] new connection, stats={db_pool_stats()}")
+    return connect_db()
+
+def connect_db(connect_timeout: int = DB_CONNECT_TIMEOUT) -> Any:
+    """New connection with the pool's settings, for callers that keep one outside the pool (e.g. LISTEN)"""
+    import_psycopg2()
+    with span('db-connect'):
+        return psycopg2.connect(
+            os.environ.get('DATABASE_URL'), connection_factory=timed_connection_class(), connect_timeout=connect_timeout
+        )
+
+def get_db_connection(cursor_factory: Optional[type] = None) -> Any:
+    '''
+    Connection from the warm pool, reconnecting if needed. At most DB_POOL_MAX_OPEN
+    connections are checked out at once per instance (idle ones are capped separately
+    by DB_POOL_MAX_SIZE); a caller waits up to DB_POOL_WAIT seconds for one to be
+    released and then gets psycopg2.pool.PoolError. cursor_factory becomes the
+    connection's default for this checkout.
+    '''
+    import_psycopg2()
+    if not _db_pool_slots.acquire(timeout=DB_POOL_WAIT):
+        with _db_pool_lock:
+            _db_pool_stats['exhausted'] += 1
+        raise psycopg2.pool.PoolError(f'all {DB_POOL_MAX_OPEN} database connections are in use')
+    try:
+        conn = _checkout()
+        conn.cursor_factory = cursor_factory
+    except BaseException:
+        _db_pool_slots.release()
+        raise
+    with _db_pool_lock:
+        _db_pool_stats['checked_out'] += 1
+    return conn
+
+def release_db_connection(conn: Any) -> None:
+    """Return connection to the pool; broken or surplus connections are closed"""
+    with _db_pool_lock:
+        _db_pool_stats['checked_out'] -= 1
+    try:
+        if conn.closed:
+            _discard_db_connection(conn)
+            return
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            _discard_db_connection(conn)
+            return
+        with _db_pool_lock:
+            if len(_db_pool) < DB_POOL_MAX_SIZE:
+                _db_pool.append((conn, time.monotonic()))
+                return
+        _discard_db_connection(conn)
+    finally:
+        _db_pool_slots.release()
+
+def db_pool_stats() -> Dict[str, int]:
+    """Pool hit/miss counters for confirming reuse across warm invocations"""
+    with _db_pool_lock:
+        return {**_db_pool_stats, 'idle': len(_db_pool)}
@@ -1,35 +1,430 @@
+import atexit
+import hashlib
 import json
 import os
+import threading
+import time
 import random
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+import re
+import tempfile
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
+from urllib.parse import quote
 
-def get_db_connection():
-    """Get database connection"""
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+from blobstore import BLOB_MAX_BYTES, BLOB_STORE_DIR, BLOB_STORE_QUOTA, BlobStore, serve_blob, store_blob
+import dbpool
+from dbpool import db_pool_stats, release_db_connection
+from intents import IntentMatcher
+from sessions import get_session_token, request_header, verify_session_token
+from singleflight import single_flight
+from timing import dumps, instrumented, label, metrics_snapshot, span
+from webgen import WEBGEN_PAGE, compressed_body, negotiate_encoding
 
+psycopg2: Any = None
+RealDictCursor: Any = None
+execute_values: Any = None
+
+def import_psycopg2() -> None:
+    """Import psycopg2 on first database use, so preflights never load it"""
+    global psycopg2, RealDictCursor, execute_values
+    if psycopg2 is None:
+        with span('import'):
+            import psycopg2 as module
+            from psycopg2 import extras
+        RealDictCursor = extras.RealDictCursor
+        execute_values = extras.execute_values
+        psycopg2 = module
+
+def get_db_connection() -> Any:
+    """Pooled connection with dict rows by default, see dbpool.get_db_connection"""
+    import_psycopg2()
+    return dbpool.get_db_connection(cursor_factory=RealDictCursor)
+
+QUESTION_KEY_NON_WORD = re.compile(r'[\W_]+')
+
+def normalize_question(question: str) -> str:
+    """Case-fold, strip punctuation and collapse whitespace; letters and digits of every script are kept"""
+    return QUESTION_KEY_NON_WORD.sub(' ', question.casefold()).strip(' ')
+
+def question_key(question: str) -> str:
+    """Normalized knowledge key, must match duwdu_question_key() in V0018"""
+    return hashlib.md5((normalize_question(question) or question.strip(' ')).encode()).hexdigest()
+
+KNOWLEDGE_HITS_FLUSH_INTERVAL = float(os.environ.get('KNOWLEDGE_HITS_FLUSH_INTERVAL', '5'))
+KNOWLEDGE_HITS_FLUSH_SIZE = int(os.environ.get('KNOWLEDGE_HITS_FLUSH_SIZE', '500'))
+
+_knowledge_hits: Dict[str, int] = {}
+_knowledge_hits_total = 0
+_knowledge_hits_flushed_at = time.monotonic()
+_knowledge_hits_lock = threading.Lock()
+
+def record_knowledge_hit(key: str) -> None:
+    """Buffer a used_count increment instead of writing it on the read path"""
+    global _knowledge_hits_total
+    with _knowledge_hits_lock:
+        _knowledge_hits[key] = _knowledge_hits.get(key, 0) + 1
+        _knowledge_hits_total += 1
+
+def flush_knowledge_hits(force: bool = False) -> None:
+    """Write buffered hits as one batched UPDATE once the interval or size threshold is reached"""
+    global _knowledge_hits, _knowledge_hits_total, _knowledge_hits_flushed_at
+    with _knowledge_hits_lock:
+        due = (
+            force
+            or _knowledge_hits_total >= KNOWLEDGE_HITS_FLUSH_SIZE
+            or time.monotonic() - _knowledge_hits_flushed_at >= KNOWLEDGE_HITS_FLUSH_INTERVAL
+        )
+        if not due:
+            return
+        pending, _knowledge_hits = _knowledge_hits, {}
+        _knowledge_hits_total = 0
+        _knowledge_hits_flushed_at = time.monotonic()
+    if not pending:
+        return
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        execute_values(
+            cur,
+            """UPDATE duwdu_knowledge AS k SET used_count = k.used_count + v.hits
+               FROM (VALUES %s) AS v(question_key, hits)
+               WHERE k.question_key = v.question_key""",
+            sorted(pending.items()),
+            template='(%s::char(32), %s::integer)'
+        )
+        conn.commit()
+        cur.close()
+    except psycopg2.Error as e:
+        print(f"[knowledge-hits] flush failed, re-buffering {len(pending)} keys: {e}")
+        with _knowledge_hits_lock:
+            for key, hits in pending.items():
+                _knowledge_hits[key] = _knowledge_hits.get(key, 0) + hits
+                _knowledge_hits_total += hits
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+atexit.register(flush_knowledge_hits, True)
+
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', '2048'))
+ANSWER_CACHE_TTL = float(os.environ.get('ANSWER_CACHE_TTL', '300'))
+ANSWER_CACHE_NEGATIVE_TTL = float(os.environ.get('ANSWER_CACHE_NEGATIVE_TTL', '2'))
+KNOWLEDGE_CHANNEL = 'duwdu_knowledge_changed'
+INTENTS_CHANNEL = 'duwdu_intents_changed'
+
+class AnswerCache:
+    """
+    Bounded LRU of question_key -> answer with TTL; None marks a known miss.
+    An answer borrowed from a similar question is put with that question's key as
+    its source, so invalidating the source drops the borrowed copies too.
+    """
+    
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries: 'OrderedDict[str, Tuple[Optional[str], float, Optional[str]]]' = OrderedDict()
+        self.aliases: Dict[str, Set[str]] = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+    
+    def get(self, key: str) -> Tuple[bool, Optional[str]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return False, None
+            answer, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.stats['hits' if answer is not None else 'negative_hits'] += 1
+            return True, answer
+    
+    def put(self, key: str, answer: Optional[str], source: Optional[str] = None) -> None:
+        ttl = self.ttl if answer is not None else self.negative_ttl
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (answer, time.monotonic() + ttl, source)
+            if source is not None:
+                self.aliases.setdefault(source, set()).add(key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+    
+    def _remove(self, key: str) -> bool:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        source = entry[2]
+        if source is not None and source in self.aliases:
+            self.aliases[source].discard(key)
+            if not self.aliases[source]:
+                del self.aliases[source]
+        return True
+    
+    def invalidate(self, key: str) -> None:
+        with self.lock:
+            for alias in self.aliases.pop(key, ()):
+                if self._remove(alias):
+                    self.stats['invalidations'] += 1
+            if self._remove(key):
+                self.stats['invalidations'] += 1
+    
+    def clear(self) -> None:
+        with self.lock:
+            self.stats['invalidations'] += len(self.entries)
+            self.entries.clear()
+            self.aliases.clear()
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.stats, 'size': len(self.entries), 'aliases': sum(len(keys) for keys in self.aliases.values())}
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_NEGATIVE_TTL)
+KNOWLEDGE_LISTENER_CONNECT_TIMEOUT = int(os.environ.get('KNOWLEDGE_LISTENER_CONNECT_TIMEOUT', '2'))
+KNOWLEDGE_LISTENER_RETRY = float(os.environ.get('KNOWLEDGE_LISTENER_RETRY', '30'))
+
+_knowledge_listener: Any = None
+_knowledge_listener_retry_at = float('-inf')
+_knowledge_listener_lock = threading.Lock()
+
+def apply_knowledge_notifications() -> None:
+    """
+    Drop cached answers and intents edited on any instance (LISTEN/NOTIFY from V0007/V0008 triggers).
+    After a failed connect the listener waits KNOWLEDGE_LISTENER_RETRY seconds before trying
+    again; cached answers stay in use meanwhile (bounded by their TTL) and are dropped once
+    the listener is back, since notifications sent in between were missed. One thread at a
+    time uses the connection; the others skip this round rather than wait for it.
+    """
+    global _knowledge_listener, _knowledge_listener_retry_at, _intents_loaded_at
+    import_psycopg2()
+    if not _knowledge_listener_lock.acquire(blocking=False):
+        return
+    try:
+        if _knowledge_listener is None or _knowledge_listener.closed:
+            if time.monotonic() < _knowledge_listener_retry_at:
+                return
+            _knowledge_listener = dbpool.connect_db(KNOWLEDGE_LISTENER_CONNECT_TIMEOUT)
+            _knowledge_listener.autocommit = True
+            cur = _knowledge_listener.cursor()
+            cur.execute(f"LISTEN {KNOWLEDGE_CHANNEL}; LISTEN {INTENTS_CHANNEL}")
+            cur.close()
+            # Anything edited while we were not listening may be cached stale
+            answer_cache.clear()
+            _intents_loaded_at = float('-inf')
+            return
+        _knowledge_listener.poll()
+        for notify in _knowledge_listener.notifies:
+            if notify.channel == INTENTS_CHANNEL:
+                _intents_loaded_at = float('-inf')
+            else:
+                answer_cache.invalidate(notify.payload)
+        _knowledge_listener.notifies.clear()
+    except psycopg2.Error as e:
+        print(f"[answer-cache] listener failed, retrying in {KNOWLEDGE_LISTENER_RETRY:.0f}s: {e}")
+        if _knowledge_listener is not None and not _knowledge_listener.closed:
+            _knowledge_listener.close()
+        _knowledge_listener = None
+        _knowledge_listener_retry_at = time.monotonic() + KNOWLEDGE_LISTENER_RETRY
+    finally:
+        _knowledge_listener_lock.release()
+
+# Mount on persistent storage to let cold instances start from the saved index; in the
+# default tempdir it survives only warm restarts and the timer trigger rebuilds it
+KNOWLEDGE_INDEX_DIR = os.environ.get('KNOWLEDGE_INDEX_DIR', os.path.join(tempfile.gettempdir(), 'duwdu_knowledge_index'))
+KNOWLEDGE_INDEX_SYNC = float(os.environ.get('KNOWLEDGE_INDEX_SYNC', '30'))
+KNOWLEDGE_INDEX_BATCH = int(os.environ.get('KNOWLEDGE_INDEX_BATCH', '2000'))
+KNOWLEDGE_MATCH_THRESHOLD = float(os.environ.get('KNOWLEDGE_MATCH_THRESHOLD', '0.9'))
+KNOWLEDGE_MATCH_CANDIDATES = 3
+NUMBER_TOKEN = re.compile(r'\d+')
+
+knowledge_index: Any = None
+_knowledge_index_opened = False
+_knowledge_index_synced_at = float('-inf')
+_knowledge_index_caught_up = False
+_knowledge_index_lock = threading.Lock()
+
+def open_knowledge_index() -> Any:
+    """
+    Load the persisted index on the first fuzzy lookup rather than at import:
+    numpy is the largest import of this function and exact-key hits never need it.
+    None when numpy is unavailable.
+    """
+    global knowledge_index, _knowledge_index_opened
+    if _knowledge_index_opened:
+        return knowledge_index
+    with _knowledge_index_lock:
+        if not _knowledge_index_opened:
+            try:
+                with span('import'):
+                    from knowledge_index import KnowledgeIndex
+            except ImportError:
+                KnowledgeIndex = None
+            if KnowledgeIndex is not None:
+                index = KnowledgeIndex(KNOWLEDGE_INDEX_DIR)
+                try:
+                    index.load()
+                except (OSError, ValueError) as e:
+                    print(f"[knowledge-index] persisted index unusable, rebuilding: {e}")
+                    index = KnowledgeIndex(KNOWLEDGE_INDEX_DIR)
+                knowledge_index = index
+            _knowledge_index_opened = True
+    return knowledge_index
+
+def sync_knowledge_index(conn: Any, force: bool = False, max_batches: Optional[int] = 1) -> bool:
+    """
+    Pull rows inserted by any instance since the index watermark, KNOWLEDGE_INDEX_BATCH
+    at a time: requests add one batch each, the timer trigger (max_batches=None) catches
+    up completely. Returns whether the index has caught up with the table.
+    """
+    global _knowledge_index_synced_at, _knowledge_index_caught_up
+    if open_knowledge_index() is None:
+        return False
+    if not force and _knowledge_index_caught_up and time.monotonic() - _knowledge_index_synced_at < KNOWLEDGE_INDEX_SYNC:
+        return True
+    with _knowledge_index_lock:
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT id, question FROM duwdu_knowledge WHERE id > %s ORDER BY id LIMIT %s",
+                (knowledge_index.last_id, KNOWLEDGE_INDEX_BATCH)
+            )
+            rows = [(row['id'], normalize_question(row['question'])) for row in cur.fetchall()]
+            cur.close()
+            knowledge_index.add_many(rows)
+            batches += 1
+            _knowledge_index_caught_up = len(rows) < KNOWLEDGE_INDEX_BATCH
+            if _knowledge_index_caught_up:
+                break
+        knowledge_index.flush()
+        _knowledge_index_synced_at = time.monotonic()
+        return _knowledge_index_caught_up
+
+def find_similar_question(conn: Any, prompt: str) -> Optional[Dict[str, Any]]:
+    """
+    Closest stored question above KNOWLEDGE_MATCH_THRESHOLD with the same numbers in the
+    same order, with its answer. None while the index is still catching up.
+    """
+    if not sync_knowledge_index(conn):
+        return None
+    normalized = normalize_question(prompt)
+    matches = knowledge_index.search(normalized, k=KNOWLEDGE_MATCH_CANDIDATES, min_score=KNOWLEDGE_MATCH_THRESHOLD)
+    if not matches:
+        return None
+    cur = conn.cursor()
+    cur.execute("SELECT id, question, question_key, answer FROM duwdu_knowledge WHERE id = ANY(%s)", ([row_id for row_id, _ in matches],))
+    rows = {row['id']: row for row in cur.fetchall()}
+    cur.close()
+    numbers = NUMBER_TOKEN.findall(normalized)
+    for row_id, _ in matches:
+        row = rows.get(row_id)
+        if row is not None and NUMBER_TOKEN.findall(normalize_question(row['question'])) == numbers:
+            return row
+    return None
+
+INTENTS_REFRESH = float(os.environ.get('INTENTS_REFRESH', '300'))
+DEFAULT_ANSWER = 'Понял запрос "{prompt}". Обработано и сохранено в базу знаний 💡'
+
+# Used until duwdu_intents is readable; mirrors the V0008 seed
+DEFAULT_INTENTS = [
+    {'priority': 10, 'any_keywords': ['привет', 'здравствуй', 'hi'], 'all_keywords': [], 'answer': 'Привет! Чем займёмся сегодня? 🚀'},
+    {'priority': 20, 'any_keywords': ['как дела', 'how are you'], 'all_keywords': [], 'answer': 'Отлично! Готов помочь тебе 💪'},
+    {'priority': 30, 'any_keywords': ['спасибо', 'благодар'], 'all_keywords': [], 'answer': 'Всегда пожалуйста! 😊'},
+    {'priority': 40, 'any_keywords': ['кто ты', 'что ты'], 'all_keywords': [], 'answer': 'Я DUWDU — нейросеть, которая учится на твоих вопросах'},
+    {'priority': 50, 'any_keywords': [], 'all_keywords': ['каша', 'гречн'], 'answer': '1. Промой стакан гречки\n2. Вскипяти 2 стакана воды, добавь гречку\n3. Вари 10 минут\n4. Добавь 2 стакана молока и сахар\n5. Вари 5-7 минут\n6. Готово! 🍚'},
+    {'priority': 60, 'any_keywords': ['реферат', 'сочинение'], 'all_keywords': [], 'answer': 'Конечно! Вот структура:\n\n1. Введение\n2. Основная часть\n3. Заключение\n\nТема раскрыта полностью с примерами и выводами 📝'},
+    {'priority': 70, 'any_keywords': ['?'], 'all_keywords': [], 'answer': 'Отличный вопрос! По теме "{prompt}" могу сказать: это требует внимательного рассмотрения. Основные аспекты учтены ✅'},
+]
+
+intent_matcher = IntentMatcher(DEFAULT_INTENTS)
+_intents_loaded_at = float('-inf')
+
+def load_intents(conn: Any) -> None:
+    """Recompile the matcher from duwdu_intents when notified or every INTENTS_REFRESH seconds"""
+    global intent_matcher, _intents_loaded_at
+    if time.monotonic() - _intents_loaded_at < INTENTS_REFRESH:
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, priority, any_keywords, all_keywords, answer FROM duwdu_intents WHERE is_active ORDER BY priority, id"
+        )
+        intent_matcher = IntentMatcher([
+            {
+                **row,
+                'any_keywords': [keyword.lower() for keyword in row['any_keywords']],
+                'all_keywords': [keyword.lower() for keyword in row['all_keywords']]
+            }
+            for row in cur.fetchall()
+        ])
+        cur.close()
+    except psycopg2.Error as e:
+        print(f"[intents] load failed, keeping {len(intent_matcher.intents)} compiled intents: {e}")
+        conn.rollback()
+    _intents_loaded_at = time.monotonic()
+
+def answer_from_intents(conn: Any, prompt: str) -> str:
+    load_intents(conn)
+    intent = intent_matcher.match(prompt.lower())
+    template = intent['answer'] if intent else DEFAULT_ANSWER
+    return template.replace('{prompt}', prompt[:50])
+
+CORS_PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+
+def refresh_knowledge_index() -> Dict[str, Any]:
+    """Timer trigger: bring the index up to date off the request path"""
+    if open_knowledge_index() is None:
+        return {'available': False}
+    conn = None
+    try:
+        conn = get_db_connection()
+        caught_up = sync_knowledge_index(conn, force=True, max_batches=None)
+        return {'available': True, 'rows': knowledge_index.count, 'caughtUp': caught_up}
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+MODULES = frozenset({'text', 'stats', 'webgen', 'imaging', 'voice'})
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: DUWDU - нейросеть сквозь время с реальной генерацией контента
-    Args: event with httpMethod, body with module, prompt/text
+    Args: event with httpMethod, body with module, prompt/text;
+          GET with ?blob=<sha256>[&variant=thumb] serves a stored image;
+          a timer trigger event (any event without httpMethod; give this function a trigger,
+          e.g. every minute) brings the knowledge index up to date
     Returns: HTTP response with AI-generated content
     '''
+    if 'httpMethod' not in event:
+        label('index')
+        return {'statusCode': 200, 'body': json.dumps({'knowledgeIndex': refresh_knowledge_index()})}
+    
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': dict(CORS_PREFLIGHT_HEADERS),
             'body': ''
         }
     
+    if method == 'GET' and 'blob' in (event.get('queryStringParameters') or {}):
+        label('blob')
+        return serve_blob(blob_store, event)
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -39,11 +434,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     body = json.loads(event.get('body', '{}'))
     module = body.get('module', 'text')
+    label(module, MODULES)
+    
+    token = get_session_token(event, body)
+    if token and verify_session_token(token) is None:
+        return {
+            'statusCode': 401,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Invalid or expired token'})
+        }
     
     if module == 'text':
-        return handle_text_ai(body)
+        response = handle_text_ai(body)
+        flush_knowledge_hits()
+        return response
+    elif module == 'stats':
+        return {
+            'statusCode': 200,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'answerCache': answer_cache.snapshot(), 'blobStore': blob_store.snapshot(), 'dbPool': db_pool_stats(), 'timings': metrics_snapshot()})
+        }
     elif module == 'webgen':
-        return handle_website_generation(body)
+        return handle_website_generation(body, event.get('headers') or {})
     elif module == 'imaging':
         return handle_image_generation(body)
     elif module == 'voice':
@@ -66,58 +478,62 @@ def handle_text_ai(body: Dict[str, Any]) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Prompt is required'})
         }
     
+    key = question_key(prompt)
+    apply_knowledge_notifications()
+    cached, cached_answer = answer_cache.get(key)
+    
+    if cached_answer is not None:
+        record_knowledge_hit(key)
+        return {
+            'statusCode': 200,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'response': cached_answer})
+        }
+    
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         
-        cur.execute(
-            "SELECT answer FROM duwdu_knowledge WHERE LOWER(question) = LOWER(%s)",
-            (prompt,)
-        )
-        result = cur.fetchone()
-        
-        if result:
-            cur.execute(
-                "UPDATE duwdu_knowledge SET used_count = used_count + 1 WHERE LOWER(question) = LOWER(%s)",
-                (prompt,)
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
+        if not cached:
+            cur.execute("SELECT answer FROM duwdu_knowledge WHERE question_key = %s", (key,))
+            result = cur.fetchone()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'response': result['answer']})
-            }
-        
-        prompt_lower = prompt.lower()
-        answer = ''
+            if result:
+                answer_cache.put(key, result['answer'])
+                record_knowledge_hit(key)
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'response': result['answer']})
+                }
+            
+            answer_cache.put(key, None)
+            
+            similar = find_similar_question(conn, prompt)
+            if similar:
+                answer_cache.put(key, similar['answer'], source=similar['question_key'])
+                record_knowledge_hit(similar['question_key'])
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'response': similar['answer']})
+                }
         
-        if 'привет' in prompt_lower or 'здравствуй' in prompt_lower or 'hi' in prompt_lower:
-            answer = 'Привет! Чем займёмся сегодня? 🚀'
-        elif 'как дела' in prompt_lower or 'how are you' in prompt_lower:
-            answer = 'Отлично! Готов помочь тебе 💪'
-        elif 'спасибо' in prompt_lower or 'благодар' in prompt_lower:
-            answer = 'Всегда пожалуйста! 😊'
-        elif 'кто ты' in prompt_lower or 'что ты' in prompt_lower:
-            answer = 'Я DUWDU — нейросеть, которая учится на твоих вопросах'
-        elif 'каша' in prompt_lower and 'гречн' in prompt_lower:
-            answer = '1. Промой стакан гречки\n2. Вскипяти 2 стакана воды, добавь гречку\n3. Вари 10 минут\n4. Добавь 2 стакана молока и сахар\n5. Вари 5-7 минут\n6. Готово! 🍚'
-        elif 'реферат' in prompt_lower or 'сочинение' in prompt_lower:
-            answer = 'Конечно! Вот структура:\n\n1. Введение\n2. Основная часть\n3. Заключение\n\nТема раскрыта полностью с примерами и выводами 📝'
-        elif '?' in prompt:
-            answer = f'Отличный вопрос! По теме "{prompt[:50]}" могу сказать: это требует внимательного рассмотрения. Основные аспекты учтены ✅'
-        else:
-            answer = f'Понял запрос "{prompt[:50]}". Обработано и сохранено в базу знаний 💡'
+        answer = answer_from_intents(conn, prompt)
         
         cur.execute(
-            "INSERT INTO duwdu_knowledge (question, answer, source) VALUES (%s, %s, %s)",
-            (prompt, answer, 'duwdu_ai')
+            """INSERT INTO duwdu_knowledge (question, question_key, answer, source) VALUES (%s, %s, %s, %s)
+               ON CONFLICT (question_key) DO UPDATE SET used_count = duwdu_knowledge.used_count + 1
+               RETURNING id, answer""",
+            (prompt, key, answer, 'duwdu_ai')
         )
+        inserted = cur.fetchone()
+        answer = inserted['answer']
         conn.commit()
-        cur.close()
-        conn.close()
+        answer_cache.put(key, answer)
+        if knowledge_index is not None and _knowledge_index_caught_up and inserted['id'] > knowledge_index.last_id:
+            sync_knowledge_index(conn, force=True)
         
         return {
             'statusCode': 200,
@@ -131,8 +547,12 @@ def handle_text_ai(body: Dict[str, Any]) -> Dict[str, Any]:
             'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
             'body': json.dumps({'error': f'Error: {str(e)}'})
         }
+    
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
 
-def handle_website_generation(body: Dict[str, Any]) -> Dict[str, Any]:
+def handle_website_generation(body: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
     """DUWDU WebGen - создание любых сайтов как Юра"""
     prompt = body.get('prompt', '').strip()
     
@@ -143,161 +563,147 @@ def handle_website_generation(body: Dict[str, Any]) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Prompt is required'})
         }
     
-    prompt_lower = prompt.lower()
     title = prompt.replace('создай', '').replace('сделай', '').replace('сайт', '').strip()
+    etag = WEBGEN_PAGE.etag(title=title, prompt=prompt)
+    encoding = negotiate_encoding(headers)
+    encoded_etag = f'{etag[:-1]}-{encoding}"' if encoding else etag
+    response_headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json',
+        'ETag': encoded_etag,
+        'Vary': 'Accept-Encoding'
+    }
+    if encoding:
+        response_headers['Content-Encoding'] = encoding
     
-    html = f'''<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{title} - DUWDU WebGen</title>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{ 
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; 
-            background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
-            color: #fff;
-            min-height: 100vh;
-        }}
-        header {{ 
-            background: rgba(139, 92, 246, 0.2);
-            backdrop-filter: blur(10px);
-            padding: 40px 20px; 
-            text-align: center;
-            border-bottom: 2px solid rgba(139, 92, 246, 0.3);
-        }}
-        h1 {{ 
-            font-size: 3em; 
-            background: linear-gradient(90deg, #a78bfa, #8b5cf6);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            margin-bottom: 15px;
-        }}
-        .tagline {{ font-size: 1.2em; opacity: 0.9; color: #c4b5fd; }}
-        .container {{ 
-            max-width: 1200px; 
-            margin: 50px auto; 
-            padding: 40px;
-        }}
-        .content {{
-            background: rgba(139, 92, 246, 0.1);
-            backdrop-filter: blur(10px);
-            border: 1px solid rgba(139, 92, 246, 0.3);
-            border-radius: 20px;
-            padding: 40px;
-            margin: 30px 0;
-        }}
-        .content h2 {{ color: #a78bfa; margin-bottom: 20px; }}
-        .content p {{ line-height: 1.8; margin: 15px 0; color: #e0e7ff; }}
-        .features {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(280px, 1fr));
-            gap: 30px;
-            margin-top: 40px;
-        }}
-        .feature {{
-            background: rgba(139, 92, 246, 0.15);
-            padding: 30px;
-            border-radius: 15px;
-            border: 1px solid rgba(139, 92, 246, 0.3);
-            transition: all 0.3s;
-        }}
-        .feature:hover {{
-            transform: translateY(-10px);
-            background: rgba(139, 92, 246, 0.25);
-            box-shadow: 0 10px 30px rgba(139, 92, 246, 0.3);
-        }}
-        .feature h3 {{ 
-            color: #c4b5fd; 
-            margin-bottom: 15px; 
-            font-size: 1.4em;
-        }}
-        button {{
-            background: linear-gradient(90deg, #8b5cf6, #a78bfa);
-            color: white;
-            border: none;
-            padding: 15px 40px;
-            border-radius: 30px;
-            font-size: 1.1em;
-            cursor: pointer;
-            transition: all 0.3s;
-            margin: 20px 10px;
-        }}
-        button:hover {{
-            transform: scale(1.05);
-            box-shadow: 0 5px 20px rgba(139, 92, 246, 0.5);
-        }}
-        footer {{
-            text-align: center;
-            padding: 30px;
-            background: rgba(0,0,0,0.3);
-            margin-top: 50px;
-            border-top: 1px solid rgba(139, 92, 246, 0.3);
-        }}
-        @media (max-width: 768px) {{
-            h1 {{ font-size: 2em; }}
-            .features {{ grid-template-columns: 1fr; }}
-        }}
-    </style>
-</head>
-<body>
-    <header>
-        <h1>✨ {title}</h1>
-        <p class="tagline">Создано нейросетью DUWDU</p>
-    </header>
-    
-    <div class="container">
-        <div class="content">
-            <h2>О проекте</h2>
-            <p>Добро пожаловать на сайт, созданный искусственным интеллектом DUWDU специально по вашему запросу!</p>
-            <p>Этот сайт разработан с использованием современных технологий и адаптирован для всех устройств.</p>
-        </div>
-        
-        <div class="features">
-            <div class="feature">
-                <h3>⚡ Быстрая загрузка</h3>
-                <p>Оптимизированный код обеспечивает мгновенную загрузку страниц</p>
-            </div>
-            
-            <div class="feature">
-                <h3>📱 Адаптивный дизайн</h3>
-                <p>Идеально работает на телефонах, планшетах и компьютерах</p>
-            </div>
-            
-            <div class="feature">
-                <h3>🎨 Современный стиль</h3>
-                <p>Чёрно-фиолетовая палитра с эффектами размытия</p>
-            </div>
-            
-            <div class="feature">
-                <h3>🚀 Готов к запуску</h3>
-                <p>Можно сразу использовать или доработать под свои нужды</p>
-            </div>
-        </div>
-        
-        <div style="text-align: center; margin-top: 40px;">
-            <button onclick="alert('Спасибо, что используете DUWDU! 🚀')">Узнать больше</button>
-            <button onclick="alert('Свяжитесь с нами!')">Контакты</button>
-        </div>
-    </div>
-    
-    <footer>
-        <p>🌟 Создано нейросетью DUWDU WebGen</p>
-        <p style="opacity: 0.7; margin-top: 10px;">Запрос: "{prompt}"</p>
-    </footer>
-</body>
-</html>'''
+    if request_header(headers, 'if-none-match') == encoded_etag:
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+    
+    with span('render'):
+        html = WEBGEN_PAGE.render(title=title, prompt=prompt)
+    payload = dumps({
+        'html': html,
+        'message': f'Сайт "{title}" создан! Открой в новом окне'
+    })
+    
+    if encoding:
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': compressed_body(etag, encoding, payload.encode()),
+            'isBase64Encoded': True
+        }
     
     return {
         'statusCode': 200,
-        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-        'body': json.dumps({
-            'html': html,
-            'message': f'Сайт "{title}" создан! Открой в новом окне'
-        })
+        'headers': response_headers,
+        'body': payload
     }
 
+BLOB_DOWNLOAD_TIMEOUT = float(os.environ.get('BLOB_DOWNLOAD_TIMEOUT', '10'))
+BLOB_INGEST_RETRY = int(os.environ.get('BLOB_INGEST_RETRY', '86400'))
+BLOB_PUBLIC_URL = os.environ.get('BLOB_PUBLIC_URL', 'https://functions.poehali.dev/3d0e0115-283a-4cdf-9d1e-0cb406ac4bf8').rstrip('/')
+
+blob_store = BlobStore(BLOB_STORE_DIR, BLOB_STORE_QUOTA)
+
+def blob_url(digest: str, variant: str = '') -> str:
+    return f'{BLOB_PUBLIC_URL}?blob={digest}' + (f'&variant={variant}' if variant else '')
+
+def download_media(url: str) -> bytes:
+    """Fetch an external asset once for ingest, refusing anything over BLOB_MAX_BYTES"""
+    import urllib.request
+    with span('download'):
+        with urllib.request.urlopen(url, timeout=BLOB_DOWNLOAD_TIMEOUT) as response:
+            content = response.read(BLOB_MAX_BYTES + 1)
+    if len(content) > BLOB_MAX_BYTES:
+        raise ValueError(f'media larger than {BLOB_MAX_BYTES} bytes')
+    return content
+
+def ingest_media(url: str) -> Optional[str]:
+    """Download and store an external image; None (keep serving the URL) if that fails"""
+    try:
+        return store_blob(blob_store, download_media(url))
+    except Exception as e:
+        print(f"[blobs] ingest of {url} failed: {e}")
+        return None
+
+def find_or_create_media(prompt: str, media_type: str) -> Tuple[str, bool]:
+    """
+    (url, created) for a prompt. The unique (LOWER(prompt), type) index makes the
+    INSERT the cross-instance claim: a worker that loses the race reads the winner's row.
+    Images are ingested into the blob store and answered with our own URL from then on;
+    videos keep their external URL. Only the worker that stamps ingest_attempted_at
+    downloads, after its transaction is committed, and a failed ingest is not retried
+    for BLOB_INGEST_RETRY seconds.
+    """
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        
+        cur.execute(
+            "SELECT id, image_url, blob_sha256 FROM duwdu_images WHERE LOWER(prompt) = LOWER(%s) AND type = %s LIMIT 1",
+            (prompt, media_type)
+        )
+        row = cur.fetchone()
+        created = claimed = False
+        
+        if row:
+            if row['blob_sha256'] is None and media_type == 'image':
+                # Rows from before the blob store (or whose ingest failed) point at the external URL
+                cur.execute(
+                    """UPDATE duwdu_images SET ingest_attempted_at = NOW()
+                       WHERE id = %s AND blob_sha256 IS NULL
+                         AND (ingest_attempted_at IS NULL OR ingest_attempted_at < NOW() - %s * INTERVAL '1 second')""",
+                    (row['id'], BLOB_INGEST_RETRY)
+                )
+                claimed = cur.rowcount == 1
+        else:
+            if media_type == 'image':
+                colors = ['667eea', '764ba2', '8b5cf6', 'a78bfa', 'ec4899', '06b6d4']
+                color = random.choice(colors)
+                encoded_text = quote(prompt[:30], safe='')
+                image_url = f'https://via.placeholder.com/1024x1024/{color}/ffffff?text={encoded_text}'
+            else:
+                image_url = 'https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4'
+            
+            cur.execute(
+                """INSERT INTO duwdu_images (prompt, image_url, type, ingest_attempted_at)
+                   VALUES (%s, %s, %s, CASE WHEN %s = 'image' THEN NOW() END)
+                   ON CONFLICT (LOWER(prompt), type) DO NOTHING
+                   RETURNING id, image_url, blob_sha256""",
+                (prompt, image_url, media_type, media_type)
+            )
+            row = cur.fetchone()
+            created = row is not None
+            claimed = created and media_type == 'image'
+            if not created:
+                cur.execute(
+                    "SELECT id, image_url, blob_sha256 FROM duwdu_images WHERE LOWER(prompt) = LOWER(%s) AND type = %s LIMIT 1",
+                    (prompt, media_type)
+                )
+                row = cur.fetchone()
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    
+    if row['blob_sha256']:
+        return blob_url(row['blob_sha256']), created
+    if not claimed:
+        return row['image_url'], created
+    
+    digest = ingest_media(row['image_url'])
+    if digest is None:
+        return row['image_url'], created
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE duwdu_images SET blob_sha256 = %s WHERE id = %s", (digest, row['id']))
+        conn.commit()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+    return blob_url(digest), created
+
 def handle_image_generation(body: Dict[str, Any]) -> Dict[str, Any]:
     """DUWDU Imaging - генерация изображений ИЛИ видео"""
     prompt = body.get('prompt', '').strip()
@@ -311,53 +717,10 @@ def handle_image_generation(body: Dict[str, Any]) -> Dict[str, Any]:
         }
     
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            "SELECT image_url FROM duwdu_images WHERE LOWER(prompt) = LOWER(%s) AND type = %s LIMIT 1",
-            (prompt, media_type)
-        )
-        result = cur.fetchone()
-        
-        if result:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 200,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({
-                    'url': result['image_url'],
-                    'type': media_type,
-                    'message': f'Найдено в базе'
-                })
-            }
-        
-        if media_type == 'image':
-            colors = ['667eea', '764ba2', '8b5cf6', 'a78bfa', 'ec4899', '06b6d4']
-            color = random.choice(colors)
-            encoded_text = prompt[:30].replace(' ', '+')
-            image_url = f'https://via.placeholder.com/1024x1024/{color}/ffffff?text={encoded_text}'
-        else:
-            image_url = 'https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4'
-        
-        cur.execute(
-            "INSERT INTO duwdu_images (prompt, image_url, type) VALUES (%s, %s, %s)",
-            (prompt, image_url, media_type)
+        image_url, created = single_flight(
+            f'{media_type}:{prompt.lower()}',
+            lambda: find_or_create_media(prompt, media_type)
         )
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-            'body': json.dumps({
-                'url': image_url,
-                'type': media_type,
-                'message': f'Создано через Шедеврум: {prompt}'
-            })
-        }
     
     except Exception as e:
         return {
@@ -365,6 +728,17 @@ def handle_image_generation(body: Dict[str, Any]) -> Dict[str, Any]:
             'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
             'body': json.dumps({'error': f'Error: {str(e)}'})
         }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'url': image_url,
+            'thumbnailUrl': f'{image_url}&variant=thumb' if image_url.startswith(f'{BLOB_PUBLIC_URL}?blob=') else None,
+            'type': media_type,
+            'message': f'Создано через Шедеврум: {prompt}' if created else f'Найдено в базе'
+        })
+    }
 
 def handle_voice_synthesis(body: Dict[str, Any]) -> Dict[str, Any]:
     """DUWDU Voice - озвучка текста реальным аудио"""
@@ -378,6 +752,7 @@ def handle_voice_synthesis(body: Dict[str, Any]) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Text is required'})
         }
     
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -404,9 +779,6 @@ def handle_voice_synthesis(body: Dict[str, Any]) -> Dict[str, Any]:
             )
             conn.commit()
         
-        cur.close()
-        conn.close()
-        
         voice_names = {
             'male': 'Мужской',
             'female': 'Женский',
@@ -430,3 +802,7 @@ def handle_voice_synthesis(body: Dict[str, Any]) -> Dict[str, Any]:
             'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
             'body': json.dumps({'error': f'Error: {str(e)}'})
         }
+    
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
@@ -0,0 +1,75 @@
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+class IntentMatcher:
+    '''
+    Keyword intents compiled into one Aho-Corasick automaton.
+    An intent matches when any of its any_keywords (or none are given) and all of
+    its all_keywords occur in the text; among matches the lowest priority wins.
+    Scanning is a single pass over the text, independent of the number of intents.
+    '''
+
+    def __init__(self, intents: Iterable[Dict[str, Any]]):
+        self.intents = sorted(
+            (intent for intent in intents if intent['any_keywords'] or intent['all_keywords']),
+            key=lambda intent: (intent['priority'], intent.get('id', 0))
+        )
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+        self.keyword_intents: Dict[str, List[int]] = {}
+        for position, intent in enumerate(self.intents):
+            for keyword in set(intent['any_keywords']) | set(intent['all_keywords']):
+                if position not in self.keyword_intents.setdefault(keyword, []):
+                    self.keyword_intents[keyword].append(position)
+        for keyword in self.keyword_intents:
+            self._insert(keyword)
+        self._link()
+
+    def _insert(self, keyword: str) -> None:
+        state = 0
+        for char in keyword:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(keyword)
+
+    def _link(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def keywords_in(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """Highest-priority intent satisfied by the text, or None"""
+        found = self.keywords_in(text)
+        candidates = sorted({position for keyword in found for position in self.keyword_intents[keyword]})
+        for position in candidates:
+            intent = self.intents[position]
+            if intent['any_keywords'] and not found.intersection(intent['any_keywords']):
+                continue
+            if not found.issuperset(intent['all_keywords']):
+                continue
+            return intent
+        return None
@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 2
+# Fraction of rows added since the last weighting that triggers a new one
+REWEIGH_GROWTH = 0.01
+
+class _Weights:
+    """TF-IDF weighting of the first `count` rows; replaced as a whole, never modified"""
+    __slots__ = ('count', 'idf', 'row_weights', 'postings_start', 'postings_rows', 'postings_weights')
+
+    def __init__(self, count: int, idf: np.ndarray, row_weights: np.ndarray, postings_start: np.ndarray,
+                 postings_rows: np.ndarray, postings_weights: np.ndarray):
+        self.count = count
+        self.idf = idf
+        self.row_weights = row_weights
+        self.postings_start = postings_start
+        self.postings_rows = postings_rows
+        self.postings_weights = postings_weights
+
+class KnowledgeIndex:
+    '''
+    Character n-gram TF-IDF vectors for approximate question matching.
+    N-grams are hashed into `dim` buckets and rows are stored sparsely (CSR of raw
+    n-gram counts), so a search only touches the posting lists of the query's own
+    n-grams. IDF weights and row norms are derived from the raw counts at search time,
+    recomputed for all rows once the index has grown by REWEIGH_GROWTH since the last
+    weighting, so IDF never drifts further than that from the whole index. Searches
+    may run while rows are added.
+    Files in `path`: ids.i64, indptr.i64, indices.i32 and counts.f32 (appended),
+    df.npy and meta.json (row count is committed last, so a crash only loses rows
+    that the next sync re-adds).
+    '''
+
+    def __init__(self, path: Optional[str], dim: int = 1 << 18, ngram: int = 3):
+        self.path = path
+        self.dim = dim
+        self.ngram = ngram
+        self.count = 0
+        self.last_id = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.counts = np.zeros(0, dtype=np.float32)
+        self.df = np.zeros(dim, dtype=np.float64)
+        self._persisted = 0
+        self._weights: Optional[_Weights] = None
+        self._lock = threading.Lock()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def load(self) -> bool:
+        """Read a persisted index; returns False if there is none to reuse"""
+        if not self.path or not os.path.exists(self._file('meta.json')):
+            return False
+        with open(self._file('meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION or meta['dim'] != self.dim or meta['ngram'] != self.ngram:
+            return False
+        count, nnz = meta['count'], meta['nnz']
+        self.ids = np.fromfile(self._file('ids.i64'), dtype=np.int64, count=count)
+        self.indptr = np.fromfile(self._file('indptr.i64'), dtype=np.int64, count=count + 1)
+        self.indices = np.fromfile(self._file('indices.i32'), dtype=np.int32, count=nnz)
+        self.counts = np.fromfile(self._file('counts.f32'), dtype=np.float32, count=nnz)
+        if len(self.ids) != count or len(self.indptr) != count + 1 or len(self.indices) != nnz or len(self.counts) != nnz:
+            raise ValueError('index files are shorter than meta.json')
+        self.df = np.load(self._file('df.npy'))
+        self.count = self._persisted = count
+        self.last_id = meta['last_id']
+        self._weights = None
+        return True
+
+    def flush(self) -> None:
+        """Append rows added since the last flush, then commit the row count"""
+        if not self.path or self._persisted == self.count:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        done, nnz = self._persisted, int(self.indptr[self._persisted])
+        # Appends start at the committed sizes, dropping anything an interrupted flush left behind
+        self._append('ids.i64', done * 8, self.ids[done:self.count])
+        self._append('indptr.i64', (done + 1) * 8 if done else 0, self.indptr[done + 1 if done else 0:self.count + 1])
+        self._append('indices.i32', nnz * 4, self.indices[nnz:self.indptr[self.count]])
+        self._append('counts.f32', nnz * 4, self.counts[nnz:self.indptr[self.count]])
+        np.save(self._file('df.npy'), self.df)
+        meta = {
+            'version': FORMAT_VERSION, 'dim': self.dim, 'ngram': self.ngram,
+            'count': self.count, 'nnz': int(self.indptr[self.count]), 'last_id': self.last_id
+        }
+        with open(self._file('meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(self._file('meta.json.tmp'), self._file('meta.json'))
+        self._persisted = self.count
+
+    def _append(self, name: str, committed: int, values: np.ndarray) -> None:
+        with open(self._file(name), 'r+b' if committed else 'wb') as f:
+            f.truncate(committed)
+            f.seek(committed)
+            f.write(np.ascontiguousarray(values).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _grams(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(row number, bucket) of every n-gram of every text, all texts hashed in one pass"""
+        padded = [f' {text} ' for text in texts]
+        codes = np.frombuffer('\0'.join(padded).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        lengths = np.array([len(text) + 1 for text in padded], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        windows = len(codes) - self.ngram + 1
+        if windows <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        hashed = np.zeros(windows, dtype=np.uint64)
+        separator = np.zeros(windows, dtype=bool)
+        for offset in range(self.ngram):
+            window = codes[offset:offset + windows]
+            hashed = hashed * np.uint64(0x100000001B3) ^ window
+            separator |= window == 0
+        hashed *= np.uint64(0x9E3779B97F4A7C15)
+        buckets = (hashed >> np.uint64(32)).astype(np.int64) % self.dim
+        positions = np.flatnonzero(~separator)
+        rows = np.searchsorted(starts, positions, side='right') - 1
+        return rows, buckets[positions]
+
+    def add_many(self, rows: Iterable[Tuple[int, str]]) -> None:
+        """Append normalized (row_id, text) pairs; the row count is published last"""
+        rows = list(rows)
+        if not rows:
+            return
+        row_numbers, buckets = self._grams([text for _, text in rows])
+        keys, counts = np.unique(row_numbers * self.dim + buckets, return_counts=True)
+        indices = (keys % self.dim).astype(np.int32)
+        per_row = np.bincount(keys // self.dim, minlength=len(rows))
+        with self._lock:
+            # New arrays keep the old rows as their prefix, so concurrent searches stay valid
+            self.df = self.df + np.bincount(indices, minlength=self.dim)
+            self.ids = np.concatenate((self.ids[:self.count], [row_id for row_id, _ in rows])).astype(np.int64)
+            self.indptr = np.concatenate((self.indptr[:self.count + 1], self.indptr[self.count] + np.cumsum(per_row)))
+            nnz = self.indptr[self.count]
+            self.indices = np.concatenate((self.indices[:nnz], indices))
+            self.counts = np.concatenate((self.counts[:nnz], counts.astype(np.float32)))
+            self.count += len(rows)
+            self.last_id = max(self.last_id, max(row_id for row_id, _ in rows))
+
+    def add(self, row_id: int, text: str) -> None:
+        self.add_many([(row_id, text)])
+
+    def _reweigh(self, count: int) -> _Weights:
+        """IDF from the current document frequencies, normalized rows, postings by bucket"""
+        with self._lock:
+            if self._weights is not None and self._weights.count >= count:
+                return self._weights
+            count, nnz = self.count, self.indptr[self.count]
+            indices = self.indices[:nnz]
+            idf = (np.log((1 + count) / (1 + self.df)) + 1).astype(np.float32)
+            row_of = np.repeat(np.arange(count, dtype=np.int64), np.diff(self.indptr[:count + 1]))
+            weights = self.counts[:nnz] * idf[indices]
+            norms = np.sqrt(np.bincount(row_of, weights * weights, minlength=count)).astype(np.float32)
+            weights /= np.maximum(norms, 1e-12)[row_of]
+            order = np.argsort(indices, kind='stable')
+            self._weights = _Weights(
+                count, idf, weights, np.searchsorted(indices[order], np.arange(self.dim + 1)), row_of[order], weights[order]
+            )
+            return self._weights
+
+    def search(self, text: str, k: int = 1, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        Top-k (row_id, cosine score) pairs scoring at least min_score, best first.
+        Weighting is recomputed once the index has grown by more than REWEIGH_GROWTH;
+        rows added since are scored directly with the current weighting's IDF.
+        With min_score set, only rows sharing one of the query's heaviest n-grams are
+        scored: a row missing all of them can reach at most the norm of the remaining
+        query weights, which the prefix is chosen to keep below min_score.
+        """
+        count = self.count
+        weighted = self._weights
+        if weighted is None or count - weighted.count > weighted.count * REWEIGH_GROWTH:
+            weighted = self._reweigh(count)
+        count = max(count, weighted.count)
+        if count == 0:
+            return []
+        _, buckets = self._grams([text])
+        if len(buckets) == 0:
+            return []
+        buckets, counts = np.unique(buckets, return_counts=True)
+        query = counts * weighted.idf[buckets]
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        heaviest = np.argsort(query)[::-1]
+        remaining = np.sqrt(np.cumsum((query[heaviest] ** 2)[::-1])[::-1])
+        prefix = heaviest[:max(1, int(np.count_nonzero(remaining >= min_score)))] if min_score > 0 else heaviest
+        lengths = weighted.postings_start[buckets + 1] - weighted.postings_start[buckets]
+        average_row = self.indptr[weighted.count] / max(weighted.count, 1)
+        if lengths[prefix].sum() * average_row < lengths.sum():
+            candidates = np.unique(np.concatenate([
+                weighted.postings_rows[weighted.postings_start[bucket]:weighted.postings_start[bucket + 1]]
+                for bucket in buckets[prefix]
+            ]))
+            scores = self._score_rows(weighted, candidates, buckets, query)
+        else:
+            candidates, scores = self._score_postings(weighted, buckets, query)
+        if count > weighted.count:
+            tail = np.arange(weighted.count, count)
+            candidates = np.concatenate((candidates, tail))
+            scores = np.concatenate((scores, self._score_rows(weighted, tail, buckets, query)))
+        if len(candidates) == 0:
+            return []
+        k = min(k, len(candidates))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(self.ids[candidates[i]]), float(scores[i])) for i in top if scores[i] > 0 and scores[i] >= min_score]
+
+    def _score_postings(self, weighted: _Weights, buckets: np.ndarray, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores of every weighted row, accumulated from the query buckets' posting lists"""
+        rows, weights = [], []
+        for bucket, weight in zip(buckets, query):
+            start, end = weighted.postings_start[bucket], weighted.postings_start[bucket + 1]
+            rows.append(weighted.postings_rows[start:end])
+            weights.append(weighted.postings_weights[start:end] * weight)
+        scores = np.bincount(np.concatenate(rows), np.concatenate(weights), minlength=weighted.count)
+        return np.arange(weighted.count), scores
+
+    def _score_rows(self, weighted: _Weights, rows: np.ndarray, buckets: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Exact scores of the given rows, all weighted or all added since the weighting"""
+        starts, lengths = self.indptr[rows], self.indptr[rows + 1] - self.indptr[rows]
+        owner = np.repeat(np.arange(len(rows)), lengths)
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        if len(rows) and rows[0] >= weighted.count:
+            row_weights = self.counts[entries] * weighted.idf[self.indices[entries]]
+            norms = np.sqrt(np.bincount(owner, row_weights * row_weights, minlength=len(rows)))
+            row_weights /= np.maximum(norms, 1e-12)[owner]
+        else:
+            row_weights = weighted.row_weights[entries]
+        # Query buckets are sorted, so each row entry finds its query weight by binary search
+        at = np.minimum(np.searchsorted(buckets, self.indices[entries]), len(buckets) - 1)
+        shared = buckets[at] == self.indices[entries]
+        return np.bincount(owner, np.where(shared, query[at] * row_weights, 0), minlength=len(rows))
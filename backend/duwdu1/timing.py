@@ -0,0 +1,192 @@
+import functools
+import json
+import math
+import threading
+import time
+from typing import Any, Callable, Collection, Dict, List, Optional
+
+HISTOGRAM_BASE_MS = 0.05
+HISTOGRAM_GROWTH = 1.1
+HISTOGRAM_BUCKETS = 160
+
+class Histogram:
+    '''
+    Log-scale latency histogram (10% wide buckets from 0.05 ms up to about
+    three minutes): constant memory, percentiles accurate to one bucket.
+    '''
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, ms: float) -> None:
+        index = 0 if ms <= HISTOGRAM_BASE_MS else int(math.log(ms / HISTOGRAM_BASE_MS, HISTOGRAM_GROWTH)) + 1
+        self.counts[min(index, HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += ms
+
+    def percentile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return round(HISTOGRAM_BASE_MS * HISTOGRAM_GROWTH ** index, 3)
+        return 0.0
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99)
+        }
+
+class RequestTimer:
+    __slots__ = ('label', 'started', 'spans')
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+_local = threading.local()
+_histograms: Dict[str, Histogram] = {}
+_histograms_lock = threading.Lock()
+
+def current() -> Optional[RequestTimer]:
+    return getattr(_local, 'timer', None)
+
+UNKNOWN_LABEL = 'unknown'
+HTTP_METHODS = frozenset({'get', 'head', 'post', 'put', 'patch', 'delete', 'options'})
+
+def label(name: Any, known: Optional[Collection[str]] = None) -> None:
+    '''
+    Name the current request for metrics, e.g. its module or action. Every label gets
+    its own histograms, so names taken from the request must be checked against
+    `known`; anything else is recorded as 'unknown'.
+    '''
+    timer = current()
+    if timer is not None:
+        timer.label = name if known is None or (isinstance(name, str) and name in known) else UNKNOWN_LABEL
+
+class span:
+    '''
+    Time a block into the current request: `with span('db'): ...`. Repeated names
+    add up and are reported with their count. A no-op outside a request.
+    '''
+    __slots__ = ('name', 'timer', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> 'span':
+        self.timer = getattr(_local, 'timer', None)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.timer is not None:
+            self.timer.add(self.name, time.perf_counter() - self.started)
+
+def dumps(obj: Any, **kwargs: Any) -> str:
+    """json.dumps timed as the 'serialize' span"""
+    with span('serialize'):
+        return json.dumps(obj, **kwargs)
+
+def _record(key: str, ms: float) -> None:
+    with _histograms_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.record(ms)
+
+def finish(timer: RequestTimer, response: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach Server-Timing, log one structured line and feed the histograms"""
+    total_ms = (time.perf_counter() - timer.started) * 1000
+    spans = {name: (seconds * 1000, count) for name, (seconds, count) in timer.spans.items()}
+    header = ', '.join(
+        [f'{name};dur={ms:.2f}' + (f';desc="x{count}"' if count > 1 else '') for name, (ms, count) in spans.items()]
+        + [f'total;dur={total_ms:.2f}']
+    )
+    response.setdefault('headers', {})
+    response['headers']['Server-Timing'] = header
+    response['headers']['Timing-Allow-Origin'] = '*'
+
+    _record(timer.label, total_ms)
+    for name, (ms, _) in spans.items():
+        _record(f'{timer.label}.{name}', ms)
+
+    print(json.dumps({
+        'event': 'request',
+        'module': timer.label,
+        'status': response.get('statusCode'),
+        'ms': round(total_ms, 2),
+        'spans': {name: round(ms, 2) for name, (ms, _) in spans.items()}
+    }))
+    return response
+
+def instrumented(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Wrap a function handler so every invocation is timed and reported"""
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        method = str(event.get('httpMethod', 'event')).lower()
+        timer = RequestTimer(method if method in HTTP_METHODS or method == 'event' else UNKNOWN_LABEL)
+        _local.timer = timer
+        try:
+            response = handler(event, context)
+        finally:
+            _local.timer = None
+        return finish(timer, response)
+    return wrapper
+
+def metrics_snapshot() -> Dict[str, Dict[str, float]]:
+    """Latency percentiles per request label and per label.span, in milliseconds"""
+    with _histograms_lock:
+        return {key: histogram.snapshot() for key, histogram in sorted(_histograms.items())}
+
+_cursor_classes: Dict[type, type] = {}
+
+def timed_cursor_class(base: type) -> type:
+    """Subclass of a psycopg2 cursor class whose execute/executemany are 'db' spans"""
+    timed = _cursor_classes.get(base)
+    if timed is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                with span('db'):
+                    return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                with span('db'):
+                    return super().executemany(query, vars_list)
+
+        timed = _cursor_classes[base] = TimedCursor
+    return timed
+
+_connection_class: Optional[type] = None
+
+def timed_connection_class() -> type:
+    """psycopg2 connection_factory whose cursors (of any cursor_factory) are timed"""
+    global _connection_class
+    if _connection_class is None:
+        import psycopg2.extensions
+
+        class TimedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+                kwargs['cursor_factory'] = timed_cursor_class(base)
+                return super().cursor(*args, **kwargs)
+
+        _connection_class = TimedConnection
+    return _connection_class
@@ -0,0 +1,238 @@
+import base64
+import gzip
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SLOT_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+STYLE_PATTERN = re.compile(r'(<style>)(.*?)(</style>)', re.S)
+CSS_PUNCTUATION = re.compile(r'\s*([{};:,>])\s*')
+BETWEEN_TAGS = re.compile(r'>\s+<')
+WHITESPACE_RUN = re.compile(r'\s+')
+COMPRESSED_CACHE_SIZE = 256
+
+def minify_html(source: str) -> str:
+    """Collapse whitespace in markup and tighten CSS punctuation inside <style>"""
+    source = STYLE_PATTERN.sub(
+        lambda m: m.group(1) + CSS_PUNCTUATION.sub(r'\1', WHITESPACE_RUN.sub(' ', m.group(2))).strip().replace(';}', '}') + m.group(3),
+        source
+    )
+    return WHITESPACE_RUN.sub(' ', BETWEEN_TAGS.sub('><', source)).strip()
+
+class PageTemplate:
+    '''
+    Static page split once into fragments around {{ slot }} placeholders.
+    Rendering only escapes the slot values and joins them with the prebuilt fragments.
+    '''
+    
+    def __init__(self, source: str, minify: bool = True):
+        compiled = minify_html(source) if minify else source
+        pieces = SLOT_PATTERN.split(compiled)
+        self.fragments: List[str] = pieces[0::2]
+        self.slots: List[str] = pieces[1::2]
+        self.version = hashlib.sha256(compiled.encode()).hexdigest()[:12]
+    
+    def render(self, **values: str) -> str:
+        escaped = {name: html.escape(str(value)) for name, value in values.items()}
+        parts = [self.fragments[0]]
+        for slot, fragment in zip(self.slots, self.fragments[1:]):
+            parts.append(escaped[slot])
+            parts.append(fragment)
+        return ''.join(parts)
+    
+    def etag(self, **values: str) -> str:
+        """Stable validator for this template version and slot values"""
+        digest = hashlib.sha256(self.version.encode())
+        for name in sorted(values):
+            digest.update(b'\0' + name.encode() + b'\0' + str(values[name]).encode())
+        return f'"{digest.hexdigest()[:20]}"'
+
+def negotiate_encoding(headers: Dict[str, str]) -> Optional[str]:
+    """Pick br or gzip from Accept-Encoding, honouring q=0"""
+    accept = next((value for name, value in headers.items() if name.lower() == 'accept-encoding'), '')
+    accepted = set()
+    for item in accept.split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.replace(' ', '').startswith('q=0') and not params.replace(' ', '').startswith('q=0.'):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+_compressed: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+_compressed_lock = threading.Lock()
+
+def compressed_body(etag: str, encoding: str, data: bytes) -> str:
+    """Base64 of the compressed body, cached per (ETag, encoding)"""
+    key = (etag, encoding)
+    with _compressed_lock:
+        if key in _compressed:
+            _compressed.move_to_end(key)
+            return _compressed[key]
+    encoded = base64.b64encode(compress(data, encoding)).decode()
+    with _compressed_lock:
+        _compressed[key] = encoded
+        while len(_compressed) > COMPRESSED_CACHE_SIZE:
+            _compressed.popitem(last=False)
+    return encoded
+
+WEBGEN_PAGE_SOURCE = '''<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ title }} - DUWDU WebGen</title>
+    <style>
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { 
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; 
+            background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
+            color: #fff;
+            min-height: 100vh;
+        }
+        header { 
+            background: rgba(139, 92, 246, 0.2);
+            backdrop-filter: blur(10px);
+            padding: 40px 20px; 
+            text-align: center;
+            border-bottom: 2px solid rgba(139, 92, 246, 0.3);
+        }
+        h1 { 
+            font-size: 3em; 
+            background: linear-gradient(90deg, #a78bfa, #8b5cf6);
+            -webkit-background-clip: text;
+            -webkit-text-fill-color: transparent;
+            margin-bottom: 15px;
+        }
+        .tagline { font-size: 1.2em; opacity: 0.9; color: #c4b5fd; }
+        .container { 
+            max-width: 1200px; 
+            margin: 50px auto; 
+            padding: 40px;
+        }
+        .content {
+            background: rgba(139, 92, 246, 0.1);
+            backdrop-filter: blur(10px);
+            border: 1px solid rgba(139, 92, 246, 0.3);
+            border-radius: 20px;
+            padding: 40px;
+            margin: 30px 0;
+        }
+        .content h2 { color: #a78bfa; margin-bottom: 20px; }
+        .content p { line-height: 1.8; margin: 15px 0; color: #e0e7ff; }
+        .features {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(280px, 1fr));
+            gap: 30px;
+            margin-top: 40px;
+        }
+        .feature {
+            background: rgba(139, 92, 246, 0.15);
+            padding: 30px;
+            border-radius: 15px;
+            border: 1px solid rgba(139, 92, 246, 0.3);
+            transition: all 0.3s;
+        }
+        .feature:hover {
+            transform: translateY(-10px);
+            background: rgba(139, 92, 246, 0.25);
+            box-shadow: 0 10px 30px rgba(139, 92, 246, 0.3);
+        }
+        .feature h3 { 
+            color: #c4b5fd; 
+            margin-bottom: 15px; 
+            font-size: 1.4em;
+        }
+        button {
+            background: linear-gradient(90deg, #8b5cf6, #a78bfa);
+            color: white;
+            border: none;
+            padding: 15px 40px;
+            border-radius: 30px;
+            font-size: 1.1em;
+            cursor: pointer;
+            transition: all 0.3s;
+            margin: 20px 10px;
+        }
+        button:hover {
+            transform: scale(1.05);
+            box-shadow: 0 5px 20px rgba(139, 92, 246, 0.5);
+        }
+        footer {
+            text-align: center;
+            padding: 30px;
+            background: rgba(0,0,0,0.3);
+            margin-top: 50px;
+            border-top: 1px solid rgba(139, 92, 246, 0.3);
+        }
+        @media (max-width: 768px) {
+            h1 { font-size: 2em; }
+            .features { grid-template-columns: 1fr; }
+        }
+    </style>
+</head>
+<body>
+    <header>
+        <h1>✨ {{ title }}</h1>
+        <p class="tagline">Создано нейросетью DUWDU</p>
+    </header>
+    
+    <div class="container">
+        <div class="content">
+            <h2>О проекте</h2>
+            <p>Добро пожаловать на сайт, созданный искусственным интеллектом DUWDU специально по вашему запросу!</p>
+            <p>Этот сайт разработан с использованием современных технологий и адаптирован для всех устройств.</p>
+        </div>
+        
+        <div class="features">
+            <div class="feature">
+                <h3>⚡ Быстрая загрузка</h3>
+                <p>Оптимизированный код обеспечивает мгновенную загрузку страниц</p>
+            </div>
+            
+            <div class="feature">
+                <h3>📱 Адаптивный дизайн</h3>
+                <p>Идеально работает на телефонах, планшетах и компьютерах</p>
+            </div>
+            
+            <div class="feature">
+                <h3>🎨 Современный стиль</h3>
+                <p>Чёрно-фиолетовая палитра с эффектами размытия</p>
+            </div>
+            
+            <div class="feature">
+                <h3>🚀 Готов к запуску</h3>
+                <p>Можно сразу использовать или доработать под свои нужды</p>
+            </div>
+        </div>
+        
+        <div style="text-align: center; margin-top: 40px;">
+            <button onclick="alert('Спасибо, что используете DUWDU! 🚀')">Узнать больше</button>
+            <button onclick="alert('Свяжитесь с нами!')">Контакты</button>
+        </div>
+    </div>
+    
+    <footer>
+        <p>🌟 Создано нейросетью DUWDU WebGen</p>
+        <p style="opacity: 0.7; margin-top: 10px;">Запрос: "{{ prompt }}"</p>
+    </footer>
+</body>
+</html>'''
+
+WEBGEN_PAGE = PageTemplate(WEBGEN_PAGE_SOURCE)
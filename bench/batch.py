@@ -0,0 +1,59 @@
+'''
+Wall time of a 20-item ai-generate batch against the local fake OpenAI server,
+compared with the same items sent one request at a time. Request logging is
+replaced with no-ops so only the upstream fan-out is measured.
+Usage: python bench/batch.py [latency_ms]
+'''
+import json
+import os
+import sys
+import time
+
+from fake_openai import FakeOpenAI
+
+os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+# Measure the fan-out, not the limiter: 39 text requests exceed the default per-user
+# bucket and upstream pacing, so both are opened wide as in load_test.py
+os.environ.setdefault('RATE_LIMIT_USER_CAPACITY', '1000000')
+os.environ.setdefault('RATE_LIMIT_USER_REFILL', '1000000')
+os.environ.setdefault('RATE_LIMIT_GLOBAL_REFILL', '1000000')
+
+from common import helper_module, load_function
+
+def main() -> None:
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.2
+    auth = load_function('auth')
+    generator = load_function('ai-generate')
+    sessions = helper_module('ai-generate', 'sessions')
+    sessions._revoked_token_ids = frozenset()
+    sessions._revoked_loaded_at = time.monotonic() + 3600
+    generator.log_ai_request = lambda user_id, module_type, prompt, response: 0
+    generator.log_ai_requests = lambda user_id, rows: list(range(len(rows)))
+    token = auth.issue_session_token(1)
+    
+    items = [{'moduleType': 'text', 'prompt': f'вопрос {i}', 'noCache': True} for i in range(19)]
+    items.append({'moduleType': 'unknown', 'prompt': 'x'})
+    
+    with FakeOpenAI(latency=latency) as fake:
+        generator.OPENAI_BASE_URL = fake.url
+        generator._openai_session = None
+        
+        started = time.perf_counter()
+        for item in items:
+            generator.handler({'httpMethod': 'POST', 'headers': {'X-Auth-Token': token}, 'body': json.dumps(item)}, None)
+        sequential = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        response = generator.handler({'httpMethod': 'POST', 'headers': {'X-Auth-Token': token}, 'body': json.dumps({'items': items})}, None)
+        batched = time.perf_counter() - started
+    
+    results = json.loads(response['body'])['results']
+    assert [r['index'] for r in results] == list(range(len(items)))
+    assert results[0]['response'] == 'Ответ на: вопрос 0' and not results[-1]['success']
+    print(f"{len(items)} items, upstream latency {latency * 1000:.0f} ms")
+    print(f"  sequential: {sequential * 1000:.0f} ms")
+    print(f"  batch:      {batched * 1000:.0f} ms ({sum(r['success'] for r in results)} ok, per-item error: {results[-1]['error']})")
+
+if __name__ == '__main__':
+    main()
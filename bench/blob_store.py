@@ -0,0 +1,91 @@
+'''
+Content-addressed media store: local read latency, LRU eviction under the disk quota,
+and (with DATABASE_URL set, migrated through V0016) the ai-generate image path end to
+end against the fake OpenAI server: a repeated prompt must cost zero upstream calls and
+a cold instance must refill its local store from media_blobs.
+Usage: [DATABASE_URL=postgresql://...] python bench/blob_store.py
+'''
+import os
+import shutil
+import sys
+import tempfile
+
+from fake_openai import FakeOpenAI
+
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+
+from common import BACKEND_DIR, load_function, time_per_call
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'ai-generate'))
+from blobstore import BlobStore, sha256_hex
+
+MB = 1024 * 1024
+
+def local_store() -> None:
+    root = tempfile.mkdtemp(prefix='blobs-')
+    try:
+        store = BlobStore(root, quota_bytes=10 * MB)
+        blobs = [os.urandom(MB) for _ in range(30)]
+        digests = [sha256_hex(blob) for blob in blobs]
+        for digest, blob in zip(digests, blobs):
+            store.put(digest, blob)
+            store.get(digests[0])
+        snapshot = store.snapshot()
+        print(f"30 x 1 MB into a 10 MB quota: {snapshot['files']} files, {snapshot['bytes'] / MB:.0f} MB, {snapshot['evicted']} evicted")
+        assert snapshot['bytes'] <= 10 * MB
+        assert store.get(digests[0]) is not None, 'the most read blob was evicted'
+        assert store.get(digests[1]) is None
+
+        print(f"local read of 1 MB: {time_per_call(lambda: store.get(digests[-1]), 500):.1f} us")
+        reopened = BlobStore(root, quota_bytes=10 * MB)
+        assert reopened.get(digests[-1]) is not None
+        print(f"reopened store tracks {reopened.snapshot()['files']} files")
+    finally:
+        shutil.rmtree(root)
+
+def image_path() -> None:
+    generator = load_function('ai-generate')
+    root = tempfile.mkdtemp(prefix='blobs-')
+    try:
+        generator.blob_store = BlobStore(root, generator.BLOB_STORE_QUOTA)
+        with FakeOpenAI(latency=0.2) as fake:
+            generator.OPENAI_BASE_URL = fake.url
+            generator._openai_session = None
+            prompt = f'бенч кот {os.getpid()}'
+
+            url, ok = generator.request_dalle_image(prompt)
+            assert ok, url
+            first_requests = fake.requests
+            repeated, ok = generator.request_dalle_image(prompt)
+            assert ok and repeated == url
+            print(f"repeat prompt: {fake.requests - first_requests} upstream calls (first: {first_requests})")
+            assert fake.requests == first_requests
+
+        digest = url.split('blob=')[1]
+        event = {'httpMethod': 'GET', 'queryStringParameters': {'blob': digest}, 'headers': {}}
+        local = generator.serve_blob(generator.blob_store, event)
+        assert local['statusCode'] == 200 and local['headers']['Content-Type'] == 'image/png', local['headers']
+        print(f"local read: {time_per_call(lambda: generator.serve_blob(generator.blob_store, event), 200):.1f} us per request")
+
+        generator.blob_store = BlobStore(tempfile.mkdtemp(dir=root), generator.BLOB_STORE_QUOTA)
+        refilled = generator.serve_blob(generator.blob_store, event)
+        assert refilled['body'] == local['body']
+        print(f"cold instance refilled from media_blobs, then local: {generator.blob_store.snapshot()}")
+
+        event['headers'] = {'If-None-Match': local['headers']['ETag']}
+        assert generator.serve_blob(generator.blob_store, event)['statusCode'] == 304
+        thumb = generator.serve_blob(generator.blob_store, {**event, 'headers': {}, 'queryStringParameters': {'blob': digest, 'variant': 'thumb'}})
+        print(f"thumbnail: {thumb['headers']['Content-Type']}, {len(thumb['body']) * 3 // 4} bytes")
+    finally:
+        shutil.rmtree(root)
+
+def main() -> None:
+    local_store()
+    if 'DATABASE_URL' not in os.environ:
+        print('DATABASE_URL not set, skipping the end-to-end image path')
+        return
+    image_path()
+
+if __name__ == '__main__':
+    main()
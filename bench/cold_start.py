@@ -0,0 +1,119 @@
+'''
+Cold-start profile of each function: a fresh interpreter per run imports index.py
+under `python -X importtime` and serves one OPTIONS preflight. Reports the import and
+first-request wall time (median over runs), what every imported top-level package cost
+(self time, summed over its submodules), which of index.py's own imports are the most
+expensive, and whether a dependency that should be deferred got loaded.
+Usage: python bench/cold_start.py [--runs 5] [--top 10] [--check] [--json out.json] [function ...]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+from common import BACKEND_DIR
+
+FUNCTIONS = ['auth', 'duwdu1', 'ai-generate']
+DEFERRED = ['psycopg2', 'requests', 'numpy', 'concurrent.futures']
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+served = time.perf_counter()
+sys.stderr.flush()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'options_ms': (served - imported) * 1000,
+    'deferred_loaded': [name for name in %r if name in sys.modules]
+}))
+''' % (DEFERRED,)
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """(module, depth, self us, cumulative us) in the order -X importtime prints them"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_part, cumulative_part, name = line.split('|')
+        self_us = int(self_part.split(':')[1])
+        cumulative_us = int(cumulative_part)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((name.strip(), depth, self_us, cumulative_us))
+    return rows
+
+def index_tree(rows: List[Tuple[str, int, int, int]]) -> List[Tuple[str, int, int, int]]:
+    """Rows imported by `import index` (children print before their parent)"""
+    end = next(i for i, row in enumerate(rows) if row[0] == 'index' and row[1] == 0)
+    start = end
+    while start > 0 and rows[start - 1][1] > 0:
+        start -= 1
+    return rows[start:end + 1]
+
+def profile_once(function: str) -> Dict[str, Any]:
+    env = {**os.environ, 'SESSION_SECRET': os.environ.get('SESSION_SECRET', 'bench-secret')}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=os.path.join(BACKEND_DIR, function), env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'{function}: probe failed\n{result.stderr[-2000:]}')
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    tree = index_tree(parse_importtime(result.stderr))
+    packages: Dict[str, int] = {}
+    for name, _, self_us, _ in tree:
+        packages[name.split('.')[0]] = packages.get(name.split('.')[0], 0) + self_us
+    probe['packages_ms'] = {name: us / 1000 for name, us in packages.items()}
+    probe['direct_ms'] = {name: cumulative / 1000 for name, depth, _, cumulative in tree if depth == 1}
+    return probe
+
+def profile(function: str, runs: int) -> Dict[str, Any]:
+    # The first run may also compile bytecode; it is reported but kept out of the medians
+    first = profile_once(function)
+    samples = [profile_once(function) for _ in range(runs)]
+
+    def median_of(key: str) -> Dict[str, float]:
+        names = {name for sample in samples for name in sample[key]}
+        return {name: round(statistics.median(sample[key].get(name, 0.0) for sample in samples), 3) for name in names}
+
+    return {
+        'first_import_ms': round(first['import_ms'], 2),
+        'import_ms': round(statistics.median(sample['import_ms'] for sample in samples), 2),
+        'options_ms': round(statistics.median(sample['options_ms'] for sample in samples), 3),
+        'deferred_loaded': sorted({name for sample in samples for name in sample['deferred_loaded']}),
+        'packages_ms': dict(sorted(median_of('packages_ms').items(), key=lambda item: -item[1])),
+        'direct_ms': dict(sorted(median_of('direct_ms').items(), key=lambda item: -item[1]))
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Import-time profile of the function handlers')
+    parser.add_argument('functions', nargs='*', default=FUNCTIONS)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--check', action='store_true', help=f"exit 1 if import + OPTIONS loads any of {', '.join(DEFERRED)}")
+    parser.add_argument('--json', help='also write the full report here')
+    args = parser.parse_args()
+
+    if os.environ.get('PYTHONDONTWRITEBYTECODE'):
+        print('note: PYTHONDONTWRITEBYTECODE is set, so module self times include compiling source')
+    report = {}
+    for function in args.functions:
+        result = report[function] = profile(function, args.runs)
+        print(f"{function}: import {result['import_ms']:.1f} ms (first run {result['first_import_ms']:.1f} ms), "
+              f"OPTIONS {result['options_ms']:.2f} ms, deferred loaded: {', '.join(result['deferred_loaded']) or 'none'}")
+        print('  by package (self ms): ' + ', '.join(f'{name} {ms:.2f}' for name, ms in list(result['packages_ms'].items())[:args.top]))
+        print('  index.py imports (cumulative ms): ' + ', '.join(f'{name} {ms:.2f}' for name, ms in list(result['direct_ms'].items())[:args.top]))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.check and any(result['deferred_loaded'] for result in report.values()):
+        sys.exit('deferred dependencies were imported on the cold path')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import importlib.util
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+_helpers: Dict[str, Dict[str, Any]] = {}
+
+def load_function(name: str) -> Any:
+    """
+    Import backend/<name>/index.py the way the function runtime does. Helper modules
+    that several functions ship under the same name (dbpool, timing, webgen, ...) are re-imported
+    from this function's directory.
+    """
+    module_name = f"{name.replace('-', '_')}_index"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    function_dir = os.path.join(BACKEND_DIR, name)
+    if function_dir in sys.path:
+        sys.path.remove(function_dir)
+    sys.path.insert(0, function_dir)
+    for helper in os.listdir(function_dir):
+        if helper.endswith('.py') and helper != 'index.py':
+            sys.modules.pop(helper[:-3], None)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(function_dir, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    _helpers[name] = {
+        helper[:-3]: sys.modules[helper[:-3]]
+        for helper in os.listdir(function_dir)
+        if helper.endswith('.py') and helper != 'index.py' and helper[:-3] in sys.modules
+    }
+    return module
+
+def helper_module(name: str, helper: str) -> Any:
+    """The helper module (e.g. sessions) as imported by the loaded function `name`"""
+    load_function(name)
+    return _helpers[name][helper]
+
+def time_per_call(fn: Callable[[], Any], iterations: int) -> float:
+    """Mean wall time of fn() in microseconds"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
@@ -0,0 +1,106 @@
+'''
+Local stand-in for the OpenAI API with tunable latency and injected failures.
+Serves /v1/chat/completions and /v1/images/generations over keep-alive HTTP/1.1.
+Image requests with "response_format": "b64_json" get a small PNG whose colour
+depends on the prompt.
+'''
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+def solid_png(prompt: str, size: int = 64) -> bytes:
+    """size x size RGB PNG filled with a colour derived from the prompt"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return len(data).to_bytes(4, 'big') + kind + data + zlib.crc32(kind + data).to_bytes(4, 'big')
+    pixel = hashlib.sha256(prompt.encode()).digest()[:3]
+    rows = b''.join(b'\x00' + pixel * size for _ in range(size))
+    header = size.to_bytes(4, 'big') * 2 + bytes([8, 2, 0, 0, 0])
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+class FakeOpenAI:
+    def __init__(self, latency: float = 0.0, fail_first: int = 0, fail_status: int = 503,
+                 failure_rate: float = 0.0, retry_after: Optional[str] = None, seed: int = 0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+
+    def __enter__(self) -> 'FakeOpenAI':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            failing = self.requests <= self.fail_first or self.random.random() < self.failure_rate
+            if failing:
+                self.failures += 1
+            return failing
+
+    def reply(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if path.endswith('/images/generations'):
+            if payload.get('response_format') == 'b64_json':
+                return {'data': [{'b64_json': base64.b64encode(solid_png(payload.get('prompt', ''))).decode()}]}
+            return {'data': [{'url': f'https://images.invalid/{abs(hash(payload.get("prompt"))) % 10 ** 8}.png'}]}
+        prompt = payload['messages'][-1]['content']
+        return {'choices': [{'message': {'role': 'assistant', 'content': f'Ответ на: {prompt}'}}]}
+
+    def _handler_class(self) -> Any:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self) -> None:
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def send_json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                encoded = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(encoded)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_POST(self) -> None:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.should_fail():
+                    headers = {'Retry-After': fake.retry_after} if fake.retry_after else None
+                    self.send_json(fake.fail_status, {'error': {'message': 'injected failure'}}, headers)
+                    return
+                self.send_json(200, fake.reply(self.path, payload))
+
+        return Handler
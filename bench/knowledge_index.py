@@ -0,0 +1,57 @@
+'''
+Benchmark: approximate question matching, queries per second versus corpus size
+Usage: python bench/knowledge_index.py [size ...]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+from common import BACKEND_DIR
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'duwdu1'))
+from knowledge_index import KnowledgeIndex
+
+WORDS = ['как', 'приготовить', 'гречневую', 'кашу', 'что', 'такое', 'нейросеть', 'привет', 'дела',
+         'написать', 'реферат', 'история', 'почему', 'небо', 'синее', 'сколько', 'стоит', 'сайт']
+
+THRESHOLD = 0.9
+
+def synthetic_questions(count: int, rng: random.Random):
+    for _ in range(count):
+        yield ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 7)))
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    rng = random.Random(42)
+    queries = list(synthetic_questions(200, rng))
+    
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as path:
+            index = KnowledgeIndex(path)
+            started = time.perf_counter()
+            index.add_many(enumerate(synthetic_questions(size, rng), start=1))
+            index.flush()
+            build_seconds = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            reopened = KnowledgeIndex(path)
+            reopened.load()
+            load_ms = (time.perf_counter() - started) * 1000
+            
+            started = time.perf_counter()
+            for query in queries:
+                reopened.search(query, k=5)
+            qps = len(queries) / (time.perf_counter() - started)
+            
+            started = time.perf_counter()
+            for query in queries:
+                reopened.search(query, k=1, min_score=THRESHOLD)
+            threshold_qps = len(queries) / (time.perf_counter() - started)
+            
+            print(f"rows={size:>8}  build={build_seconds:6.2f}s  load={load_ms:6.1f}ms  "
+                  f"search={qps:8.0f} q/s  search>={THRESHOLD}={threshold_qps:8.0f} q/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+'''
+Load test for the auth, duwdu1 and ai-generate handlers against a local Postgres
+and the fake OpenAI server. Seeds bench data (users, knowledge rows, sites), drives a
+weighted event mix from --concurrency threads and reports per scenario requests/s,
+latency percentiles, DB round-trips per request (the 'db' span of Server-Timing) and
+allocations per request (tracemalloc, measured on a separate single-threaded pass).
+Results are written as JSON named after the git commit; --compare prints the change
+against an earlier results file.
+Usage: DATABASE_URL=postgresql://... python bench/load_test.py [--migrate] [--seed] [--duration 30]
+           [--concurrency 16] [--users 1000] [--knowledge 10000] [--sites 2000]
+           [--openai-latency 0.05] [--mix ai.text=20,ai.site=20] [--compare bench/results/<commit>.json]
+'''
+import argparse
+import contextlib
+import glob
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fake_openai import FakeOpenAI
+
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+# Measure the handlers, not the limiter: per-user buckets and upstream pacing are
+# opened wide unless the environment asks for production settings.
+os.environ.setdefault('RATE_LIMIT_USER_CAPACITY', '1000000')
+os.environ.setdefault('RATE_LIMIT_USER_REFILL', '1000000')
+os.environ.setdefault('RATE_LIMIT_GLOBAL_REFILL', '1000000')
+
+from common import load_function, percentiles
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, 'bench', 'results')
+BENCH_PASSWORD = 'bench-password'
+DB_SPAN = re.compile(r'(?:^|,\s*)db;dur=[\d.]+(?:;desc="x(\d+)")?')
+
+DEFAULT_MIX = {
+    'auth.check_code': 5,
+    'auth.login': 5,
+    'duwdu1.text_known': 20,
+    'duwdu1.text_new': 5,
+    'duwdu1.webgen': 5,
+    'ai.text': 20,
+    'ai.text_uncached': 5,
+    'ai.site': 20,
+    'ai.history': 10,
+    'ai.batch': 5
+}
+
+def migrate(conn) -> None:
+    """Apply db_migrations/V*.sql in order to an empty database"""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('users') IS NOT NULL")
+    if cur.fetchone()[0]:
+        sys.exit('--migrate expects an empty database; the users table already exists')
+    for path in sorted(glob.glob(os.path.join(ROOT_DIR, 'db_migrations', 'V*.sql'))):
+        with open(path) as f:
+            cur.execute(f.read())
+        conn.commit()
+        print(f"migrated {os.path.basename(path)}")
+    cur.close()
+
+def seed(conn, users: int, knowledge: int, sites: int, template_version: str) -> None:
+    """Top bench rows up to the requested sizes; existing bench rows are reused"""
+    cur = conn.cursor()
+    cur.execute(
+        """INSERT INTO access_codes (code, is_used, used_at)
+           SELECT 'BENCHU' || lpad(g::TEXT, 8, '0'), TRUE, NOW() FROM generate_series(1, %s) g
+           ON CONFLICT (code) DO NOTHING""",
+        (users,)
+    )
+    cur.execute(
+        """INSERT INTO access_codes (code)
+           SELECT 'BENCHF' || lpad(g::TEXT, 8, '0') FROM generate_series(1, 100) g
+           ON CONFLICT (code) DO NOTHING"""
+    )
+    cur.execute(
+        """INSERT INTO users (username, password, access_code)
+           SELECT 'bench_user_' || g, %s, 'BENCHU' || lpad(g::TEXT, 8, '0') FROM generate_series(1, %s) g
+           ON CONFLICT (username) DO NOTHING""",
+        (BENCH_PASSWORD, users)
+    )
+    cur.execute(
+        """INSERT INTO duwdu_knowledge (question, answer, source, question_key)
+           SELECT 'бенч вопрос номер ' || g, 'Бенч ответ номер ' || g, 'bench', duwdu_question_key('бенч вопрос номер ' || g)
+           FROM generate_series(1, %s) g
+           ON CONFLICT (question_key) DO NOTHING""",
+        (knowledge,)
+    )
+    cur.execute(
+        """INSERT INTO generated_websites (user_id, site_name, template_version, params)
+           SELECT u.id, 'site-' || u.id || '-bench-' || g, %s, jsonb_build_object('prompt', 'бенч сайт ' || g)
+           FROM generate_series(1, %s) g
+           JOIN users u ON u.username = 'bench_user_' || (1 + (g - 1) %% %s)
+           ON CONFLICT (user_id, site_name) DO NOTHING""",
+        (template_version, sites, max(users, 1))
+    )
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.commit()
+    cur.close()
+
+def load_fixtures(conn, users: int, knowledge: int, sites: int) -> Dict[str, List[Any]]:
+    cur = conn.cursor()
+    cur.execute("SELECT id, username FROM users WHERE username LIKE 'bench\\_user\\_%%' ORDER BY id LIMIT %s", (users,))
+    accounts = cur.fetchall()
+    cur.execute("SELECT question FROM duwdu_knowledge WHERE source = 'bench' ORDER BY id LIMIT %s", (knowledge,))
+    questions = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT site_name FROM generated_websites WHERE site_name LIKE 'site-%%-bench-%%' LIMIT %s", (sites,))
+    site_names = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT code FROM access_codes WHERE code LIKE 'BENCHF%'")
+    free_codes = [row[0] for row in cur.fetchall()]
+    cur.close()
+    if not accounts or not questions or not site_names:
+        sys.exit('no bench data found; run with --seed')
+    return {'accounts': accounts, 'questions': questions, 'sites': site_names, 'codes': free_codes}
+
+def post(body: Dict[str, Any], token: Optional[str] = None) -> Dict[str, Any]:
+    headers = {'X-Auth-Token': token} if token else {}
+    return {'httpMethod': 'POST', 'headers': headers, 'body': json.dumps(body, ensure_ascii=False)}
+
+def get(params: Dict[str, str], token: Optional[str] = None) -> Dict[str, Any]:
+    headers = {'X-Auth-Token': token} if token else {}
+    return {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+
+def build_scenarios(fixtures: Dict[str, List[Any]], tokens: Dict[int, str], prompts: int) -> Dict[str, Tuple[str, Callable[[random.Random], Dict[str, Any]]]]:
+    """scenario name -> (function name, event factory)"""
+    accounts, questions, sites, codes = fixtures['accounts'], fixtures['questions'], fixtures['sites'], fixtures['codes']
+    counter = iter(range(1 << 62))
+
+    def token_for(rng: random.Random) -> str:
+        return tokens[rng.choice(accounts)[0]]
+
+    def site_event(rng: random.Random) -> Dict[str, Any]:
+        event = get({'site': rng.choice(sites)})
+        event['headers'] = {'Accept-Encoding': 'gzip, br'}
+        return event
+
+    return {
+        'auth.check_code': ('auth', lambda rng: post({'action': 'check_code', 'code': rng.choice(codes or ['NOSUCHCODE'])})),
+        'auth.login': ('auth', lambda rng: post({'action': 'login', 'username': rng.choice(accounts)[1], 'password': BENCH_PASSWORD})),
+        'duwdu1.text_known': ('duwdu1', lambda rng: post({'module': 'text', 'prompt': rng.choice(questions)})),
+        'duwdu1.text_new': ('duwdu1', lambda rng: post({'module': 'text', 'prompt': f'новый бенч вопрос {time.time_ns()} {next(counter)}'})),
+        'duwdu1.webgen': ('duwdu1', lambda rng: post({'module': 'webgen', 'prompt': f'создай сайт бенч {rng.randrange(prompts)}'})),
+        'ai.text': ('ai-generate', lambda rng: post({'moduleType': 'text', 'prompt': f'бенч промпт {rng.randrange(prompts)}'}, token_for(rng))),
+        'ai.text_uncached': ('ai-generate', lambda rng: post({'moduleType': 'text', 'prompt': f'бенч промпт {rng.randrange(prompts)}', 'noCache': True}, token_for(rng))),
+        'ai.site': ('ai-generate', site_event),
+        'ai.history': ('ai-generate', lambda rng: get({'history': '', 'limit': '20'}, token_for(rng))),
+        'ai.batch': ('ai-generate', lambda rng: post({'items': [
+            {'moduleType': 'text', 'prompt': f'бенч промпт {rng.randrange(prompts)}'} for _ in range(5)
+        ]}, token_for(rng)))
+    }
+
+def db_round_trips(response: Dict[str, Any]) -> int:
+    """Number of statements the request executed, from its Server-Timing header"""
+    header = (response.get('headers') or {}).get('Server-Timing', '')
+    match = DB_SPAN.search(header)
+    if match is None:
+        return 0
+    return int(match.group(1) or 1)
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[Tuple[float, int, int]]] = {}
+
+    def add(self, name: str, ms: float, status: int, trips: int) -> None:
+        with self.lock:
+            self.samples.setdefault(name, []).append((ms, status, trips))
+
+def call(handlers: Dict[str, Any], scenarios, name: str, rng: random.Random) -> Tuple[float, int, int]:
+    function, factory = scenarios[name]
+    event = factory(rng)
+    started = time.perf_counter()
+    try:
+        response = handlers[function](event, None)
+    except Exception:
+        return (time.perf_counter() - started) * 1000, 0, 0
+    return (time.perf_counter() - started) * 1000, response.get('statusCode', 0), db_round_trips(response)
+
+def run_load(handlers, scenarios, mix: Dict[str, float], concurrency: int, duration: float, seed_value: int, recorder: Optional[Recorder]) -> float:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.monotonic() + duration
+
+    def worker(index: int) -> None:
+        rng = random.Random(seed_value * 1000 + index)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            ms, status, trips = call(handlers, scenarios, name, rng)
+            if recorder is not None:
+                recorder.add(name, ms, status, trips)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return time.perf_counter() - started
+
+def measure_allocations(handlers, scenarios, names: List[str], samples: int, seed_value: int) -> Dict[str, Dict[str, float]]:
+    """Peak and retained tracemalloc bytes per request, one request at a time"""
+    rng = random.Random(seed_value)
+    result = {}
+    tracemalloc.start()
+    try:
+        for name in names:
+            peaks, retained = [], []
+            for _ in range(samples):
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                call(handlers, scenarios, name, rng)
+                after, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained.append(after - before)
+            result[name] = {
+                'alloc_peak_kb': round(sum(peaks) / len(peaks) / 1024, 1),
+                'alloc_retained_b': round(sum(retained) / len(retained))
+            }
+    finally:
+        tracemalloc.stop()
+    return result
+
+def summarize(recorder: Recorder, elapsed: float, allocations: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    scenarios = {}
+    everything = []
+    for name, samples in sorted(recorder.samples.items()):
+        latencies = [ms for ms, _, _ in samples]
+        everything.extend(latencies)
+        statuses: Dict[str, int] = {}
+        for _, status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        scenarios[name] = {
+            'requests': len(samples),
+            'rps': round(len(samples) / elapsed, 1),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            **{q: round(v, 3) for q, v in percentiles(latencies).items()},
+            'errors': sum(count for status, count in statuses.items() if not status.startswith('2') and status != '304'),
+            'statuses': statuses,
+            'db_round_trips': round(sum(trips for _, _, trips in samples) / len(samples), 2),
+            **allocations.get(name, {})
+        }
+    return {
+        'total': {
+            'requests': len(everything),
+            'rps': round(len(everything) / elapsed, 1),
+            'mean_ms': round(sum(everything) / len(everything), 3) if everything else 0.0,
+            **{q: round(v, 3) for q, v in percentiles(everything).items()}
+        },
+        'scenarios': scenarios
+    }
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"{'scenario':<20} {'req':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>5} {'db/req':>7} {'peak KB':>8}")
+    for name, row in results['scenarios'].items():
+        print(f"{name:<20} {row['requests']:>7} {row['rps']:>8.1f} {row['p50']:>8.2f} {row['p95']:>8.2f} {row['p99']:>8.2f} "
+              f"{row['errors']:>5} {row['db_round_trips']:>7.2f} {row.get('alloc_peak_kb', 0):>8.1f}")
+    total = results['total']
+    print(f"{'total':<20} {total['requests']:>7} {total['rps']:>8.1f} {total['p50']:>8.2f} {total['p95']:>8.2f} {total['p99']:>8.2f}")
+
+def print_comparison(baseline: Dict[str, Any], results: Dict[str, Any]) -> None:
+    def change(old: float, new: float) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+
+    print(f"\nagainst {baseline['commit']} ({baseline['started_at']}):")
+    print(f"{'scenario':<20} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'db/req':>9} {'peak KB':>9}")
+    for name, row in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        print(f"{name:<20} {change(old['rps'], row['rps']):>9} {change(old['p50'], row['p50']):>9} {change(old['p95'], row['p95']):>9} "
+              f"{change(old['p99'], row['p99']):>9} {change(old['db_round_trips'], row['db_round_trips']):>9} "
+              f"{change(old.get('alloc_peak_kb', 0), row.get('alloc_peak_kb', 0)):>9}")
+    print(f"{'total':<20} {change(baseline['total']['rps'], results['total']['rps']):>9} "
+          f"{change(baseline['total']['p50'], results['total']['p50']):>9} {change(baseline['total']['p95'], results['total']['p95']):>9} "
+          f"{change(baseline['total']['p99'], results['total']['p99']):>9}")
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name.strip()!r}; known: {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test the function handlers against local Postgres and a fake OpenAI')
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations to an empty database first')
+    parser.add_argument('--seed', action='store_true', help='insert bench users, knowledge rows and sites')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--knowledge', type=int, default=10000)
+    parser.add_argument('--sites', type=int, default=2000)
+    parser.add_argument('--prompts', type=int, default=500, help='distinct ai.text / webgen prompts (controls cache hit rates)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of unmeasured load before the run')
+    parser.add_argument('--openai-latency', type=float, default=0.05, help='fake OpenAI response time in seconds')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX), help='scenario=weight,... (default: all scenarios)')
+    parser.add_argument('--alloc-samples', type=int, default=50, help='requests per scenario for the tracemalloc pass, 0 to skip')
+    parser.add_argument('--seed-value', type=int, default=1, help='random seed for the event mix')
+    parser.add_argument('--output', help='results file (default bench/results/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--verbose', action='store_true', help='keep the handlers\' per-request log lines')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        sys.exit('DATABASE_URL is required')
+
+    import psycopg2
+
+    auth = load_function('auth')
+    duwdu = load_function('duwdu1')
+    generator = load_function('ai-generate')
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    if args.migrate:
+        migrate(conn)
+    if args.seed:
+        started = time.perf_counter()
+        seed(conn, args.users, args.knowledge, args.sites, generator.SITE_PAGE.version)
+        print(f"seeded {args.users} users, {args.knowledge} knowledge rows, {args.sites} sites in {time.perf_counter() - started:.1f}s")
+    fixtures = load_fixtures(conn, args.users, args.knowledge, args.sites)
+    conn.close()
+
+    tokens = {user_id: auth.issue_session_token(user_id) for user_id, _ in fixtures['accounts']}
+    scenarios = build_scenarios(fixtures, tokens, args.prompts)
+    handlers = {'auth': auth.handler, 'duwdu1': duwdu.handler, 'ai-generate': generator.handler}
+
+    with FakeOpenAI(latency=args.openai_latency) as fake:
+        generator.OPENAI_BASE_URL = fake.url
+        generator._openai_session = None
+
+        recorder = Recorder()
+        with open(os.devnull, 'w') as devnull, (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)):
+            if args.warmup > 0:
+                run_load(handlers, scenarios, args.mix, args.concurrency, args.warmup, args.seed_value + 1, None)
+            elapsed = run_load(handlers, scenarios, args.mix, args.concurrency, args.duration, args.seed_value, recorder)
+            allocations = measure_allocations(handlers, scenarios, list(args.mix), args.alloc_samples, args.seed_value) if args.alloc_samples > 0 else {}
+            generator.flush_ai_requests()
+            duwdu.flush_knowledge_hits()
+        upstream_requests = fake.requests
+
+    results = {
+        'commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'verbose')},
+        'elapsed_s': round(elapsed, 2),
+        'upstream_requests': upstream_requests,
+        **summarize(recorder, elapsed, allocations)
+    }
+
+    print_report(results)
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+if __name__ == '__main__':
+    main()
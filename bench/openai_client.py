@@ -0,0 +1,72 @@
+'''
+Check the ai-generate OpenAI client against the local fake server:
+connection reuse, retry on injected 5xx/429, Retry-After handling, latency per call,
+and single-flight coalescing of concurrent identical prompts.
+Usage: python bench/openai_client.py
+'''
+import os
+import threading
+import time
+
+from fake_openai import FakeOpenAI
+
+os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+os.environ.setdefault('OPENAI_BACKOFF_BASE', '0.05')
+
+from common import load_function
+
+def configure(generator, fake: FakeOpenAI) -> None:
+    generator.OPENAI_BASE_URL = fake.url
+    generator._openai_session = None
+
+def main() -> None:
+    generator = load_function('ai-generate')
+    
+    with FakeOpenAI(latency=0.002) as fake:
+        configure(generator, fake)
+        started = time.perf_counter()
+        for i in range(50):
+            assert generator.generate_text_with_gpt(f'вопрос {i}', use_cache=False) == f'Ответ на: вопрос {i}'
+        elapsed_ms = (time.perf_counter() - started) * 1000 / 50
+        print(f"keep-alive: 50 calls over {fake.connections} connection(s), {elapsed_ms:.2f} ms/call")
+        assert fake.connections == 1
+    
+    with FakeOpenAI(fail_first=2, fail_status=503) as fake:
+        configure(generator, fake)
+        assert generator.generate_text_with_gpt('привет', use_cache=False) == 'Ответ на: привет'
+        print(f"503 x2 then success: {fake.requests} requests, recovered")
+    
+    with FakeOpenAI(fail_first=1, fail_status=429, retry_after='0.3') as fake:
+        configure(generator, fake)
+        started = time.perf_counter()
+        assert generator.openai_post('images/generations', {'prompt': 'кот'}, 'sk-fake').status_code == 200
+        waited = time.perf_counter() - started
+        print(f"429 with Retry-After 0.3s: waited {waited:.2f}s")
+        assert waited >= 0.3
+    
+    with FakeOpenAI(fail_first=100, fail_status=500) as fake:
+        configure(generator, fake)
+        result = generator.generate_text_with_gpt('привет', use_cache=False)
+        print(f"persistent 500: {fake.requests} requests, gave up with: {result}")
+        assert fake.requests == generator.OPENAI_MAX_RETRIES + 1
+    
+    with FakeOpenAI(fail_first=1, fail_status=400) as fake:
+        configure(generator, fake)
+        generator.generate_text_with_gpt('привет', use_cache=False)
+        print(f"400 is not retried: {fake.requests} request")
+        assert fake.requests == 1
+    
+    with FakeOpenAI(latency=0.2) as fake:
+        configure(generator, fake)
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(generator.generate_text_with_gpt('Вирусный  запрос'))) for _ in range(20)]
+        callers += [threading.Thread(target=lambda: results.append(generator.generate_image_with_dalle('кот'))) for _ in range(10)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        print(f"coalescing: {len(results)} concurrent calls, {fake.requests} upstream requests")
+        assert fake.requests == 2 and len(set(results)) == 2
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Admission control under overload: many users send text requests concurrently through
+ai-generate against the local fake OpenAI server. Reports admitted/rejected counts and
+the upstream request rate per 100 ms window, which should stay at the global refill
+rate instead of bursting.
+Usage: python bench/rate_limit.py [users] [requests_per_user]
+'''
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from fake_openai import FakeOpenAI
+
+os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('RATE_LIMIT_GLOBAL_REFILL', '100')
+os.environ.setdefault('RATE_LIMIT_GLOBAL_BURST', '0.1')
+
+from common import helper_module, load_function
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    auth = load_function('auth')
+    generator = load_function('ai-generate')
+    sessions = helper_module('ai-generate', 'sessions')
+    sessions._revoked_token_ids = frozenset()
+    sessions._revoked_loaded_at = time.monotonic() + 3600
+    generator.log_ai_request = lambda *args: 0
+    
+    sent = []
+    session = generator.openai_session()
+    original_post = session.post
+    
+    def recording_post(*args, **kwargs):
+        sent.append(time.perf_counter())
+        return original_post(*args, **kwargs)
+    
+    session.post = recording_post
+    statuses = Counter()
+    lock = threading.Lock()
+    
+    def user(user_id: int) -> None:
+        token = auth.issue_session_token(user_id)
+        for i in range(per_user):
+            event = {
+                'httpMethod': 'POST',
+                'headers': {'X-Auth-Token': token},
+                'body': json.dumps({'moduleType': 'text', 'prompt': f'{user_id}-{i}', 'noCache': True})
+            }
+            status = generator.handler(event, None)['statusCode']
+            with lock:
+                statuses[status] += 1
+    
+    with FakeOpenAI(latency=0.01) as fake:
+        generator.OPENAI_BASE_URL = fake.url
+        started = time.perf_counter()
+        threads = [threading.Thread(target=user, args=(n + 1,)) for n in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    
+    windows = Counter(int((t - started) * 10) for t in sent)
+    rates = [windows[w] * 10 for w in range(max(windows) + 1)] if windows else []
+    print(f"{users} users x {per_user} requests in {elapsed:.2f}s: {dict(statuses)}")
+    print(f"upstream: {len(sent)} requests, target {generator.RATE_LIMIT_GLOBAL_REFILL:.0f}/s")
+    print(f"rate per 100 ms window (req/s): max {max(rates, default=0)}, mean {sum(rates) / max(1, len(rates)):.0f}")
+
+if __name__ == '__main__':
+    main()
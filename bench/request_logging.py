@@ -0,0 +1,78 @@
+'''
+Handler latency percentiles for ai-generate with request logging off, write-behind
+(the default: rows are buffered and the handler writes them once per
+AI_REQUESTS_FLUSH_INTERVAL) and synchronous (every call writes its row). Also checks
+that every logged row reached ai_requests.
+Needs a migrated, seeded database (python bench/load_test.py --seed):
+DATABASE_URL=postgresql://... python bench/request_logging.py [requests]
+'''
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+
+from common import helper_module, load_function, percentiles
+
+def run(generator, token: str, requests: int) -> dict:
+    event = {
+        'httpMethod': 'POST',
+        'headers': {'X-Auth-Token': token},
+        'body': json.dumps({'moduleType': 'voice', 'prompt': 'проверка журнала запросов ' * 20})
+    }
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = generator.handler(event, None)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response['statusCode'] == 200, response
+    return percentiles(samples)
+
+def count_rows(generator) -> int:
+    conn = generator.get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM ai_requests")
+    count = cur.fetchone()[0]
+    cur.close()
+    generator.release_db_connection(conn)
+    return count
+
+def main() -> None:
+    if 'DATABASE_URL' not in os.environ:
+        sys.exit('DATABASE_URL is required')
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    auth = load_function('auth')
+    generator = load_function('ai-generate')
+    sessions = helper_module('ai-generate', 'sessions')
+    sessions._revoked_token_ids = frozenset()
+    sessions._revoked_loaded_at = time.monotonic() + 3600
+    
+    conn = generator.get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM users ORDER BY id LIMIT 1")
+    row = cur.fetchone()
+    cur.close()
+    generator.release_db_connection(conn)
+    if row is None:
+        sys.exit('the users table is empty')
+    token = auth.issue_session_token(row[0])
+    
+    write_behind = generator.log_ai_request
+    
+    def synchronous(*args):
+        request_id = write_behind(*args)
+        generator.flush_ai_requests()
+        return request_id
+    
+    modes = [('off', lambda *args: None), ('write-behind', write_behind), ('synchronous', synchronous)]
+    for name, logger in modes:
+        generator.log_ai_request = logger
+        before = count_rows(generator)
+        result = run(generator, token, requests)
+        generator.flush_ai_requests()
+        written = count_rows(generator) - before
+        print(f"{name:>13}: " + ', '.join(f"{q} {v:.2f} ms" for q, v in result.items()) + f", {written} rows written")
+
+if __name__ == '__main__':
+    main()
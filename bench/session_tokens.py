@@ -0,0 +1,32 @@
+'''
+Benchmark: in-process session token verification (no database round-trip)
+Usage: python bench/session_tokens.py [iterations]
+'''
+import os
+import sys
+import time
+
+from common import helper_module, load_function, time_per_call
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+    
+    auth = load_function('auth')
+    generator = load_function('ai-generate')
+    sessions = helper_module('ai-generate', 'sessions')
+    sessions._revoked_token_ids = frozenset(f'revoked-{i}' for i in range(1000))
+    sessions._revoked_loaded_at = time.monotonic() + 3600
+    
+    token = auth.issue_session_token(42)
+    forged = token[:-4] + 'AAAA'
+    assert generator.verify_session_token(token) == 42
+    assert generator.verify_session_token(forged) is None
+    
+    print(f"token length: {len(token)} bytes")
+    print(f"issue:         {time_per_call(lambda: auth.issue_session_token(42), iterations):.2f} us/op")
+    print(f"verify valid:  {time_per_call(lambda: generator.verify_session_token(token), iterations):.2f} us/op")
+    print(f"verify forged: {time_per_call(lambda: generator.verify_session_token(forged), iterations):.2f} us/op")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+'''
+Benchmark: webgen page rendering, renders per second and bytes on the wire
+Usage: python bench/webgen_templates.py [iterations]
+'''
+import json
+import os
+import sys
+
+from common import BACKEND_DIR, time_per_call
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'duwdu1'))
+import webgen
+
+PROMPT = 'Создай сайт магазина цветов'
+TITLE = 'магазина цветов'
+
+def legacy_render(source: str) -> str:
+    """What the f-string did: rebuild the whole unminified page per call"""
+    return source.replace('{{ title }}', TITLE).replace('{{ prompt }}', PROMPT)
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    source = webgen.WEBGEN_PAGE_SOURCE
+    
+    before = json.dumps({'html': legacy_render(source), 'message': 'ok'}).encode()
+    after = json.dumps({'html': webgen.WEBGEN_PAGE.render(title=TITLE, prompt=PROMPT), 'message': 'ok'}).encode()
+    etag = webgen.WEBGEN_PAGE.etag(title=TITLE, prompt=PROMPT)
+    
+    legacy_us = time_per_call(lambda: legacy_render(source), iterations)
+    render_us = time_per_call(lambda: webgen.WEBGEN_PAGE.render(title=TITLE, prompt=PROMPT), iterations)
+    print(f"render before: {1e6 / legacy_us:10.0f}/s   after: {1e6 / render_us:10.0f}/s")
+    print(f"bytes before (raw JSON):      {len(before):6d}")
+    print(f"bytes after  (minified JSON): {len(after):6d}")
+    for encoding in ['gzip'] + (['br'] if webgen.brotli else []):
+        compressed = webgen.compress(after, encoding)
+        cold_us = time_per_call(lambda: webgen.compress(after, encoding), max(1, iterations // 20))
+        warm_us = time_per_call(lambda: webgen.compressed_body(etag, encoding, after), iterations)
+        print(f"bytes after  ({encoding:4}):            {len(compressed):6d}   compress {cold_us:7.1f} us, cached {warm_us:5.2f} us")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS idx_access_codes_created_at ON access_codes(created_at);
+CREATE INDEX IF NOT EXISTS idx_access_codes_used_at ON access_codes(used_at);
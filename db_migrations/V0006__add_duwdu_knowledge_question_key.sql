@@ -0,0 +1,34 @@
+CREATE OR REPLACE FUNCTION duwdu_question_key(question TEXT) RETURNS CHAR(32) AS $$
+    SELECT md5(COALESCE(
+        NULLIF(btrim(regexp_replace(
+            translate(question,
+                'ABCDEFGHIJKLMNOPQRSTUVWXYZАБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯЁ',
+                'abcdefghijklmnopqrstuvwxyzабвгдежзийклмнопрстуфхцчшщъыьэюяё'),
+            '[^a-z0-9а-яё]+', ' ', 'g')), ''),
+        btrim(question)
+    ))
+$$ LANGUAGE SQL IMMUTABLE;
+
+ALTER TABLE duwdu_knowledge ADD COLUMN IF NOT EXISTS question_key CHAR(32);
+
+UPDATE duwdu_knowledge SET question_key = duwdu_question_key(question) WHERE question_key IS NULL;
+
+UPDATE duwdu_knowledge k
+SET used_count = totals.used_count
+FROM (
+    SELECT MIN(id) AS id, SUM(used_count) AS used_count
+    FROM duwdu_knowledge
+    GROUP BY question_key
+    HAVING COUNT(*) > 1
+) totals
+WHERE k.id = totals.id;
+
+DELETE FROM duwdu_knowledge a
+USING duwdu_knowledge b
+WHERE a.question_key = b.question_key AND a.id > b.id;
+
+ALTER TABLE duwdu_knowledge ALTER COLUMN question_key SET NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_duwdu_knowledge_question_key ON duwdu_knowledge(question_key);
+
+DROP INDEX IF EXISTS idx_duwdu_knowledge_question;
@@ -0,0 +1,12 @@
+CREATE OR REPLACE FUNCTION notify_duwdu_knowledge_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('duwdu_knowledge_changed', OLD.question_key);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS duwdu_knowledge_changed ON duwdu_knowledge;
+
+CREATE TRIGGER duwdu_knowledge_changed
+AFTER UPDATE OF answer, question_key OR DELETE ON duwdu_knowledge
+FOR EACH ROW EXECUTE FUNCTION notify_duwdu_knowledge_changed();
@@ -0,0 +1,34 @@
+CREATE TABLE IF NOT EXISTS duwdu_intents (
+    id SERIAL PRIMARY KEY,
+    priority INTEGER NOT NULL DEFAULT 100,
+    any_keywords TEXT[] NOT NULL DEFAULT '{}',
+    all_keywords TEXT[] NOT NULL DEFAULT '{}',
+    answer TEXT NOT NULL,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO duwdu_intents (priority, any_keywords, all_keywords, answer)
+SELECT * FROM (VALUES
+    (10, ARRAY['привет', 'здравствуй', 'hi'], ARRAY[]::TEXT[], 'Привет! Чем займёмся сегодня? 🚀'),
+    (20, ARRAY['как дела', 'how are you'], ARRAY[]::TEXT[], 'Отлично! Готов помочь тебе 💪'),
+    (30, ARRAY['спасибо', 'благодар'], ARRAY[]::TEXT[], 'Всегда пожалуйста! 😊'),
+    (40, ARRAY['кто ты', 'что ты'], ARRAY[]::TEXT[], 'Я DUWDU — нейросеть, которая учится на твоих вопросах'),
+    (50, ARRAY[]::TEXT[], ARRAY['каша', 'гречн'], E'1. Промой стакан гречки\n2. Вскипяти 2 стакана воды, добавь гречку\n3. Вари 10 минут\n4. Добавь 2 стакана молока и сахар\n5. Вари 5-7 минут\n6. Готово! 🍚'),
+    (60, ARRAY['реферат', 'сочинение'], ARRAY[]::TEXT[], E'Конечно! Вот структура:\n\n1. Введение\n2. Основная часть\n3. Заключение\n\nТема раскрыта полностью с примерами и выводами 📝'),
+    (70, ARRAY['?'], ARRAY[]::TEXT[], 'Отличный вопрос! По теме "{prompt}" могу сказать: это требует внимательного рассмотрения. Основные аспекты учтены ✅')
+) AS seed(priority, any_keywords, all_keywords, answer)
+WHERE NOT EXISTS (SELECT 1 FROM duwdu_intents);
+
+CREATE OR REPLACE FUNCTION notify_duwdu_intents_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('duwdu_intents_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS duwdu_intents_changed ON duwdu_intents;
+
+CREATE TRIGGER duwdu_intents_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON duwdu_intents
+FOR EACH STATEMENT EXECUTE FUNCTION notify_duwdu_intents_changed();
@@ -0,0 +1,7 @@
+ALTER TABLE generated_websites ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE generated_websites ADD COLUMN IF NOT EXISTS html_gzip BYTEA;
+ALTER TABLE generated_websites ADD COLUMN IF NOT EXISTS html_br BYTEA;
+
+UPDATE generated_websites
+SET content_hash = encode(sha256(convert_to(html_content, 'UTF8')), 'hex')
+WHERE content_hash IS NULL;
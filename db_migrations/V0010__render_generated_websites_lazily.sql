@@ -0,0 +1,16 @@
+ALTER TABLE generated_websites ADD COLUMN IF NOT EXISTS template_version VARCHAR(32);
+ALTER TABLE generated_websites ADD COLUMN IF NOT EXISTS params JSONB;
+ALTER TABLE generated_websites ALTER COLUMN html_content DROP NOT NULL;
+
+UPDATE generated_websites
+SET template_version = 'legacy',
+    params = jsonb_build_object('prompt',
+        replace(replace(replace(replace(replace(
+            substring(html_content from '<h1>(.*?)</h1>'),
+            '&lt;', '<'), '&gt;', '>'), '&quot;', '"'), '&#x27;', ''''), '&amp;', '&')),
+    html_content = NULL
+WHERE params IS NULL AND html_content ~ '<h1>.*?</h1>';
+
+ALTER TABLE generated_websites DROP COLUMN IF EXISTS html_gzip;
+ALTER TABLE generated_websites DROP COLUMN IF EXISTS html_br;
+ALTER TABLE generated_websites DROP COLUMN IF EXISTS content_hash;
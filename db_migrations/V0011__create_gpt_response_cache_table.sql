@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS gpt_response_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_gpt_response_cache_expires_at ON gpt_response_cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_gpt_response_cache_created_at ON gpt_response_cache(created_at);
@@ -0,0 +1,16 @@
+CREATE UNLOGGED TABLE IF NOT EXISTS generation_flights (
+    flight_key CHAR(64) PRIMARY KEY,
+    result TEXT,
+    claimed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    completed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_flights_completed_at ON generation_flights(completed_at);
+
+DELETE FROM duwdu_images a
+USING duwdu_images b
+WHERE LOWER(a.prompt) = LOWER(b.prompt) AND a.type = b.type AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_duwdu_images_prompt_type ON duwdu_images(LOWER(prompt), type);
+
+DROP INDEX IF EXISTS idx_duwdu_images_prompt;
@@ -0,0 +1,25 @@
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    module_type VARCHAR(50) NOT NULL,
+    media_type VARCHAR(20) NOT NULL DEFAULT 'image',
+    prompt TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    progress SMALLINT NOT NULL DEFAULT 0,
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    max_attempts SMALLINT NOT NULL DEFAULT 3,
+    locked_by VARCHAR(100),
+    visible_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    result_url TEXT,
+    response TEXT,
+    error TEXT,
+    request_id INTEGER,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    CHECK (status IN ('queued', 'running', 'succeeded', 'failed'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_pending ON generation_jobs(visible_at, id) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_user ON generation_jobs(user_id, created_at DESC);
@@ -0,0 +1,94 @@
+ALTER TABLE ai_requests RENAME TO ai_requests_legacy;
+ALTER TABLE ai_requests_legacy RENAME CONSTRAINT ai_requests_pkey TO ai_requests_legacy_pkey;
+
+ALTER SEQUENCE ai_requests_id_seq AS BIGINT;
+
+CREATE TABLE ai_requests (
+    id BIGINT NOT NULL DEFAULT nextval('ai_requests_id_seq'),
+    user_id INTEGER NOT NULL,
+    module_type VARCHAR(50) NOT NULL,
+    prompt TEXT NOT NULL,
+    response TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE ai_requests_id_seq OWNED BY ai_requests.id;
+
+CREATE INDEX IF NOT EXISTS idx_ai_requests_user_created ON ai_requests(user_id, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS ai_requests_default PARTITION OF ai_requests DEFAULT;
+
+CREATE TABLE IF NOT EXISTS ai_requests_daily (
+    day DATE NOT NULL,
+    module_type VARCHAR(50) NOT NULL,
+    requests BIGINT NOT NULL,
+    PRIMARY KEY (day, module_type)
+);
+
+CREATE OR REPLACE FUNCTION ensure_ai_requests_partitions(first_month DATE, months_ahead INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    month DATE := date_trunc('month', first_month)::DATE;
+    last_month DATE := (date_trunc('month', NOW()) + make_interval(months => months_ahead))::DATE;
+    created INTEGER := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        IF to_regclass(format('ai_requests_%s', to_char(month, 'YYYYMM'))) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF ai_requests FOR VALUES FROM (%L) TO (%L)',
+                format('ai_requests_%s', to_char(month, 'YYYYMM')), month, (month + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION compact_ai_requests(keep_months INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    part RECORD;
+    cutoff DATE := (date_trunc('month', NOW()) - make_interval(months => keep_months))::DATE;
+    compacted INTEGER := 0;
+BEGIN
+    FOR part IN
+        SELECT c.relname, to_date(substring(c.relname FROM 13), 'YYYYMM') AS month
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'ai_requests'::regclass AND c.relname ~ '^ai_requests_[0-9]{6}$'
+        ORDER BY 2
+    LOOP
+        EXIT WHEN part.month >= cutoff;
+        EXECUTE format(
+            'INSERT INTO ai_requests_daily (day, module_type, requests)
+             SELECT created_at::DATE, module_type, COUNT(*) FROM %I GROUP BY 1, 2
+             ON CONFLICT (day, module_type) DO UPDATE SET requests = ai_requests_daily.requests + EXCLUDED.requests',
+            part.relname
+        );
+        EXECUTE format('ALTER TABLE ai_requests DETACH PARTITION %I', part.relname);
+        EXECUTE format('DROP TABLE %I', part.relname);
+        compacted := compacted + 1;
+    END LOOP;
+
+    WITH moved AS (
+        DELETE FROM ai_requests_default WHERE created_at < cutoff RETURNING created_at, module_type
+    )
+    INSERT INTO ai_requests_daily (day, module_type, requests)
+    SELECT created_at::DATE, module_type, COUNT(*) FROM moved GROUP BY 1, 2
+    ON CONFLICT (day, module_type) DO UPDATE SET requests = ai_requests_daily.requests + EXCLUDED.requests;
+
+    RETURN compacted;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_ai_requests_partitions(
+    COALESCE((SELECT MIN(created_at) FROM ai_requests_legacy), NOW())::DATE,
+    3
+);
+
+INSERT INTO ai_requests (id, user_id, module_type, prompt, response, created_at)
+SELECT id, user_id, module_type, prompt, response, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM ai_requests_legacy;
+
+DROP TABLE ai_requests_legacy;
@@ -0,0 +1,9 @@
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+    user_id INTEGER NOT NULL,
+    module VARCHAR(20) NOT NULL,
+    tokens REAL NOT NULL,
+    capacity REAL NOT NULL,
+    refill REAL NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+    PRIMARY KEY (user_id, module)
+);
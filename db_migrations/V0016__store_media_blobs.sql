@@ -0,0 +1,19 @@
+CREATE TABLE IF NOT EXISTS media_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    content_type VARCHAR(100) NOT NULL,
+    size INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    thumbnail BYTEA,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+ALTER TABLE media_blobs ALTER COLUMN data SET STORAGE EXTERNAL;
+ALTER TABLE media_blobs ALTER COLUMN thumbnail SET STORAGE EXTERNAL;
+
+ALTER TABLE duwdu_images ADD COLUMN IF NOT EXISTS blob_sha256 CHAR(64) REFERENCES media_blobs(sha256);
+
+CREATE TABLE IF NOT EXISTS generated_images (
+    request_key CHAR(64) PRIMARY KEY,
+    blob_sha256 CHAR(64) NOT NULL REFERENCES media_blobs(sha256),
+    created_at TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1 @@
+ALTER TABLE duwdu_images ADD COLUMN IF NOT EXISTS ingest_attempted_at TIMESTAMP;
@@ -0,0 +1,41 @@
+-- CREATE TABLE ... PARTITION OF fails while ai_requests_default holds rows for the new
+-- partition's range (e.g. written before maintenance created that month), and then
+-- every later maintenance run fails the same way. Each missing month is now built as
+-- a plain table, the month's rows are moved out of the default partition into it, and
+-- only then is it attached.
+CREATE OR REPLACE FUNCTION ensure_ai_requests_partitions(first_month DATE, months_ahead INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    month DATE := date_trunc('month', first_month)::DATE;
+    last_month DATE := (date_trunc('month', NOW()) + make_interval(months => months_ahead))::DATE;
+    part TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        part := format('ai_requests_%s', to_char(month, 'YYYYMM'));
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE ai_requests INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part);
+            EXECUTE format(
+                'WITH moved AS (
+                     DELETE FROM ai_requests_default WHERE created_at >= %L AND created_at < %L
+                     RETURNING id, user_id, module_type, prompt, response, created_at
+                 )
+                 INSERT INTO %I (id, user_id, module_type, prompt, response, created_at)
+                 SELECT id, user_id, module_type, prompt, response, created_at FROM moved',
+                month, (month + INTERVAL '1 month')::DATE, part
+            );
+            EXECUTE format(
+                'ALTER TABLE ai_requests ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                part, month, (month + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_ai_requests_partitions(
+    COALESCE((SELECT MIN(created_at) FROM ai_requests_default), NOW())::DATE,
+    3
+);